@@ -2,9 +2,13 @@
 What is necessary to grade a single assignment.
 """
 
+import concurrent.futures
 import datetime
+import os
+import time
 
-from cse40.question import Question
+import cse40.metrics
+from cse40.question import Question, CACHE_POLICIES, CACHE_SANITIZED
 
 PRETTY_TIMESTEMP_FORMAT = '%Y-%m-%d %H:%M'
 
@@ -13,24 +17,101 @@ class Assignment(object):
     A collection of questions to be scored.
     """
 
-    def __init__(self, name, questions):
+    def __init__(self, name, questions, cpu_limit = None, memory_limit = None):
+        """
+        The CPU (seconds) and memory (bytes) limits are defaults
+        for questions that do not set their own (see cse40.question.Question).
+        """
+
         self._name = name
         self._questions = questions
 
+        for question in self._questions:
+            if (question.cpu_limit is None):
+                question.cpu_limit = cpu_limit
+
+            if (question.memory_limit is None):
+                question.memory_limit = memory_limit
+
         self._grading_start = None
         self._grading_end = None
 
-    def grade(self, submission, additional_data = {}, show_exceptions = False):
+        # {stage: seconds} (see cse40.metrics).
+        self._timings = {}
+
+    def grade(self, submission, additional_data = {}, show_exceptions = False,
+            parallel = False, workers = None):
+        """
+        Grade all the questions and return the total score.
+        If parallel is true, then questions will be graded concurrently
+        using at most |workers| (default: the number of CPUs) at a time.
+        Regardless of the order questions finish in, they will be reported in their original order.
+
+        Stage timings (see cse40.metrics) will be recorded for the questions,
+        as well as any stages that ran on this thread since the last grading
+        (e.g. extracting and sanitizing the submission).
+
+        See grade_iter() to get each question as soon as it is graded.
+        """
+
+        for _ in self.grade_iter(submission, additional_data = additional_data,
+                show_exceptions = show_exceptions, parallel = parallel, workers = workers):
+            pass
+
+        return self.get_score()[0]
+
+    def grade_iter(self, submission, additional_data = {}, show_exceptions = False,
+            parallel = False, workers = None):
+        """
+        The same as grade(), but yield each question as soon as it has been graded.
+        When grading in parallel, questions are yielded in the order they finish.
+        The grading is only finished (e.g. the end time and timings are set)
+        once the generator is exhausted.
+        """
+
+        self._timings = cse40.metrics.collect()
+        start_time = time.perf_counter()
+
         self._grading_start = datetime.datetime.now().strftime(PRETTY_TIMESTEMP_FORMAT)
-        score = 0
 
-        for question in self._questions:
-            score += question.grade(submission, additional_data = additional_data,
-                show_exceptions = show_exceptions)
+        if (parallel):
+            yield from self._grade_parallel(submission, additional_data, show_exceptions, workers)
+        else:
+            for question in self._questions:
+                question.grade(submission, additional_data = additional_data,
+                    show_exceptions = show_exceptions)
+                yield question
 
         self._grading_end = datetime.datetime.now().strftime(PRETTY_TIMESTEMP_FORMAT)
 
-        return score
+        for question in self._questions:
+            for (stage, seconds) in question.timings.items():
+                self._timings[stage] = self._timings.get(stage, 0.0) + seconds
+
+        total_time = time.perf_counter() - start_time
+        self._timings[cse40.metrics.STAGE_TOTAL] = total_time
+        cse40.metrics.record(cse40.metrics.STAGE_TOTAL, total_time, pending = False)
+
+    def _grade_parallel(self, submission, additional_data, show_exceptions, workers):
+        """
+        Each question already runs in its own process (see cse40.utils.invoke_with_timeout),
+        so threads are only used to wait on those processes.
+        Questions are yielded as they finish.
+        """
+
+        if (workers is None):
+            workers = os.cpu_count() or 1
+
+        workers = max(1, min(workers, len(self._questions)))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = workers) as executor:
+            futures = {executor.submit(question.grade, submission,
+                    additional_data = additional_data, show_exceptions = show_exceptions): question
+                    for question in self._questions}
+
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+                yield futures[future]
 
     def get_score(self):
         """
@@ -46,7 +127,26 @@ class Assignment(object):
 
         return (total_score, max_score)
 
-    def report(self, question_prefix = ''):
+    def get_cache_policy(self):
+        """
+        Get the strictest cache policy of all the questions (see cse40.question.CACHE_POLICIES).
+        """
+
+        policy = CACHE_SANITIZED
+        for question in self._questions:
+            policy = max(policy, question.cache_policy, key = CACHE_POLICIES.index)
+
+        return policy
+
+    def get_timings(self):
+        """
+        Get the time (in seconds) spent in each stage of the last grading (see cse40.metrics).
+        Note that questions graded in parallel may add up to more than the total.
+        """
+
+        return dict(self._timings)
+
+    def report(self, question_prefix = '', show_timings = False):
         """
         Return a string representation of the grading for this assignment.
         """
@@ -68,6 +168,18 @@ class Assignment(object):
         output.append('')
         output.append("Total: %d / %d" % (total_score, max_score))
 
+        if (show_timings):
+            output.append('')
+            output.append('Timings:')
+
+            for (stage, seconds) in sorted(self._timings.items()):
+                output.append("   %s: %.3fs" % (stage, seconds))
+
+            for question in self._questions:
+                timings = ', '.join(["%s: %.3fs" % (stage, seconds)
+                        for (stage, seconds) in sorted(question.timings.items())])
+                output.append("   %s -- %s" % (question.name, timings))
+
         return "\n".join(output)
 
     def __eq__(self, other):
@@ -90,6 +202,7 @@ class Assignment(object):
             'start': self._grading_start,
             'end': self._grading_end,
             'questions': [question.to_dict() for question in self._questions],
+            'timings': self._timings,
         }
 
     @staticmethod
@@ -104,5 +217,6 @@ class Assignment(object):
 
         assignment._grading_start = data['start']
         assignment._grading_end = data['end']
+        assignment._timings = data.get('timings', {})
 
         return assignment
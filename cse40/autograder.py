@@ -5,39 +5,54 @@ An interface for interacting with the autograder (submitting assignments, queryi
 import argparse
 import datetime
 import json
+import os
 import sys
-import urllib.request
 
 import cse40.assignment
-import cse40.code
+import cse40.client
 
-ENCODING = 'utf-8'
+ENCODING = cse40.client.ENCODING
 DEFAULT_CONFIG_PATH = 'config.json'
 DEFAULT_SUBMISSION_PATH = 'assignment.ipynb'
-DEFAULT_AUTOGRADER_URL = 'http://sozopol.soe.ucsc.edu:12345'
+DEFAULT_AUTOGRADER_URL = cse40.client.DEFAULT_AUTOGRADER_URL
+DEFAULT_TIMEOUT_SEC = cse40.client.DEFAULT_TIMEOUT_SEC
 
-TASK_HISTORY = 'history'
-TASK_REPEAT = 'repeat'
-TASK_SUBMIT = 'submit'
-TASKS = [TASK_HISTORY, TASK_REPEAT, TASK_SUBMIT]
+TASK_HISTORY = cse40.client.TASK_HISTORY
+TASK_REPEAT = cse40.client.TASK_REPEAT
+TASK_SUBMIT = cse40.client.TASK_SUBMIT
+TASKS = cse40.client.TASKS
 
 DATETIME_FORMAT = '%Y-%m-%d %H:%M'
 
-def request_history(config_path = DEFAULT_CONFIG_PATH, autograde_url = DEFAULT_AUTOGRADER_URL):
-    with open(config_path, 'r') as file:
-        config = json.load(file)
+# {absolute path: ((mtime, size), config), ...}
+_config_cache = {}
 
-    config['task'] = TASK_HISTORY
+def request_history(config_path = DEFAULT_CONFIG_PATH, autograde_url = DEFAULT_AUTOGRADER_URL,
+        use_cache = True, page_size = None):
+    """
+    If |use_cache| is true, then the history is cached locally
+    and only new rows are requested from the server.
+    See cse40.client.HistoryFetch.
+    """
 
-    body, message = _send_request(config, autograde_url)
-    if (body is None):
-        return (False, message)
+    cache = None
+    if (use_cache):
+        cache = cse40.client.get_history_cache()
+
+    fetch = cse40.client.HistoryFetch(_load_config(config_path), autograde_url,
+            cache = cache, page_size = page_size)
+
+    while (fetch.request is not None):
+        body, message = _send_request(fetch.request, autograde_url)
+        if (body is None):
+            return (False, message)
 
-    return (True, body['history'])
+        fetch.handle(body)
+
+    return (True, fetch.get_history())
 
 def request_repeat(config_path = DEFAULT_CONFIG_PATH, autograde_url = DEFAULT_AUTOGRADER_URL):
-    with open(config_path, 'r') as file:
-        config = json.load(file)
+    config = _load_config(config_path)
 
     config['task'] = TASK_REPEAT
 
@@ -48,11 +63,28 @@ def request_repeat(config_path = DEFAULT_CONFIG_PATH, autograde_url = DEFAULT_AU
     return (True, cse40.assignment.Assignment.from_dict(body['assignment']))
 
 def request_submit(config_path = DEFAULT_CONFIG_PATH, submission_path = DEFAULT_SUBMISSION_PATH,
-        autograde_url = DEFAULT_AUTOGRADER_URL):
+        autograde_url = DEFAULT_AUTOGRADER_URL, delta = False, on_question = None,
+        compress = False):
+    """
+    If |delta| is true, then the code will only be uploaded if the server has not seen it before.
+    If |on_question| is given, then it will be called with each question as soon as it is graded.
+    If |compress| is true, then the code will be gzipped (the server must support it).
+    See cse40.client.Client.submit().
+    """
+
+    # Extracting code is only needed for submissions, so it is loaded on demand.
+    import cse40.code
+
     source_code = cse40.code.extract_code(submission_path)
+    config = _load_config(config_path)
+
+    if (delta or (on_question is not None) or compress):
+        async def submit():
+            async with cse40.client.Client(autograde_url, compress = compress) as client:
+                return await client.submit(config, source_code, delta = delta,
+                        on_question = on_question)
 
-    with open(config_path, 'r') as file:
-        config = json.load(file)
+        return cse40.client.run(cse40.client.capture(submit()))
 
     config['task'] = TASK_SUBMIT
     config['code'] = source_code
@@ -63,6 +95,73 @@ def request_submit(config_path = DEFAULT_CONFIG_PATH, submission_path = DEFAULT_
 
     return (True, cse40.assignment.Assignment.from_dict(body['assignment']))
 
+def request_history_many(config_paths, autograde_url = DEFAULT_AUTOGRADER_URL,
+        max_connections = cse40.client.DEFAULT_MAX_CONNECTIONS, timeout = DEFAULT_TIMEOUT_SEC,
+        use_cache = True, page_size = None):
+    """
+    The same as request_history(), but for many configs at once (see cse40.client).
+    Return a list of (success, history or message) in the same order as |config_paths|.
+    """
+
+    configs = [_load_config(config_path) for config_path in config_paths]
+
+    cache = None
+    if (use_cache):
+        cache = cse40.client.get_history_cache()
+
+    return cse40.client.run(cse40.client.history_many(configs, autograde_url,
+            max_connections = max_connections, timeout = timeout,
+            cache = cache, page_size = page_size))
+
+def request_repeat_many(config_paths, autograde_url = DEFAULT_AUTOGRADER_URL,
+        max_connections = cse40.client.DEFAULT_MAX_CONNECTIONS, timeout = DEFAULT_TIMEOUT_SEC):
+    """
+    The same as request_repeat(), but for many configs at once (see cse40.client).
+    Return a list of (success, assignment or message) in the same order as |config_paths|.
+    """
+
+    configs = [_load_config(config_path) for config_path in config_paths]
+
+    return cse40.client.run(cse40.client.repeat_many(configs, autograde_url,
+            max_connections = max_connections, timeout = timeout))
+
+def request_submit_many(submissions, autograde_url = DEFAULT_AUTOGRADER_URL,
+        max_connections = cse40.client.DEFAULT_MAX_CONNECTIONS, timeout = DEFAULT_TIMEOUT_SEC,
+        delta = False, compress = False):
+    """
+    The same as request_submit(), but for many (config path, submission path) pairs at once
+    (see cse40.client).
+    Return a list of (success, assignment or message) in the same order as |submissions|.
+    """
+
+    import cse40.code
+
+    pairs = [(_load_config(config_path), cse40.code.extract_code(submission_path))
+            for (config_path, submission_path) in submissions]
+
+    return cse40.client.run(cse40.client.submit_many(pairs, autograde_url,
+            max_connections = max_connections, timeout = timeout, delta = delta,
+            compress = compress))
+
+def _load_config(config_path):
+    """
+    Load a config, only re-reading the file if it has changed.
+    A new copy is returned each time, so callers are free to modify it.
+    """
+
+    path = os.path.abspath(config_path)
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _config_cache.get(path)
+    if ((cached is None) or (cached[0] != version)):
+        with open(path, 'r') as file:
+            cached = (version, json.load(file))
+
+        _config_cache[path] = cached
+
+    return dict(cached[1])
+
 def _history(arguments):
     (success, result) = request_history(arguments.config_path, arguments.server)
 
@@ -96,8 +195,23 @@ def _repeat(arguments):
     return 0
 
 def _submit(arguments):
+    # Questions that have already been shown as they were graded.
+    streamed = []
+
+    def show_question(question):
+        if (len(streamed) == 0):
+            print('The autograder is grading your assignment:')
+
+        print(question.scoring_report(), flush = True)
+        streamed.append(question)
+
+    on_question = None
+    if (arguments.stream):
+        on_question = show_question
+
     (success, result) = request_submit(arguments.config_path, arguments.submission_path,
-            arguments.server)
+            arguments.server, delta = arguments.delta, on_question = on_question,
+            compress = arguments.compress)
 
     if (not success):
         print('The autograder failed to grade your assignment.')
@@ -105,24 +219,24 @@ def _submit(arguments):
         return 1
 
     print('The autograder successfully graded your assignment.')
-    print(result.report())
-
-    return 0
 
-def _send_request(config, autograde_url):
-    payload = bytes(json.dumps(config), ENCODING)
-    raw_response = urllib.request.urlopen(autograde_url, data = payload)
-
-    status = raw_response.status
-    if (status != 200):
-        return None, "Got a failure status from the autograding server: %s." % (status)
+    if (len(streamed) > 0):
+        # Every question was already shown, so just finish with the total.
+        print("Total: %d / %d" % result.get_score())
+    else:
+        print(result.report())
 
-    body = json.loads(raw_response.read().decode(encoding = ENCODING))
+    return 0
 
-    if (body['status'] != 'success'):
-        return (None, body['message'])
+def _send_request(config, autograde_url, timeout = DEFAULT_TIMEOUT_SEC):
+    async def send():
+        try:
+            async with cse40.client.Client(autograde_url, timeout = timeout) as client:
+                return await client.send(config)
+        except cse40.client.REQUEST_ERRORS as ex:
+            return (None, cse40.client.describe_error(ex))
 
-    return body, None
+    return cse40.client.run(send())
 
 def main(arguments):
     if (arguments.task == TASK_HISTORY):
@@ -154,6 +268,18 @@ def _load_args():
         action = 'store', type = str, default = DEFAULT_AUTOGRADER_URL,
         help = 'The URL of the server to submit to (default: %(default)s).')
 
+    parser.add_argument('--delta', dest = 'delta',
+        action = 'store_true', default = False,
+        help = 'Only upload your code if the server has not already seen it.')
+
+    parser.add_argument('--compress', dest = 'compress',
+        action = 'store_true', default = False,
+        help = 'Compress your code when uploading it (the server must support this).')
+
+    parser.add_argument('--no-stream', dest = 'stream',
+        action = 'store_false', default = True,
+        help = 'Wait for the whole assignment to be graded before showing any results.')
+
     return parser.parse_args()
 
 if (__name__ == '__main__'):
@@ -0,0 +1,273 @@
+"""
+Grade a directory of submissions with a single grader.
+Submissions are graded across a pool of processes,
+and one JSON object (line) is output for each submission as soon as it finishes.
+"""
+
+import argparse
+import concurrent.futures
+import heapq
+import json
+import os
+import sys
+import time
+import traceback
+
+import cse40.cache
+import cse40.code
+import cse40.metrics
+import cse40.utils
+
+SUBMISSION_EXTENSIONS = ['.py', '.ipynb']
+DEFAULT_SLOWEST_COUNT = 10
+
+# ProcessPoolExecutor can only replace workers (max_tasks_per_child) on Python 3.11+.
+_SUPPORTS_MAX_TASKS_PER_CHILD = (sys.version_info >= (3, 11))
+
+# The grader (and optional result cache) loaded into each worker process (see _init_worker()).
+_grader = None
+_grader_fingerprint = None
+_cache = None
+
+def _init_worker(grader_path, warm_up, cache_dir, cache_size):
+    global _grader, _grader_fingerprint, _cache
+
+    if (warm_up):
+        cse40.utils.warm_up()
+
+    _grader = cse40.code.import_path(grader_path)
+    # Grades also depend on this package (e.g. how questions are scored).
+    _grader_fingerprint = cse40.cache.hash_text(cse40.cache.hash_file(grader_path),
+            cse40.cache.get_package_fingerprint())
+
+    if (cache_dir is not None):
+        _cache = cse40.cache.GradingCache(cache_dir, max_bytes = cache_size)
+
+def _grade_submission(path):
+    """
+    Grade a single submission inside a worker.
+    Only simple structures are returned (so they can be cheaply passed back to the parent).
+    """
+
+    start_time = time.time()
+
+    try:
+        # Timings (e.g. extraction) only count towards this submission.
+        with cse40.metrics.scope():
+            source_code = None
+            source_hash = None
+            cached = None
+
+            if (_cache is not None):
+                source_code = cse40.code.extract_code(path)
+
+                # Extracted code has its whitespace stripped, but e.g. style depends on it.
+                source_hash = cse40.cache.hash_source(path)
+                cached = _cache.get(source_code, _grader_fingerprint, source_hash = source_hash)
+
+            if (cached is not None):
+                assignment_dict = cached
+            else:
+                # Anything the grader leaves in temp paths is removed with the submission.
+                with cse40.utils.Workspace():
+                    assignment = _grader.grade(path)
+
+                assignment_dict = assignment.to_dict()
+
+                if (_cache is not None):
+                    _cache.put(source_code, _grader_fingerprint, assignment,
+                            source_hash = source_hash)
+
+            result = {
+                'path': path,
+                'status': 'success',
+                'cached': (cached is not None),
+                'assignment': assignment_dict,
+            }
+    except Exception:
+        result = {
+            'path': path,
+            'status': 'error',
+            'message': traceback.format_exc(),
+        }
+
+    result['runtime'] = time.time() - start_time
+
+    return result
+
+def find_submissions(submissions_dir):
+    """
+    Get the (sorted) paths to all the submissions in a directory.
+    """
+
+    paths = []
+    for dirent in os.scandir(submissions_dir):
+        if (dirent.is_file() and (os.path.splitext(dirent.name)[1] in SUBMISSION_EXTENSIONS)):
+            paths.append(dirent.path)
+
+    return sorted(paths)
+
+def grade_paths(grader_path, paths, workers = None, max_pending = None,
+        warm_up = True, max_tasks_per_child = None,
+        cache_dir = None, cache_size = cse40.cache.DEFAULT_MAX_BYTES):
+    """
+    Grade each submission in |paths| using the grade() function from |grader_path|,
+    and yield a result dict (see _grade_submission()) for each one as soon as it is graded.
+    At most |max_pending| (default: twice the number of workers) submissions
+    will be in-flight at any time, so memory is bounded regardless of the number of submissions.
+    If |cache_dir| is given, then results will be reused for equivalent submissions
+    (see cse40.cache.GradingCache).
+    """
+
+    if (workers is None):
+        workers = os.cpu_count() or 1
+
+    if (max_pending is None):
+        max_pending = 2 * workers
+
+    pool_options = {
+        'max_workers': workers,
+        'initializer': _init_worker,
+        'initargs': (os.path.abspath(grader_path), warm_up, cache_dir, cache_size),
+    }
+
+    # Before that is supported, workers just live as long as the pool.
+    if ((max_tasks_per_child is not None) and _SUPPORTS_MAX_TASKS_PER_CHILD):
+        pool_options['max_tasks_per_child'] = max_tasks_per_child
+
+    with concurrent.futures.ProcessPoolExecutor(**pool_options) as executor:
+        pending = set()
+
+        for path in paths:
+            if (len(pending) >= max_pending):
+                done, pending = concurrent.futures.wait(pending,
+                        return_when = concurrent.futures.FIRST_COMPLETED)
+
+                for future in done:
+                    yield future.result()
+
+            pending.add(executor.submit(_grade_submission, path))
+
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+def grade_dir(grader_path, submissions_dir, output = sys.stdout, workers = None,
+        max_pending = None, slowest_count = DEFAULT_SLOWEST_COUNT,
+        warm_up = True, max_tasks_per_child = None,
+        cache_dir = None, cache_size = cse40.cache.DEFAULT_MAX_BYTES):
+    """
+    Grade every submission in |submissions_dir| (see grade_paths()).
+    A JSON line will be written to |output| for each submission as soon as it is graded.
+
+    Return a dict of summary statistics.
+    """
+
+    stats = {
+        'count': 0,
+        'errors': 0,
+        # A min-heap of (runtime, path), so the fastest of the slow is easy to replace.
+        'slowest': [],
+    }
+
+    start_time = time.time()
+
+    results = grade_paths(grader_path, find_submissions(submissions_dir), workers = workers,
+            max_pending = max_pending, warm_up = warm_up,
+            max_tasks_per_child = max_tasks_per_child,
+            cache_dir = cache_dir, cache_size = cache_size)
+
+    for result in results:
+        _handle_result(result, output, stats, slowest_count)
+
+    runtime = time.time() - start_time
+
+    return {
+        'count': stats['count'],
+        'errors': stats['errors'],
+        'runtime': runtime,
+        'throughput': stats['count'] / max(runtime, 1e-9),
+        'slowest': sorted(stats['slowest'], reverse = True),
+    }
+
+def _handle_result(result, output, stats, slowest_count):
+    output.write(json.dumps(result) + "\n")
+    output.flush()
+
+    stats['count'] += 1
+    if (result['status'] != 'success'):
+        stats['errors'] += 1
+
+    entry = (result['runtime'], result['path'])
+    if (len(stats['slowest']) < slowest_count):
+        heapq.heappush(stats['slowest'], entry)
+    elif (slowest_count > 0):
+        heapq.heappushpop(stats['slowest'], entry)
+
+def main(arguments):
+    output = sys.stdout
+    if (arguments.output_path is not None):
+        output = open(arguments.output_path, 'w')
+
+    try:
+        stats = grade_dir(arguments.grader_path, arguments.submissions_dir, output = output,
+                workers = arguments.workers, slowest_count = arguments.slowest,
+                warm_up = arguments.warm_up, max_tasks_per_child = arguments.max_tasks_per_child,
+                cache_dir = arguments.cache_dir, cache_size = arguments.cache_size)
+    finally:
+        if (output is not sys.stdout):
+            output.close()
+
+    print("Graded %d submissions (%d errors) in %.2f seconds (%.2f submissions/sec)." % (
+        stats['count'], stats['errors'], stats['runtime'], stats['throughput']), file = sys.stderr)
+
+    if (len(stats['slowest']) > 0):
+        print('Slowest submissions:', file = sys.stderr)
+        for runtime, path in stats['slowest']:
+            print("    %8.2fs -- %s" % (runtime, path), file = sys.stderr)
+
+    return int(stats['errors'] > 0)
+
+def _load_args():
+    parser = argparse.ArgumentParser(description = 'Grade a directory of submissions.')
+
+    parser.add_argument('grader_path',
+        action = 'store', type = str,
+        help = 'The grader to use (must have a grade(path) function that returns an Assignment).')
+
+    parser.add_argument('submissions_dir',
+        action = 'store', type = str,
+        help = 'The directory of submissions (.py or .ipynb) to grade.')
+
+    parser.add_argument('--workers', dest = 'workers',
+        action = 'store', type = int, default = None,
+        help = 'The number of grading processes to use (default: the number of CPUs).')
+
+    parser.add_argument('--output', dest = 'output_path',
+        action = 'store', type = str, default = None,
+        help = 'Write JSON lines here instead of stdout.')
+
+    parser.add_argument('--slowest', dest = 'slowest',
+        action = 'store', type = int, default = DEFAULT_SLOWEST_COUNT,
+        help = 'The number of slowest submissions to report (default: %(default)s).')
+
+    parser.add_argument('--no-warm-up', dest = 'warm_up',
+        action = 'store_false', default = True,
+        help = 'Do not pre-import heavy modules in each worker (see cse40.utils.warm_up()).')
+
+    parser.add_argument('--max-tasks-per-child', dest = 'max_tasks_per_child',
+        action = 'store', type = int, default = None,
+        help = 'Replace each worker after this many submissions to release memory'
+            + ' (ignored before Python 3.11).')
+
+    parser.add_argument('--cache-dir', dest = 'cache_dir',
+        action = 'store', type = str, default = None,
+        help = 'Reuse results for equivalent submissions using a cache in this directory.')
+
+    parser.add_argument('--cache-size', dest = 'cache_size',
+        action = 'store', type = int, default = cse40.cache.DEFAULT_MAX_BYTES,
+        help = 'The maximum size (in bytes) of the result cache (default: %(default)s).')
+
+    return parser.parse_args()
+
+if (__name__ == '__main__'):
+    sys.exit(main(_load_args()))
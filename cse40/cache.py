@@ -0,0 +1,301 @@
+"""
+On-disk caches for expensive results (e.g. grading).
+Entries are JSON files keyed by a content hash and are evicted least-recently-used first
+once the cache grows past its size limit.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import uuid
+
+import cse40.question
+
+ENCODING = 'utf-8'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+ENTRY_SUFFIX = '.json'
+
+CACHE_DIR_ENV = 'CSE40_CACHE_DIR'
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_package_fingerprint = None
+
+def get_cache_dir(name):
+    """
+    Get the default directory for a named cache.
+    The base directory can be set with the CSE40_CACHE_DIR environmental variable,
+    otherwise it will be inside the user's cache directory.
+    """
+
+    base_dir = os.environ.get(CACHE_DIR_ENV)
+    if (base_dir is None):
+        base_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        base_dir = os.path.join(base_dir, 'cse40')
+
+    return os.path.join(base_dir, name)
+
+def hash_text(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(part.encode(ENCODING))
+        # Separate the parts so ('ab', 'c') and ('a', 'bc') do not collide.
+        hasher.update(b'\0')
+
+    return hasher.hexdigest()
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b''):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+def hash_dir(path, extension = '.py'):
+    """
+    Hash all the files (with |extension|) in a directory tree, along with their relative paths.
+    """
+
+    paths = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if (filename.endswith(extension)):
+                paths.append(os.path.join(dirpath, filename))
+
+    parts = []
+    for file_path in paths:
+        parts += [os.path.relpath(file_path, path), hash_file(file_path)]
+
+    return hash_text(*parts)
+
+def get_package_fingerprint():
+    """
+    Get a hash of this package's source (see hash_dir()).
+    Include it in cache keys for results that depend on this package (e.g. grading),
+    so results from a different version of the package are not reused.
+    """
+
+    global _package_fingerprint
+
+    if (_package_fingerprint is None):
+        _package_fingerprint = hash_dir(PACKAGE_DIR)
+
+    return _package_fingerprint
+
+def hash_source(path):
+    """
+    Hash the exact source that source-dependent questions (e.g. style) see:
+    the raw bytes of a .py file, or the code cells of a notebook.
+    Unlike cse40.code.extract_code(), no whitespace is stripped.
+    """
+
+    if (path.endswith('.ipynb')):
+        # Loaded on demand, so using other caches (e.g. history) stays cheap.
+        import cse40.code
+
+        return hash_text(json.dumps(cse40.code.extract_notebook_cells(path)))
+
+    return hash_file(path)
+
+class DiskCache(object):
+    """
+    A directory of JSON entries with size-based LRU eviction.
+    Entries can also be raw bytes (see get_bytes()/put_bytes()),
+    in which case a different |suffix| should be used.
+    Reads touch an entry's mtime, so the oldest mtime is the least recently used.
+    Safe to share between processes: writes are atomic and a missing entry is just a miss.
+    """
+
+    def __init__(self, cache_dir, max_bytes = DEFAULT_MAX_BYTES, suffix = ENTRY_SUFFIX):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._suffix = suffix
+
+        # An estimate of the cache size (other processes may also be writing),
+        # lazily computed on the first write.
+        self._size = None
+
+        os.makedirs(self._cache_dir, exist_ok = True)
+
+    def get(self, key):
+        """
+        Return the stored value, or None on a miss.
+        """
+
+        data = self.get_bytes(key)
+        if (data is None):
+            return None
+
+        try:
+            return json.loads(data.decode(ENCODING))
+        except ValueError:
+            return None
+
+    def put(self, key, value):
+        self.put_bytes(key, json.dumps(value).encode(ENCODING))
+
+    def get_bytes(self, key):
+        """
+        Return the stored raw bytes, or None on a miss.
+        """
+
+        path = self._path(key)
+
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        return data
+
+    def put_bytes(self, key, data):
+        path = self._path(key)
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+
+        os.replace(temp_path, path)
+
+        if (self._size is None):
+            self._size = self._compute_size()
+        else:
+            self._size += len(data)
+
+        if (self._size > self._max_bytes):
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in its size limit.
+        """
+
+        entries = []
+        for dirent in os.scandir(self._cache_dir):
+            if (not dirent.name.endswith(self._suffix)):
+                continue
+
+            try:
+                stat = dirent.stat()
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, dirent.path))
+
+        entries.sort()
+        size = sum([entry[1] for entry in entries])
+
+        for _, entry_size, path in entries:
+            if (size <= self._max_bytes):
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            size -= entry_size
+
+        self._size = size
+
+    def _compute_size(self):
+        size = 0
+        for dirent in os.scandir(self._cache_dir):
+            if (dirent.name.endswith(self._suffix)):
+                try:
+                    size += dirent.stat().st_size
+                except OSError:
+                    pass
+
+        return size
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, key + self._suffix)
+
+class GradingCache(object):
+    """
+    A cache of graded assignments (see cse40.assignment.Assignment.to_dict()).
+    Entries are keyed by the grader's fingerprint and the sanitized AST of the submission,
+    so resubmissions that only differ in whitespace, comments,
+    or removed top-level code (see cse40.code.sanitize_code()) will hit.
+    Assignments with questions that depend on the exact source (CACHE_SOURCE)
+    only hit when the source is also identical (see hash_source()),
+    and assignments with non-deterministic questions (CACHE_NEVER) are never stored.
+    """
+
+    def __init__(self, cache_dir = None, max_bytes = DEFAULT_MAX_BYTES):
+        if (cache_dir is None):
+            cache_dir = get_cache_dir('grading')
+
+        self._cache = DiskCache(cache_dir, max_bytes = max_bytes)
+
+    def get(self, source_code, fingerprint, source_hash = None):
+        """
+        Return the cached assignment dict, or None on a miss.
+        |source_hash| identifies the exact source (see hash_source()),
+        and defaults to a hash of |source_code|.
+        """
+
+        if (source_hash is None):
+            source_hash = hash_text(source_code)
+
+        key = self._key(source_code, fingerprint)
+        if (key is None):
+            return None
+
+        entry = self._cache.get(key)
+        if (entry is None):
+            return None
+
+        if ((entry['policy'] == cse40.question.CACHE_SOURCE)
+                and (entry['source'] != source_hash)):
+            return None
+
+        return entry['assignment']
+
+    def put(self, source_code, fingerprint, assignment, source_hash = None):
+        """
+        Store a graded assignment (see get() for |source_hash|).
+        Return True if the assignment was stored.
+        """
+
+        if (source_hash is None):
+            source_hash = hash_text(source_code)
+
+        policy = assignment.get_cache_policy()
+        if (policy == cse40.question.CACHE_NEVER):
+            return False
+
+        key = self._key(source_code, fingerprint)
+        if (key is None):
+            return False
+
+        entry = {
+            'policy': policy,
+            'source': source_hash,
+            'assignment': assignment.to_dict(),
+        }
+
+        self._cache.put(key, entry)
+        return True
+
+    def _key(self, source_code, fingerprint):
+        # Loaded on demand, so using other caches (e.g. history) stays cheap.
+        import cse40.code
+
+        try:
+            module_ast = cse40.code.sanitize_code(source_code)
+        except (SyntaxError, ValueError):
+            # Let the grader deal with (and report) broken code.
+            return None
+
+        return hash_text(fingerprint, ast.dump(module_ast))
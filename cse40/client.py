@@ -0,0 +1,647 @@
+"""
+An asyncio client for the autograding server (see cse40.autograder).
+Connections are kept alive and reused, the number of concurrent requests is bounded,
+and the network can only stay idle for so long (see Client).
+This makes it cheap to issue many requests at once (e.g. the history for a whole class).
+
+Large request bodies can be gzipped (this is opt-in, since not every server supports it),
+and submissions can be sent as a delta: just the hash of the code,
+with the code itself only uploaded if the server has not already seen it.
+Submissions can also be streamed: the server sends back newline-delimited JSON
+with a line for each question as soon as it is graded, followed by the usual response.
+
+History can be cached locally (see HistoryFetch), so repeated requests
+only get back the rows that are new (or nothing at all if there are none).
+"""
+
+import asyncio
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import ssl
+import urllib.parse
+
+import cse40.assignment
+import cse40.cache
+import cse40.question
+
+ENCODING = 'utf-8'
+DEFAULT_AUTOGRADER_URL = 'http://sozopol.soe.ucsc.edu:12345'
+DEFAULT_MAX_CONNECTIONS = 8
+DEFAULT_TIMEOUT_SEC = 60
+
+# Grading can take arbitrarily long, so by default there is no limit on waiting for it.
+DEFAULT_SUBMIT_TIMEOUT_SEC = None
+
+TASK_HISTORY = 'history'
+TASK_REPEAT = 'repeat'
+TASK_SUBMIT = 'submit'
+TASKS = [TASK_HISTORY, TASK_REPEAT, TASK_SUBMIT]
+
+# The status a server responds with to a delta submission for code it has not seen.
+STATUS_NEED_CODE = 'need-code'
+
+# Bodies smaller than this are not worth compressing.
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+HTTP_UNSUPPORTED_MEDIA_TYPE = 415
+
+# The content type of streamed responses (one JSON object per line).
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+HISTORY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+MAX_LINE_BYTES = 64 * 1024
+
+# Errors from talking to a server that are reported as a failed result (see describe_error()).
+# Note that timeouts are also OSErrors.
+REQUEST_ERRORS = (OSError, EOFError, ValueError)
+
+class _StaleConnection(ConnectionError):
+    """
+    A kept-alive connection was closed by the server before it answered.
+    """
+
+    pass
+
+class Client(object):
+    """
+    A pool of keep-alive HTTP/1.1 connections to a single autograding server.
+    At most |max_connections| requests will be in-flight at once.
+    Each network operation (connecting, sending, and each read of a response)
+    is limited to |timeout| seconds of inactivity (so a slow but steady response is fine).
+    Reading the response to a submission (which includes waiting for it to be graded)
+    is instead limited to |submit_timeout| seconds of inactivity (None for no limit).
+    If |compress| is true, then large request bodies will be gzipped
+    until the server says (with a 415) that it does not support them.
+    Only turn this on for servers known to accept compressed bodies (e.g. cse40.server),
+    other servers may just fail the request.
+    A client should only be used inside a single event loop, e.g.:
+
+        async with Client(url) as client:
+            results = await asyncio.gather(*[client.history(config) for config in configs])
+    """
+
+    def __init__(self, autograde_url = DEFAULT_AUTOGRADER_URL,
+            max_connections = DEFAULT_MAX_CONNECTIONS, timeout = DEFAULT_TIMEOUT_SEC,
+            compress = False, submit_timeout = DEFAULT_SUBMIT_TIMEOUT_SEC):
+        parts = urllib.parse.urlsplit(autograde_url)
+        if (parts.scheme not in ('http', 'https')):
+            raise ValueError("Unsupported autograder URL: '%s'." % (autograde_url))
+
+        self._host = parts.hostname
+        self._port = parts.port
+        self._ssl = None
+
+        if (parts.scheme == 'https'):
+            self._ssl = ssl.create_default_context()
+            if (self._port is None):
+                self._port = 443
+        elif (self._port is None):
+            self._port = 80
+
+        self._path = parts.path or '/'
+        if (parts.query != ''):
+            self._path += '?' + parts.query
+
+        self._url = autograde_url
+        self._host_header = parts.netloc
+        self._timeout = timeout
+        self._submit_timeout = submit_timeout
+        self._compress = compress
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+        # Connections that are open and not in use: [(reader, writer), ...].
+        self._idle = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        idle = self._idle
+        self._idle = []
+
+        for (_, writer) in idle:
+            await _close_connection(writer)
+
+    async def send(self, config):
+        """
+        Send a request (a config with a task) to the server.
+        Submissions wait on grading, so they use the submit timeout (like submit()).
+        Return (body, None) on success, and (None, message) on failure.
+        Network errors, timeouts, and bad responses are raised (see REQUEST_ERRORS).
+        """
+
+        submission = (config.get('task') == TASK_SUBMIT)
+        return _check_response(*(await self._send_config(config, submission = submission)))
+
+    async def history(self, config, cache = None, page_size = None):
+        """
+        The async version of cse40.autograder.request_history() (with an already loaded config).
+        See HistoryFetch for |cache| and |page_size|.
+        """
+
+        fetch = HistoryFetch(config, self._url, cache = cache, page_size = page_size)
+
+        while (fetch.request is not None):
+            body, message = await self.send(fetch.request)
+            if (body is None):
+                return (False, message)
+
+            fetch.handle(body)
+
+        return (True, fetch.get_history())
+
+    async def repeat(self, config):
+        """
+        The async version of cse40.autograder.request_repeat() (with an already loaded config).
+        """
+
+        config = dict(config)
+        config['task'] = TASK_REPEAT
+
+        body, message = await self.send(config)
+        if (body is None):
+            return (False, message)
+
+        return (True, cse40.assignment.Assignment.from_dict(body['assignment']))
+
+    async def submit(self, config, source_code, delta = False, on_question = None):
+        """
+        The async version of cse40.autograder.request_submit()
+        (with an already loaded config and extracted source code).
+        If |delta| is true, then only the hash of the code is sent at first,
+        and the code is only sent if the server asks for it.
+        If |on_question| is given, then the results are streamed
+        and it will be called with each cse40.question.Question as soon as it is graded
+        (servers that can not stream will just send the final result).
+        """
+
+        config = dict(config)
+        config['task'] = TASK_SUBMIT
+
+        on_line = None
+        if (on_question is not None):
+            config['stream'] = True
+            on_line = (lambda data: on_question(cse40.question.Question.from_dict(data)))
+
+        if (delta):
+            config['code_hash'] = hash_code(source_code)
+
+            status, body = await self._send_config(config, on_line, submission = True)
+            if ((body is None) or (body.get('status') != STATUS_NEED_CODE)):
+                body, message = _check_response(status, body)
+                if (body is None):
+                    return (False, message)
+
+                return (True, cse40.assignment.Assignment.from_dict(body['assignment']))
+
+        config['code'] = source_code
+
+        body, message = _check_response(*(await self._send_config(config, on_line,
+                submission = True)))
+        if (body is None):
+            return (False, message)
+
+        return (True, cse40.assignment.Assignment.from_dict(body['assignment']))
+
+    async def _send_config(self, config, on_line = None, submission = False):
+        """
+        Return (HTTP status, decoded body), where the body is None for a non-200 status.
+        If the response is streamed, then |on_line| will be called with each question
+        (see _StreamedBody) and the body will be the final line.
+        Responses to a |submission| wait on grading, so they use the submit timeout.
+        """
+
+        read_timeout = self._timeout
+        if (submission):
+            read_timeout = self._submit_timeout
+
+        payload = bytes(json.dumps(config), ENCODING)
+
+        async with self._semaphore:
+            status, data = await self._post(payload, on_line, read_timeout)
+
+        if (status != 200):
+            return status, None
+
+        return status, json.loads(data.decode(encoding = ENCODING))
+
+    async def _post(self, payload, on_line, read_timeout):
+        if (self._compress and (len(payload) >= COMPRESS_MIN_BYTES)):
+            status, data = await self._send(gzip.compress(payload, COMPRESS_LEVEL), on_line,
+                    read_timeout, compressed = True)
+
+            if (status != HTTP_UNSUPPORTED_MEDIA_TYPE):
+                return status, data
+
+            # The server can't take compressed bodies, so stop sending them.
+            self._compress = False
+
+        return await self._send(payload, on_line, read_timeout)
+
+    async def _send(self, payload, on_line, read_timeout, compressed = False):
+        reused = (len(self._idle) > 0)
+        if (reused):
+            reader, writer = self._idle.pop()
+        else:
+            reader, writer = await self._connect()
+
+        try:
+            status, data, keep_alive = await self._exchange(reader, writer, payload, on_line,
+                    read_timeout, compressed)
+        except _StaleConnection:
+            await _close_connection(writer)
+
+            if (not reused):
+                raise
+
+            # The server closed an idle connection, try again with a new one.
+            reader, writer = await self._connect()
+            try:
+                status, data, keep_alive = await self._exchange(reader, writer, payload, on_line,
+                    read_timeout, compressed)
+            except BaseException:
+                await _close_connection(writer)
+                raise
+        except BaseException:
+            # Includes cancellation (e.g. a timeout), which leaves the connection unusable.
+            await _close_connection(writer)
+            raise
+
+        if (keep_alive):
+            self._idle.append((reader, writer))
+        else:
+            await _close_connection(writer)
+
+        return status, data
+
+    async def _connect(self):
+        return await asyncio.wait_for(asyncio.open_connection(self._host, self._port,
+                ssl = self._ssl, limit = MAX_LINE_BYTES), self._timeout)
+
+    async def _exchange(self, reader, writer, payload, on_line, read_timeout, compressed):
+        """
+        Send a single request and read its response.
+        Return (status, body, whether the connection can be reused).
+        """
+
+        reader = _TimedReader(reader, read_timeout)
+
+        headers = [
+            "POST %s HTTP/1.1" % (self._path),
+            "Host: %s" % (self._host_header),
+            "Content-Type: application/json",
+            "Content-Length: %d" % (len(payload)),
+            "Accept-Encoding: gzip",
+            "Connection: keep-alive",
+        ]
+
+        if (compressed):
+            headers.append("Content-Encoding: gzip")
+
+        try:
+            writer.write(bytes("\r\n".join(headers) + "\r\n\r\n", ENCODING) + payload)
+            await asyncio.wait_for(writer.drain(), self._timeout)
+
+            status_line = await reader.readline()
+        except (ConnectionResetError, BrokenPipeError) as ex:
+            raise _StaleConnection(str(ex))
+
+        if (status_line == b''):
+            raise _StaleConnection('Connection closed before a response.')
+
+        version, status = _parse_status_line(status_line)
+        response_headers = await _read_headers(reader)
+
+        connection = response_headers.get('connection', '').lower()
+        if (version == 'HTTP/1.0'):
+            keep_alive = (connection == 'keep-alive')
+        else:
+            keep_alive = (connection != 'close')
+
+        compressed_response = (response_headers.get('content-encoding', '').lower() == 'gzip')
+
+        body = None
+        if ((on_line is not None)
+                and response_headers.get('content-type', '').startswith(NDJSON_CONTENT_TYPE)):
+            body = _StreamedBody(on_line)
+
+        if ('chunked' in response_headers.get('transfer-encoding', '').lower()):
+            # Streamed lines are handled as they arrive (unless they are compressed).
+            data = await _read_chunked(reader, None if compressed_response else body)
+        elif ('content-length' in response_headers):
+            data = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            # The body goes until the server closes the connection.
+            data = await reader.read()
+            keep_alive = False
+
+        if (compressed_response):
+            data = gzip.decompress(data)
+
+        if (body is not None):
+            # Anything that was not already handled as it arrived.
+            body.feed(data)
+            data = body.finish()
+
+        return status, data, keep_alive
+
+class _TimedReader(object):
+    """
+    A stream reader where each read is limited to |timeout| seconds (None for no limit).
+    """
+
+    def __init__(self, reader, timeout):
+        self._reader = reader
+        self._timeout = timeout
+
+    async def readline(self):
+        return await asyncio.wait_for(self._reader.readline(), self._timeout)
+
+    async def readexactly(self, size):
+        return await asyncio.wait_for(self._reader.readexactly(size), self._timeout)
+
+    async def read(self):
+        return await asyncio.wait_for(self._reader.read(), self._timeout)
+
+class _StreamedBody(object):
+    """
+    A newline-delimited JSON body that is read as it arrives.
+    Lines with a 'question' are passed to a callback,
+    and the final line (the normal response) is kept.
+    """
+
+    def __init__(self, on_line):
+        self._on_line = on_line
+        self._buffer = b''
+        self._final = b''
+
+    def feed(self, data):
+        self._buffer += data
+
+        while (b"\n" in self._buffer):
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            self._handle(line)
+
+    def finish(self):
+        """
+        Return the final line.
+        """
+
+        self._handle(self._buffer)
+        self._buffer = b''
+
+        return self._final
+
+    def _handle(self, line):
+        if (line.strip() == b''):
+            return
+
+        data = json.loads(line.decode(ENCODING))
+        if ('question' in data):
+            self._on_line(data['question'])
+        else:
+            self._final = line
+
+class HistoryFetch(object):
+    """
+    The requests needed to get the full history for a config,
+    which may be paginated (|page_size| rows at a time, or the server's choice if None)
+    and may use a cache (a cse40.cache.DiskCache, see get_history_cache()).
+    With a cache, the server is sent the last seen row and a validator (etag),
+    so it can answer that nothing has changed or send only the new rows.
+
+    Use:
+        while (fetch.request is not None):
+            fetch.handle(<successful response body for fetch.request>)
+        history = fetch.get_history()
+    """
+
+    def __init__(self, config, autograde_url, cache = None, page_size = None):
+        self._cache = cache
+        self._key = None
+        self._cached = None
+
+        self._rows = []
+        self._partial = None
+        self._etag = None
+
+        self.request = dict(config)
+        self.request['task'] = TASK_HISTORY
+
+        if (page_size is not None):
+            self.request['limit'] = page_size
+
+        if (self._cache is not None):
+            self._key = cse40.cache.hash_text(autograde_url, json.dumps(config, sort_keys = True))
+            self._cached = self._cache.get(self._key)
+
+        if (self._cached is not None):
+            self.request['etag'] = self._cached['etag']
+            if (len(self._cached['history']) > 0):
+                self.request['after'] = self._cached['history'][-1]['id']
+
+    def handle(self, body):
+        if (body.get('not_modified', False) and (self._cached is not None)):
+            self._rows = self._cached['history']
+            self._partial = False
+            self.request = None
+            return
+
+        # Only the first page says if the rows are in addition to the cached ones.
+        if (self._partial is None):
+            self._partial = (body.get('partial', False) and (self._cached is not None))
+
+        self._rows += body.get('history', [])
+        self._etag = body.get('etag')
+
+        if (body.get('next') is not None):
+            self.request = dict(self.request)
+            self.request['after'] = body['next']
+            return
+
+        self.request = None
+
+        if (self._partial):
+            self._rows = self._cached['history'] + self._rows
+            self._partial = False
+
+        if ((self._cache is not None) and (self._etag is not None)):
+            try:
+                self._cache.put(self._key, {'etag': self._etag, 'history': self._rows})
+            except OSError:
+                # The cache is only an optimization.
+                pass
+
+    def get_history(self):
+        return self._rows
+
+def get_history_cache():
+    """
+    Get the default (on-disk) history cache,
+    or None if it can not be used (e.g. its directory can not be created).
+    """
+
+    try:
+        return cse40.cache.DiskCache(cse40.cache.get_cache_dir('history'),
+                max_bytes = HISTORY_CACHE_MAX_BYTES)
+    except OSError:
+        return None
+
+def hash_code(source_code):
+    """
+    Get the hash that identifies some source code in a delta submission.
+    """
+
+    return hashlib.sha256(source_code.encode(ENCODING)).hexdigest()
+
+def _check_response(status, body):
+    """
+    Return (body, None) for a successful response, and (None, message) otherwise.
+    """
+
+    if (status != 200):
+        return None, "Got a failure status from the autograding server: %s." % (status)
+
+    if (body['status'] != 'success'):
+        return (None, body['message'])
+
+    return body, None
+
+def _parse_status_line(line):
+    parts = line.decode(ENCODING).split(None, 2)
+    if ((len(parts) < 2) or (not parts[0].startswith('HTTP/'))):
+        raise ValueError("Bad status line from the autograding server: '%s'." % (line))
+
+    return parts[0], int(parts[1])
+
+async def _read_headers(reader):
+    headers = {}
+
+    while True:
+        line = await reader.readline()
+        if (line in (b'\r\n', b'\n', b'')):
+            break
+
+        name, _, value = line.decode(ENCODING).partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    return headers
+
+async def _read_chunked(reader, body = None):
+    """
+    Read a chunked body, passing each chunk to |body| (a _StreamedBody) if it is given.
+    """
+
+    chunks = []
+
+    while True:
+        size_line = await reader.readline()
+        size = int(size_line.split(b';', 1)[0].strip(), 16)
+
+        if (size == 0):
+            # Skip any trailers.
+            await _read_headers(reader)
+            break
+
+        chunk = await reader.readexactly(size)
+        if (body is not None):
+            body.feed(chunk)
+        else:
+            chunks.append(chunk)
+
+        await reader.readexactly(2)
+
+    return b''.join(chunks)
+
+async def _close_connection(writer):
+    writer.close()
+
+    try:
+        await writer.wait_closed()
+    except (OSError, asyncio.CancelledError):
+        pass
+
+def describe_error(ex):
+    """
+    Get a message for one of the REQUEST_ERRORS.
+    """
+
+    if (isinstance(ex, asyncio.TimeoutError)):
+        return 'Timed out waiting for the autograding server.'
+    elif (isinstance(ex, OSError)):
+        return "Could not reach the autograding server: %s." % (ex)
+    else:
+        return "Got a bad response from the autograding server: %s." % (ex)
+
+async def capture(coroutine):
+    """
+    Turn network errors, timeouts, and bad responses into a failed (success, message) result,
+    so one bad request does not sink a bulk operation (or crash a CLI).
+    """
+
+    try:
+        return await coroutine
+    except REQUEST_ERRORS as ex:
+        return (False, describe_error(ex))
+
+async def _many(autograde_url, max_connections, timeout, make_request, items, compress = False):
+    async with Client(autograde_url, max_connections = max_connections,
+            timeout = timeout, compress = compress) as client:
+        requests = [capture(make_request(client, item)) for item in items]
+        return await asyncio.gather(*requests)
+
+async def history_many(configs, autograde_url = DEFAULT_AUTOGRADER_URL,
+        max_connections = DEFAULT_MAX_CONNECTIONS, timeout = DEFAULT_TIMEOUT_SEC,
+        cache = None, page_size = None):
+    """
+    Request the history for many configs concurrently (see Client.history()).
+    Return a list of (success, history or message) in the same order as |configs|.
+    """
+
+    return await _many(autograde_url, max_connections, timeout,
+            lambda client, config: client.history(config, cache = cache, page_size = page_size),
+            configs)
+
+async def repeat_many(configs, autograde_url = DEFAULT_AUTOGRADER_URL,
+        max_connections = DEFAULT_MAX_CONNECTIONS, timeout = DEFAULT_TIMEOUT_SEC):
+    """
+    Request a repeat for many configs concurrently.
+    Return a list of (success, assignment or message) in the same order as |configs|.
+    """
+
+    return await _many(autograde_url, max_connections, timeout,
+            lambda client, config: client.repeat(config), configs)
+
+async def submit_many(submissions, autograde_url = DEFAULT_AUTOGRADER_URL,
+        max_connections = DEFAULT_MAX_CONNECTIONS, timeout = DEFAULT_TIMEOUT_SEC,
+        delta = False, compress = False):
+    """
+    Submit many (config, source code) pairs concurrently (see Client.submit()).
+    Return a list of (success, assignment or message) in the same order as |submissions|.
+    """
+
+    return await _many(autograde_url, max_connections, timeout,
+            lambda client, submission: client.submit(*submission, delta = delta), submissions,
+            compress = compress)
+
+def run(coroutine):
+    """
+    Run a coroutine to completion from synchronous code and return its result.
+    If this thread is already running an event loop (e.g. inside a notebook),
+    then the coroutine is run in a new loop on another thread.
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
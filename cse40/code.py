@@ -3,16 +3,48 @@ Utilities for extracting and working with Python source code.
 """
 
 import ast
-import importlib
+import collections
+import hashlib
+import importlib.abc
+import importlib.util
 import json
+import linecache
+import marshal
+import mmap
 import os
+import re
+import sys
+import threading
 import types
 import uuid
 
-import cse40.utils
+import cse40.metrics
 
 AST_NODE_WHITELIST = [ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef]
 
+# The number of notebooks to keep compiled code for (see import_path()).
+NOTEBOOK_LOADER_CACHE_SIZE = 64
+
+# The number of in-memory sources to keep available for tracebacks.
+REGISTERED_SOURCE_LIMIT = 256
+
+# The number of sanitized code objects to keep in memory (see compile_sanitized()).
+CODE_CACHE_SIZE = 128
+
+# The most space compiled code may take on disk (see set_code_cache_dir()).
+CODE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+CODE_CACHE_SUFFIX = '.marshal'
+
+# Hard limits on notebooks, checked before (and while) reading them.
+MAX_NOTEBOOK_BYTES = 128 * 1024 * 1024
+MAX_NOTEBOOK_CELLS = 2000
+
+_JSON_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_JSON_STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+_JSON_SCALAR = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[^,:\[\]{}\s]+')
+# Everything up to the next bracket that is not inside of a string.
+_JSON_NON_BRACKETS = re.compile(rb'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")+')
+
 def extract_code(path):
     """
     Gets the source code out of a path (to either a notebook or vanilla python).
@@ -20,16 +52,17 @@ def extract_code(path):
 
     code = None
 
-    if (path.endswith('.ipynb')):
-        code = extract_notebook_code(path)
-    elif (path.endswith('.py')):
-        with open(path, 'r') as file:
-            lines = file.readlines()
-        lines = [line.rstrip() for line in lines]
+    with cse40.metrics.timed(cse40.metrics.STAGE_EXTRACTION):
+        if (path.endswith('.ipynb')):
+            code = extract_notebook_code(path)
+        elif (path.endswith('.py')):
+            with open(path, 'r') as file:
+                lines = file.readlines()
+            lines = [line.rstrip() for line in lines]
 
-        code = "\n".join(lines) + "\n"
-    else:
-        raise ValueError("Unknown extension for extracting code: '%s'." % (path))
+            code = "\n".join(lines) + "\n"
+        else:
+            raise ValueError("Unknown extension for extracting code: '%s'." % (path))
 
     return code.strip()
 
@@ -39,42 +72,323 @@ def extract_notebook_code(path):
     A concatenation of all the cells (with a newline between each cell) will be output.
     """
 
-    with open(path, 'r') as file:
-        notebook = json.load(file)
+    contents = [cell_code for (_, cell_code) in extract_notebook_cells(path)]
+    return "\n".join(contents) + "\n"
+
+def extract_notebook_cells(path):
+    """
+    Extract the non-empty code cells from an iPython notebook.
+    Return a list of (cell index, cell code),
+    where the index is the cell's (zero-based) position among all the notebook's cells.
+
+    Notebooks can be huge because of their outputs (images, tables, etc),
+    so the file is memory mapped and scanned without building anything except the code cells.
+    """
+
+    size = os.path.getsize(path)
+    if (size > MAX_NOTEBOOK_BYTES):
+        raise ValueError(("Notebook is too large (%d bytes, max is %d bytes): '%s'."
+                + " Try clearing all outputs and saving it again.")
+                % (size, MAX_NOTEBOOK_BYTES, path))
+
+    if (size == 0):
+        raise ValueError("Notebook is empty: '%s'." % (path))
 
-    contents = []
+    with open(path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+            try:
+                raw_cells = _NotebookScanner(buffer).scan()
+            except ValueError as ex:
+                raise ValueError("Could not read notebook '%s': %s" % (path, ex))
 
-    for cell in notebook['cells']:
-        if (cell['cell_type'] != 'code'):
+    cells = []
+
+    for (index, (cell_type, source)) in enumerate(raw_cells):
+        if (cell_type != 'code'):
             continue
 
-        cell_code = ''.join(cell['source']).strip()
+        cell_code = ''.join(json.loads(source)).strip()
 
         # Ignore empty cells.
         if (cell_code == ''):
             continue
 
-        contents.append(cell_code)
+        cells.append((index, cell_code))
 
-    return "\n".join(contents) + "\n"
+    return cells
+
+class _NotebookScanner(object):
+    """
+    A minimal JSON scanner that only understands enough of the notebook format
+    to pull out each cell's type and (raw JSON) source.
+    Everything else is skipped over without being decoded.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._position = 0
+
+        # Skip a UTF-8 BOM.
+        if (buffer[0:3] == b'\xef\xbb\xbf'):
+            self._position = 3
+
+    def scan(self):
+        """
+        Return a list of (cell type, raw source) for every cell.
+        """
+
+        cells = None
+
+        for key in self._members():
+            if (key == 'cells'):
+                cells = self._cells()
+            else:
+                self._skip_value()
+
+        if (cells is None):
+            raise ValueError("No cells found.")
+
+        return cells
+
+    def _cells(self):
+        cells = []
+
+        for _ in self._elements():
+            if (len(cells) >= MAX_NOTEBOOK_CELLS):
+                raise ValueError("Too many cells (max is %d)." % (MAX_NOTEBOOK_CELLS))
+
+            cell_type = None
+            source = b'[]'
+
+            for key in self._members():
+                if (key == 'cell_type'):
+                    cell_type = json.loads(self._raw_value())
+                elif (key == 'source'):
+                    source = self._raw_value()
+                else:
+                    self._skip_value()
+
+            cells.append((cell_type, source))
+
+        return cells
+
+    def _members(self):
+        """
+        Iterate over the keys of an object.
+        The caller must consume each value before asking for the next key.
+        """
+
+        self._expect(b'{')
+        if (self._peek() == b'}'):
+            self._position += 1
+            return
+
+        while True:
+            self._skip_whitespace()
+
+            match = _JSON_STRING.match(self._buffer, self._position)
+            if (match is None):
+                raise ValueError("Expected a key at byte %d." % (self._position))
+
+            self._position = match.end()
+            self._expect(b':')
+
+            yield json.loads(match.group(0))
+
+            if (self._expect(b',}') == b'}'):
+                return
+
+    def _elements(self):
+        """
+        Iterate over the elements of an array.
+        The caller must consume each element.
+        """
+
+        self._expect(b'[')
+        if (self._peek() == b']'):
+            self._position += 1
+            return
+
+        while True:
+            yield
+
+            if (self._expect(b',]') == b']'):
+                return
+
+    def _raw_value(self):
+        self._skip_whitespace()
+        start = self._position
+        self._skip_value()
+
+        return self._buffer[start:self._position]
+
+    def _skip_value(self):
+        if (self._peek() not in (b'{', b'[')):
+            match = _JSON_SCALAR.match(self._buffer, self._position)
+            if (match is None):
+                raise ValueError("Expected a value at byte %d." % (self._position))
+
+            self._position = match.end()
+            return
+
+        depth = 0
+        while True:
+            match = _JSON_NON_BRACKETS.match(self._buffer, self._position)
+            if (match is not None):
+                self._position = match.end()
+
+            char = self._buffer[self._position:(self._position + 1)]
+            if (char in (b'{', b'[')):
+                depth += 1
+            elif (char in (b'}', b']')):
+                depth -= 1
+            else:
+                raise ValueError("Unexpected end of file.")
+
+            self._position += 1
+
+            if (depth == 0):
+                return
+
+    def _peek(self):
+        self._skip_whitespace()
+        return self._buffer[self._position:(self._position + 1)]
+
+    def _expect(self, chars):
+        char = self._peek()
+        if ((len(char) == 0) or (char not in chars)):
+            raise ValueError("Expected one of '%s' at byte %d." % (
+                chars.decode(), self._position))
+
+        self._position += 1
+        return char
+
+    def _skip_whitespace(self):
+        self._position = _JSON_WHITESPACE.match(self._buffer, self._position).end()
 
 def import_path(path, module_name = None):
+    """
+    Import a .py or .ipynb file as a (new) module.
+    Notebooks are imported directly from memory (nothing is written to disk),
+    with __file__ and tracebacks pointing at the notebook.
+    The compiled notebook is reused, so importing the same notebook
+    under multiple module names only pays to execute it.
+    """
+
     if (module_name is None):
         module_name = str(uuid.uuid4()).replace('-', '')
 
-    # If it's a notebook, extract the code first and put it in a temp file.
+    loader = None
     if (path.endswith('.ipynb')):
-        source_code = extract_code(path)
-        path = cse40.utils.get_temp_path(suffix = '.py')
-        with open(path, 'w') as file:
-            file.write(source_code)
+        loader = _get_notebook_loader(path)
 
-    spec = importlib.util.spec_from_file_location(module_name, path)
+    spec = importlib.util.spec_from_file_location(module_name, path, loader = loader)
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
 
     return module
 
+class SourceLoader(importlib.abc.InspectLoader):
+    """
+    An import loader for source code that is already in memory.
+    The code is compiled once, and can then be executed into any number of modules.
+    """
+
+    def __init__(self, source_code, filename):
+        self._source_code = source_code
+        self._filename = filename
+
+        _register_source(filename, source_code)
+        self._code = compile(source_code, filename, 'exec', dont_inherit = True)
+
+    def get_source(self, fullname):
+        return self._source_code
+
+    def get_code(self, fullname):
+        return self._code
+
+    def get_filename(self, fullname):
+        return self._filename
+
+    def exec_module(self, module):
+        exec(self._code, module.__dict__)
+
+class NotebookFinder(importlib.abc.MetaPathFinder):
+    """
+    An import finder that allows notebooks to be imported by name (like normal modules).
+    See install_notebook_finder().
+    """
+
+    def find_spec(self, fullname, path, target = None):
+        basename = fullname.rpartition('.')[2] + '.ipynb'
+
+        if (path is None):
+            path = sys.path
+
+        for entry in path:
+            candidate = os.path.join(entry or '.', basename)
+            if (os.path.isfile(candidate)):
+                return importlib.util.spec_from_file_location(fullname, candidate,
+                        loader = _get_notebook_loader(candidate))
+
+        return None
+
+_notebook_finder = NotebookFinder()
+
+def install_notebook_finder():
+    """
+    Allow "import foo" to find foo.ipynb (after all the normal finders have failed).
+    """
+
+    if (_notebook_finder not in sys.meta_path):
+        sys.meta_path.append(_notebook_finder)
+
+# {(path, mtime, size): SourceLoader, ...}, with the most recently used last.
+_notebook_loaders = collections.OrderedDict()
+_notebook_loaders_lock = threading.Lock()
+
+def _get_notebook_loader(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+
+    with _notebook_loaders_lock:
+        if (key in _notebook_loaders):
+            _notebook_loaders.move_to_end(key)
+            return _notebook_loaders[key]
+
+    loader = SourceLoader(extract_code(path), path)
+
+    with _notebook_loaders_lock:
+        _notebook_loaders[key] = loader
+        while (len(_notebook_loaders) > NOTEBOOK_LOADER_CACHE_SIZE):
+            _notebook_loaders.popitem(last = False)
+
+    return loader
+
+# Filenames we have put into linecache, with the most recently registered last.
+_registered_sources = collections.OrderedDict()
+
+def _register_source(filename, source_code):
+    """
+    Make the source available to linecache (and therefore tracebacks).
+    Without a modification time, linecache will never try to reload it from disk
+    (which would give the wrong lines for a notebook).
+    Only the most recent sources are kept, so long-running graders do not grow forever.
+    """
+
+    lines = [line + "\n" for line in source_code.split("\n")]
+
+    with _notebook_loaders_lock:
+        linecache.cache[filename] = (len(source_code), None, lines, filename)
+
+        _registered_sources[filename] = True
+        _registered_sources.move_to_end(filename)
+
+        while (len(_registered_sources) > REGISTERED_SOURCE_LIMIT):
+            old_filename, _ = _registered_sources.popitem(last = False)
+            linecache.cache.pop(old_filename, None)
+
 def sanitize_and_import_path(path):
     """
     Get the code from a source file, sanitize it, exec it, and return it as a namespace (module).
@@ -93,13 +407,131 @@ def sanitize_and_import_code(source_code, filename):
     See sanitize_and_import_path().
     """
 
-    module_ast = sanitize_code(source_code)
+    with cse40.metrics.timed(cse40.metrics.STAGE_SANITIZE):
+        code = compile_sanitized(source_code, filename)
 
-    globals_defs = {}
-    exec(compile(module_ast, filename = filename, mode = "exec"), globals_defs)
+        # Sanitizing keeps the original line numbers, so tracebacks can use the full source.
+        _register_source(filename, source_code)
+
+        globals_defs = {}
+        exec(code, globals_defs)
 
     return types.SimpleNamespace(**globals_defs)
 
+# {key: code, ...}, with the most recently used last.
+_code_cache = collections.OrderedDict()
+_code_cache_lock = threading.Lock()
+_code_disk_cache = None
+_code_cache_stats = {
+    'hits': 0,
+    'disk_hits': 0,
+    'misses': 0,
+}
+
+def compile_sanitized(source_code, filename):
+    """
+    Sanitize (see sanitize_code()) and compile some source code.
+    Code objects are cached in memory (and on disk, see set_code_cache_dir()),
+    so the same source does not need to be parsed and compiled again.
+    """
+
+    key = _code_cache_key(source_code, filename)
+
+    with _code_cache_lock:
+        if (key in _code_cache):
+            _code_cache.move_to_end(key)
+            _code_cache_stats['hits'] += 1
+            return _code_cache[key]
+
+    code = _load_cached_code(key)
+    if (code is not None):
+        stat = 'disk_hits'
+    else:
+        stat = 'misses'
+        code = compile(sanitize_code(source_code), filename = filename, mode = "exec")
+        _store_cached_code(key, code)
+
+    with _code_cache_lock:
+        _code_cache_stats[stat] += 1
+
+        _code_cache[key] = code
+        while (len(_code_cache) > CODE_CACHE_SIZE):
+            _code_cache.popitem(last = False)
+
+    return code
+
+def set_code_cache_dir(path, max_bytes = CODE_CACHE_MAX_BYTES):
+    """
+    Also keep compiled code (as marshal files) in this directory,
+    evicting the least recently used files past |max_bytes| (see cse40.cache.DiskCache).
+    Pass None to only cache in memory.
+    """
+
+    global _code_disk_cache
+
+    if (path is None):
+        _code_disk_cache = None
+        return
+
+    # Loaded on demand, since the cache module depends on questions.
+    import cse40.cache
+
+    _code_disk_cache = cse40.cache.DiskCache(path, max_bytes = max_bytes,
+            suffix = CODE_CACHE_SUFFIX)
+
+def get_code_cache_stats():
+    """
+    Get the hit/miss counts for the compiled code cache.
+    """
+
+    with _code_cache_lock:
+        return dict(_code_cache_stats)
+
+def clear_code_cache():
+    """
+    Clear the in-memory code cache and its stats (the on-disk cache is left alone).
+    """
+
+    with _code_cache_lock:
+        _code_cache.clear()
+        for stat in _code_cache_stats:
+            _code_cache_stats[stat] = 0
+
+def _code_cache_key(source_code, filename):
+    # Code objects (and marshal's format) are specific to the Python version,
+    # and contain the filename.
+    hasher = hashlib.sha256()
+    hasher.update(importlib.util.MAGIC_NUMBER)
+    hasher.update(filename.encode('utf-8', 'surrogatepass') + b'\0')
+    hasher.update(source_code.encode('utf-8', 'surrogatepass'))
+
+    return "%s-%s" % (sys.implementation.cache_tag, hasher.hexdigest())
+
+def _load_cached_code(key):
+    disk_cache = _code_disk_cache
+    if (disk_cache is None):
+        return None
+
+    data = disk_cache.get_bytes(key)
+    if (data is None):
+        return None
+
+    try:
+        return marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        return None
+
+def _store_cached_code(key, code):
+    disk_cache = _code_disk_cache
+    if (disk_cache is None):
+        return
+
+    try:
+        disk_cache.put_bytes(key, marshal.dumps(code))
+    except OSError:
+        # The disk cache is only an optimization.
+        pass
+
 def sanitize_code(source_code):
     module_ast = ast.parse(source_code)
 
@@ -0,0 +1,141 @@
+"""
+Timing instrumentation for grading.
+
+Every timing is recorded into a process-wide registry (REGISTRY)
+that can be exported (as JSON or the Prometheus text format) by long-running graders.
+Timings for stages that happen before an assignment is graded (e.g. extraction)
+are also held per-thread until the next cse40.assignment.Assignment.grade() collects them.
+Code that grades many submissions on the same thread should grade each one inside a scope(),
+so timings recorded for other work are not attributed to the next graded assignment.
+"""
+
+import contextlib
+import threading
+import time
+
+STAGE_EXTRACTION = 'extraction'
+STAGE_SANITIZE = 'sanitize'
+STAGE_SPAWN = 'spawn'
+STAGE_SCORING = 'scoring'
+STAGE_TRANSFER = 'transfer'
+STAGE_STYLE = 'style'
+STAGE_TOTAL = 'total'
+
+PROMETHEUS_METRIC = 'cse40_stage_seconds'
+
+class Registry(object):
+    """
+    Aggregate (count, sum, max) timings for each stage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if (stage not in self._stages):
+                self._stages[stage] = {'count': 0, 'sum': 0.0, 'max': 0.0}
+
+            stats = self._stages[stage]
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def to_dict(self):
+        """
+        Get a snapshot of all the stages: {stage: {'count': int, 'sum': float, 'max': float}}.
+        """
+
+        with self._lock:
+            return {stage: dict(stats) for (stage, stats) in self._stages.items()}
+
+    def to_prometheus(self):
+        """
+        Get a snapshot in the Prometheus text exposition format.
+        """
+
+        stages = sorted(self.to_dict().items())
+
+        lines = [
+            "# HELP %s Time spent in each grading stage." % (PROMETHEUS_METRIC),
+            "# TYPE %s summary" % (PROMETHEUS_METRIC),
+        ]
+
+        for (stage, stats) in stages:
+            lines.append('%s_sum{stage="%s"} %f' % (PROMETHEUS_METRIC, stage, stats['sum']))
+            lines.append('%s_count{stage="%s"} %d' % (PROMETHEUS_METRIC, stage, stats['count']))
+
+        lines.append("# HELP %s_max The longest time spent in a grading stage."
+                % (PROMETHEUS_METRIC))
+        lines.append("# TYPE %s_max gauge" % (PROMETHEUS_METRIC))
+
+        for (stage, stats) in stages:
+            lines.append('%s_max{stage="%s"} %f' % (PROMETHEUS_METRIC, stage, stats['max']))
+
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+_pending = threading.local()
+
+def record(stage, seconds, pending = True):
+    """
+    Record a timing in the registry,
+    and (if |pending|) hold it for the next collect() on this thread.
+    """
+
+    REGISTRY.observe(stage, seconds)
+
+    if (not pending):
+        return
+
+    if (not hasattr(_pending, 'timings')):
+        _pending.timings = {}
+
+    _pending.timings[stage] = _pending.timings.get(stage, 0.0) + seconds
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    Time a block of code and record() it.
+    """
+
+    start_time = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start_time)
+
+@contextlib.contextmanager
+def scope():
+    """
+    Only let collect() (on this thread) see the timings recorded inside this block,
+    e.g. around all the work for a single submission.
+    Anything pending from before the block is set aside (and restored after it),
+    and anything recorded in the block but not collected is dropped.
+    """
+
+    saved = getattr(_pending, 'timings', {})
+    _pending.timings = {}
+
+    try:
+        yield
+    finally:
+        _pending.timings = saved
+
+def collect():
+    """
+    Get (and clear) the timings recorded on this thread since the last collect().
+    Return: {stage: seconds}.
+    """
+
+    timings = getattr(_pending, 'timings', {})
+    _pending.timings = {}
+
+    return timings
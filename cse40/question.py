@@ -6,10 +6,19 @@ import abc
 import functools
 import traceback
 
-import cse40.utils
+import cse40.metrics
 
 DEFAULT_TIMEOUT_SEC = 60
 
+# How a question's result may be reused (see cse40.cache), from least to most strict.
+# The result only depends on the sanitized submission (see cse40.code.sanitize_code()).
+CACHE_SANITIZED = 'sanitized'
+# The result depends on the exact source (e.g. style).
+CACHE_SOURCE = 'source'
+# The result is not deterministic and should never be reused.
+CACHE_NEVER = 'never'
+CACHE_POLICIES = [CACHE_SANITIZED, CACHE_SOURCE, CACHE_NEVER]
+
 class Question(object):
     """
     Questions are grade-able portions of an assignment.
@@ -17,27 +26,73 @@ class Question(object):
     Note that all scoring is in ints.
     """
 
-    def __init__(self, name, max_points, timeout = DEFAULT_TIMEOUT_SEC):
+    # The stage (see cse40.metrics) that time spent in score_question() is recorded as.
+    SCORING_STAGE = cse40.metrics.STAGE_SCORING
+
+    def __init__(self, name, max_points, timeout = DEFAULT_TIMEOUT_SEC,
+            cache_policy = CACHE_SANITIZED, cpu_limit = None, memory_limit = None,
+            in_process = False):
+        """
+        The CPU limit is in seconds and the memory (address space) limit is in bytes
+        (on top of the memory that the grading process is already using).
+        Limits that are None may be filled in by the assignment (see cse40.assignment.Assignment).
+
+        Trusted questions that are very quick to score can set |in_process|
+        to be scored inside the grading process (see cse40.utils.invoke_in_process())
+        against a copy of the submission (see cse40.utils.copy_submission()).
+        Questions with limits are always scored in their own process.
+        """
+
         self.name = name
 
         self.max_points = max_points
         self._timeout = timeout
 
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+
+        if (cache_policy not in CACHE_POLICIES):
+            raise ValueError("Unknown cache policy: '%s'." % (cache_policy))
+
+        self.cache_policy = cache_policy
+        self.in_process = in_process
+
         # Scoring artifacts.
         self.score = 0
         self.message = ''
 
+        # Measured resource usage (None if not measured).
+        self.cpu_time = None
+        self.peak_memory = None
+
+        # {stage: seconds} for the last grading (see cse40.metrics).
+        self.timings = {}
+
     def grade(self, submission, additional_data = {}, show_exceptions = False):
         """
         Invoke the scoring method using a timeout and cleanup.
         Return the score.
         """
 
+        # The grading machinery is only loaded once something is graded
+        # (results can be loaded and displayed without it, see cse40.autograder).
+        import cse40.utils
+
+        in_process = (self.in_process
+                and (self.cpu_limit is None) and (self.memory_limit is None))
+
+        if (in_process):
+            submission = cse40.utils.copy_submission(submission)
+
         helper = functools.partial(self._score_helper, submission,
                 additional_data = additional_data)
 
         try:
-            success, value = cse40.utils.invoke_with_timeout(self._timeout, helper)
+            if (in_process):
+                success, value, usage = cse40.utils.invoke_in_process(self._timeout, helper)
+            else:
+                success, value, usage = cse40.utils.invoke_with_limits(self._timeout, helper,
+                        cpu_limit = self.cpu_limit, memory_limit = self.memory_limit)
         except Exception:
             if (show_exceptions):
                 traceback.print_exc()
@@ -45,9 +100,15 @@ class Question(object):
             self.fail("Raised an exception: " + traceback.format_exc())
             return 0
 
+        self.cpu_time = usage['cpu_time']
+        self.peak_memory = usage['peak_memory']
+        self._record_timings(usage['timings'])
+
         if (not success):
             if (value is None):
                 self.fail("Timeout (%d seconds)." % (self._timeout))
+            elif (usage['limit_exceeded'] is not None):
+                self.fail(value)
             else:
                 self.fail("Error during execution: " + value)
 
@@ -63,6 +124,16 @@ class Question(object):
 
         return self.score
 
+    def _record_timings(self, timings):
+        self.timings = dict(timings)
+
+        if (cse40.metrics.STAGE_SCORING in self.timings):
+            self.timings[self.SCORING_STAGE] = self.timings.pop(cse40.metrics.STAGE_SCORING)
+
+        for (stage, seconds) in self.timings.items():
+            # Questions may be graded on other threads, so the assignment collects these itself.
+            cse40.metrics.record(stage, seconds, pending = False)
+
     def _score_helper(self, submission, additional_data = {}):
         """
         Score the question, but make sure to return the score and message so
@@ -134,6 +205,8 @@ class Question(object):
             (self.name == other.name)
             and (self.max_points == other.max_points)
             and (self._timeout == other._timeout)
+            and (self.cpu_limit == other.cpu_limit)
+            and (self.memory_limit == other.memory_limit)
             and (self.score == other.score)
             and (self.message == other.message))
 
@@ -146,8 +219,13 @@ class Question(object):
             'name': self.name,
             'max_points': self.max_points,
             'timeout': self._timeout,
+            'cpu_limit': self.cpu_limit,
+            'memory_limit': self.memory_limit,
             'score': self.score,
             'message': self.message,
+            'cpu_time': self.cpu_time,
+            'peak_memory': self.peak_memory,
+            'timings': self.timings,
         }
 
     @staticmethod
@@ -157,8 +235,12 @@ class Question(object):
         Questions constructed with this will not have an implementation for score_question().
         """
 
-        question = Question(data['name'], data['max_points'], data['timeout'])
+        question = Question(data['name'], data['max_points'], data['timeout'],
+                cpu_limit = data.get('cpu_limit'), memory_limit = data.get('memory_limit'))
         question.score = data['score']
         question.message = data['message']
+        question.cpu_time = data.get('cpu_time')
+        question.peak_memory = data.get('peak_memory')
+        question.timings = data.get('timings', {})
 
         return question
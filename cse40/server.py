@@ -0,0 +1,667 @@
+"""
+A reference autograding server that speaks the same protocol as cse40.autograder.
+Submissions are graded by a pool of worker threads that pull from a bounded queue
+(each question still runs in its own process, see cse40.question.Question.grade()).
+When the queue is full, submissions are turned away with a 429 (and a Retry-After header)
+instead of piling up.
+History is stored on local disk, and queue depth and latency stats are available
+with a GET to /stats (or /metrics for the Prometheus text format).
+
+Submissions that ask to be streamed get a newline-delimited JSON response
+(see cse40.client) with a line for each question as soon as it is graded.
+Graders can support this with a grade_iter(path) generator that yields each question
+(e.g. from cse40.assignment.Assignment.grade_iter()) and then returns the assignment,
+otherwise only the final result is sent.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import gzip
+import http.server
+import json
+import math
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+import zlib
+
+import cse40.client
+import cse40.code
+import cse40.metrics
+import cse40.utils
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 12345
+DEFAULT_DATA_DIR = 'cse40-server'
+DEFAULT_QUEUE_SIZE = 64
+
+# The number of history rows sent at once (unless the client asks for fewer).
+HISTORY_PAGE_SIZE = 100
+
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+# The number of recent latencies to keep for computing percentiles.
+LATENCY_WINDOW = 1024
+
+HTTP_BAD_REQUEST = 400
+HTTP_NOT_FOUND = 404
+HTTP_PAYLOAD_TOO_LARGE = 413
+HTTP_TOO_MANY_REQUESTS = 429
+
+# Names (of assignments and users) that are safe to use as filenames.
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.\-]*$')
+
+class HistoryStore(object):
+    """
+    Graded assignments for each (assignment, user), kept as JSON lines on disk.
+    """
+
+    def __init__(self, base_dir):
+        self._base_dir = base_dir
+        self._lock = threading.Lock()
+
+    def add(self, assignment_name, user, assignment):
+        """
+        Record a graded assignment and return its history row.
+        """
+
+        path = self._path(assignment_name, user)
+
+        with self._lock:
+            rows = self._read(path)
+
+            # Ids are (unique) timestamps.
+            row_id = int(time.time())
+            if ((len(rows) > 0) and (int(rows[-1]['id']) >= row_id)):
+                row_id = int(rows[-1]['id']) + 1
+
+            row = {
+                'id': str(row_id),
+                'score': list(assignment.get_score()),
+                'assignment': assignment.to_dict(),
+            }
+
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            with open(path, 'a') as file:
+                file.write(json.dumps(row) + "\n")
+
+        return row
+
+    def get(self, assignment_name, user):
+        """
+        Get all the history rows (oldest first), each with an 'id', 'score', and 'assignment'.
+        """
+
+        path = self._path(assignment_name, user)
+
+        with self._lock:
+            return self._read(path)
+
+    def _read(self, path):
+        if (not os.path.exists(path)):
+            return []
+
+        with open(path, 'r') as file:
+            return [json.loads(line) for line in file if (line.strip() != '')]
+
+    def _path(self, assignment_name, user):
+        return os.path.join(self._base_dir, assignment_name, user + '.jsonl')
+
+class CodeStore(object):
+    """
+    Submitted code addressed by its hash (see cse40.client.hash_code()),
+    so delta submissions can be graded without the code being sent again.
+    """
+
+    def __init__(self, base_dir):
+        self._base_dir = base_dir
+        os.makedirs(self._base_dir, exist_ok = True)
+
+    def get_path(self, code_hash):
+        """
+        Get the path to some stored code, or None if it has not been seen.
+        """
+
+        if (re.fullmatch(r'[0-9a-f]{64}', code_hash) is None):
+            return None
+
+        path = self._path(code_hash)
+        if (not os.path.exists(path)):
+            return None
+
+        return path
+
+    def put(self, source_code):
+        """
+        Store some code and return the path to it.
+        """
+
+        path = self._path(cse40.client.hash_code(source_code))
+        if (os.path.exists(path)):
+            return path
+
+        temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with open(temp_path, 'w', encoding = cse40.client.ENCODING) as file:
+            file.write(source_code)
+
+        os.replace(temp_path, path)
+
+        return path
+
+    def _path(self, code_hash):
+        return os.path.join(self._base_dir, code_hash + '.py')
+
+class GradingService(object):
+    """
+    A bounded queue of submissions and the worker threads that grade them.
+    """
+
+    def __init__(self, graders, workers = None, queue_size = DEFAULT_QUEUE_SIZE):
+        """
+        |graders| maps each assignment name to a grader module
+        (which has a grade(path) function that returns a cse40.assignment.Assignment).
+        """
+
+        if (workers is None):
+            workers = os.cpu_count() or 1
+
+        self._graders = graders
+        self._queue = queue.Queue(maxsize = queue_size)
+        self._workers = [threading.Thread(target = self._work, daemon = True)
+                for _ in range(workers)]
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'accepted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'errors': 0,
+        }
+        self._latencies = collections.deque(maxlen = LATENCY_WINDOW)
+        self._waits = collections.deque(maxlen = LATENCY_WINDOW)
+        self._stopped = False
+
+        for worker in self._workers:
+            worker.start()
+
+    def has_grader(self, assignment_name):
+        return (assignment_name in self._graders)
+
+    def submit(self, assignment_name, path, on_question = None):
+        """
+        Queue a submission for grading.
+        Return a future for the graded assignment, or None if the queue is full.
+        If |on_question| is given, then it will be called (from a worker thread)
+        with each question as soon as it is graded (if the grader supports it).
+        """
+
+        future = concurrent.futures.Future()
+        job = (future, assignment_name, path, on_question, time.monotonic())
+
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+
+            return None
+
+        with self._lock:
+            self._stats['accepted'] += 1
+
+        return future
+
+    def get_retry_after(self):
+        """
+        Estimate how long (in whole seconds) a rejected client should wait before trying again.
+        """
+
+        with self._lock:
+            if (len(self._latencies) == 0):
+                return 1
+
+            mean_latency = sum(self._latencies) / len(self._latencies)
+
+        return max(1, math.ceil(mean_latency * self._queue.qsize() / len(self._workers)))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['latency'] = _summarize(self._latencies)
+            stats['wait'] = _summarize(self._waits)
+
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_size'] = self._queue.maxsize
+        stats['workers'] = len(self._workers)
+
+        return stats
+
+    def stop(self):
+        if (self._stopped):
+            return
+
+        self._stopped = True
+
+        for _ in self._workers:
+            self._queue.put(None)
+
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if (job is None):
+                return
+
+            future, assignment_name, path, on_question, enqueue_time = job
+            start_time = time.monotonic()
+
+            if (not future.set_running_or_notify_cancel()):
+                continue
+
+            try:
+                future.set_result(_run_grader(self._graders[assignment_name], path, on_question))
+                error = False
+            except Exception as ex:
+                future.set_exception(ex)
+                error = True
+
+            end_time = time.monotonic()
+
+            with self._lock:
+                self._stats['completed'] += 1
+                self._stats['errors'] += int(error)
+                self._waits.append(start_time - enqueue_time)
+                self._latencies.append(end_time - enqueue_time)
+
+def _run_grader(grader, path, on_question):
+    # Anything the grader leaves in temp paths is removed with the submission,
+    # and only this submission's timings are attributed to it.
+    with cse40.utils.Workspace(), cse40.metrics.scope():
+        if ((on_question is None) or (not hasattr(grader, 'grade_iter'))):
+            return grader.grade(path)
+
+        questions = grader.grade_iter(path)
+        while True:
+            try:
+                question = next(questions)
+            except StopIteration as ex:
+                return ex.value
+
+            on_question(question)
+
+def _decompress_gzip(data, max_bytes):
+    """
+    Decompress a gzip body without ever producing more than |max_bytes| (so a small body
+    can not expand to use up all our memory).
+    Return None if the body expands past |max_bytes|, and raise ValueError on a bad body.
+    """
+
+    output = b''
+
+    # A body may have several gzip members.
+    while (len(data) > 0):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        try:
+            output += decompressor.decompress(data, max_bytes + 1 - len(output))
+        except zlib.error as ex:
+            raise ValueError("Bad gzip data: %s." % (ex))
+
+        if (len(output) > max_bytes):
+            return None
+
+        if (not decompressor.eof):
+            raise ValueError('Truncated gzip data.')
+
+        data = decompressor.unused_data
+
+    return output
+
+def _summarize(values):
+    values = sorted(values)
+
+    if (len(values) == 0):
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'max': None}
+
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': values[int(0.50 * (len(values) - 1))],
+        'p95': values[int(0.95 * (len(values) - 1))],
+        'max': values[-1],
+    }
+
+class GradingServer(http.server.ThreadingHTTPServer):
+    """
+    An HTTP server for the cse40.autograder protocol.
+    If |users| ({user: password}) is None, then any user is accepted.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, graders, data_dir = DEFAULT_DATA_DIR, users = None,
+            host = DEFAULT_HOST, port = DEFAULT_PORT, workers = None,
+            queue_size = DEFAULT_QUEUE_SIZE):
+        super().__init__((host, port), _Handler)
+
+        self.users = users
+        self.service = GradingService(graders, workers = workers, queue_size = queue_size)
+        self.history = HistoryStore(os.path.join(data_dir, 'history'))
+        self.code = CodeStore(os.path.join(data_dir, 'code'))
+
+    def get_url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def server_close(self):
+        super().server_close()
+        self.service.stop()
+
+    def handle_task(self, config):
+        """
+        Handle a single (decoded) request.
+        Return (HTTP status, body),
+        where a streamed body is an iterable of dicts (one for each line).
+        """
+
+        user = config.get('cruzid')
+        assignment_name = config.get('assignment')
+
+        for name in (user, assignment_name):
+            if ((not isinstance(name, str)) or (NAME_PATTERN.match(name) is None)):
+                return 200, _failure("Bad user or assignment name: '%s'." % (name))
+
+        if ((self.users is not None) and (self.users.get(user) != config.get('password'))):
+            return 200, _failure('Bad user or password.')
+
+        if (not self.service.has_grader(assignment_name)):
+            return 200, _failure("Unknown assignment: '%s'." % (assignment_name))
+
+        task = config.get('task')
+
+        if (task == cse40.client.TASK_HISTORY):
+            return 200, self._get_history(config, assignment_name, user)
+        elif (task == cse40.client.TASK_REPEAT):
+            rows = self.history.get(assignment_name, user)
+            if (len(rows) == 0):
+                return 200, _failure('No past submissions for this assignment.')
+
+            return 200, {'status': 'success', 'assignment': rows[-1]['assignment']}
+        elif (task == cse40.client.TASK_SUBMIT):
+            return self._submit(config, assignment_name, user)
+        else:
+            return 200, _failure("Unknown task: '%s'." % (task))
+
+    def _get_history(self, config, assignment_name, user):
+        """
+        See cse40.client.HistoryFetch.
+        """
+
+        rows = self.history.get(assignment_name, user)
+        history = [{'id': row['id'], 'score': row['score']} for row in rows]
+
+        # History is append-only, so the size and last id identify it.
+        etag = "%d-%s" % (len(history), history[-1]['id'] if (len(history) > 0) else '')
+
+        if (config.get('etag') == etag):
+            return {'status': 'success', 'not_modified': True, 'etag': etag}
+
+        # Only send rows after the last one the client has seen (if we know that row).
+        partial = False
+        ids = [row['id'] for row in history]
+        if (config.get('after') in ids):
+            history = history[(ids.index(config['after']) + 1):]
+            partial = True
+
+        limit = HISTORY_PAGE_SIZE
+        if (isinstance(config.get('limit'), int) and (config['limit'] > 0)):
+            limit = min(limit, config['limit'])
+
+        next_id = None
+        if (len(history) > limit):
+            history = history[:limit]
+            next_id = history[-1]['id']
+
+        return {
+            'status': 'success',
+            'history': history,
+            'partial': partial,
+            'etag': etag,
+            'next': next_id,
+        }
+
+    def _submit(self, config, assignment_name, user):
+        if ('code' in config):
+            path = self.code.put(config['code'])
+        elif ('code_hash' in config):
+            path = self.code.get_path(config['code_hash'])
+            if (path is None):
+                return 200, {'status': cse40.client.STATUS_NEED_CODE}
+        else:
+            return 200, _failure('No code was submitted.')
+
+        events = None
+        on_question = None
+
+        if (config.get('stream', False)):
+            events = queue.Queue()
+            on_question = (lambda question: events.put(question.to_dict()))
+
+        future = self.service.submit(assignment_name, path, on_question = on_question)
+        if (future is None):
+            return HTTP_TOO_MANY_REQUESTS, _failure('The autograder is busy, try again soon.')
+
+        if (events is None):
+            return 200, self._finish_submit(future, assignment_name, user)
+
+        # Questions are always reported before the future is done.
+        future.add_done_callback(lambda _: events.put(None))
+
+        return 200, self._stream_submit(future, events, assignment_name, user)
+
+    def _stream_submit(self, future, events, assignment_name, user):
+        while True:
+            question = events.get()
+            if (question is None):
+                break
+
+            yield {'question': question}
+
+        yield self._finish_submit(future, assignment_name, user)
+
+    def _finish_submit(self, future, assignment_name, user):
+        try:
+            assignment = future.result()
+        except Exception:
+            return _failure("Failed to grade the submission: %s" % (traceback.format_exc()))
+
+        self.history.add(assignment_name, user, assignment)
+
+        return {'status': 'success', 'assignment': assignment.to_dict()}
+
+def _failure(message):
+    return {'status': 'failure', 'message': message}
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive (see cse40.client).
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if (self.path == '/stats'):
+            stats = self.server.service.get_stats()
+            stats['stages'] = cse40.metrics.REGISTRY.to_dict()
+            self._respond(200, json.dumps(stats), 'application/json')
+        elif (self.path == '/metrics'):
+            self._respond(200, cse40.metrics.REGISTRY.to_prometheus(), 'text/plain')
+        else:
+            self._respond(HTTP_NOT_FOUND, json.dumps(_failure('Not found.')), 'application/json')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if (length > MAX_REQUEST_BYTES):
+            self.close_connection = True
+            self._respond_json(HTTP_PAYLOAD_TOO_LARGE, _failure('Request is too large.'))
+            return
+
+        data = self.rfile.read(length)
+
+        encoding = self.headers.get('Content-Encoding', 'identity').lower()
+        if (encoding == 'gzip'):
+            try:
+                data = _decompress_gzip(data, MAX_REQUEST_BYTES)
+            except ValueError:
+                self._respond_json(HTTP_BAD_REQUEST, _failure('Bad gzip body.'))
+                return
+
+            if (data is None):
+                self.close_connection = True
+                self._respond_json(HTTP_PAYLOAD_TOO_LARGE, _failure('Request is too large.'))
+                return
+        elif (encoding != 'identity'):
+            self._respond_json(cse40.client.HTTP_UNSUPPORTED_MEDIA_TYPE,
+                    _failure("Unsupported Content-Encoding: '%s'." % (encoding)))
+            return
+
+        try:
+            config = json.loads(data.decode(cse40.client.ENCODING))
+        except ValueError:
+            self._respond_json(HTTP_BAD_REQUEST, _failure('Bad JSON body.'))
+            return
+
+        if (not isinstance(config, dict)):
+            self._respond_json(HTTP_BAD_REQUEST, _failure('Bad JSON body.'))
+            return
+
+        status, body = self.server.handle_task(config)
+
+        if (isinstance(body, dict)):
+            self._respond_json(status, body)
+        else:
+            self._respond_stream(status, body)
+
+    def _respond_stream(self, status, lines):
+        self.send_response(status)
+        self.send_header('Content-Type', cse40.client.NDJSON_CONTENT_TYPE)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        lines = iter(lines)
+
+        try:
+            for line in lines:
+                data = (json.dumps(line) + "\n").encode(cse40.client.ENCODING)
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # The client went away, but still finish up (e.g. recording the history).
+            self.close_connection = True
+            for _ in lines:
+                pass
+
+    def _respond_json(self, status, body):
+        headers = {}
+        if (status == HTTP_TOO_MANY_REQUESTS):
+            headers['Retry-After'] = str(self.server.service.get_retry_after())
+
+        self._respond(status, json.dumps(body), 'application/json', headers)
+
+    def _respond(self, status, text, content_type, headers = {}):
+        data = text.encode(cse40.client.ENCODING)
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+
+        if ((len(data) >= cse40.client.COMPRESS_MIN_BYTES)
+                and ('gzip' in self.headers.get('Accept-Encoding', ''))):
+            data = gzip.compress(data, cse40.client.COMPRESS_LEVEL)
+            self.send_header('Content-Encoding', 'gzip')
+
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def _parse_graders(specs):
+    graders = {}
+
+    for spec in specs:
+        name, separator, path = spec.partition('=')
+        if ((separator == '') or (NAME_PATTERN.match(name) is None)):
+            raise ValueError("Bad grader (expected ASSIGNMENT=PATH): '%s'." % (spec))
+
+        graders[name] = cse40.code.import_path(path)
+
+    return graders
+
+def main(arguments):
+    users = None
+    if (arguments.users_path is not None):
+        with open(arguments.users_path, 'r') as file:
+            users = json.load(file)
+
+    server = GradingServer(_parse_graders(arguments.graders), data_dir = arguments.data_dir,
+            users = users, host = arguments.host, port = arguments.port,
+            workers = arguments.workers, queue_size = arguments.queue_size)
+
+    print("Serving on %s." % (server.get_url()), file = sys.stderr)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+def _load_args():
+    parser = argparse.ArgumentParser(description = 'Run an autograding server.')
+
+    parser.add_argument('graders', metavar = 'ASSIGNMENT=GRADER',
+        action = 'store', type = str, nargs = '+',
+        help = 'An assignment name and the grader to use for it'
+            + ' (must have a grade(path) function that returns an Assignment).')
+
+    parser.add_argument('--host', dest = 'host',
+        action = 'store', type = str, default = DEFAULT_HOST,
+        help = 'The host to listen on (default: %(default)s).')
+
+    parser.add_argument('--port', dest = 'port',
+        action = 'store', type = int, default = DEFAULT_PORT,
+        help = 'The port to listen on (default: %(default)s).')
+
+    parser.add_argument('--data-dir', dest = 'data_dir',
+        action = 'store', type = str, default = DEFAULT_DATA_DIR,
+        help = 'Where to store history and submitted code (default: %(default)s).')
+
+    parser.add_argument('--users', dest = 'users_path',
+        action = 'store', type = str, default = None,
+        help = 'A JSON file of {user: password} (default: accept any user).')
+
+    parser.add_argument('--workers', dest = 'workers',
+        action = 'store', type = int, default = None,
+        help = 'The number of submissions to grade at once (default: the number of CPUs).')
+
+    parser.add_argument('--queue-size', dest = 'queue_size',
+        action = 'store', type = int, default = DEFAULT_QUEUE_SIZE,
+        help = 'The number of submissions that can wait to be graded (default: %(default)s).')
+
+    return parser.parse_args()
+
+if (__name__ == '__main__'):
+    sys.exit(main(_load_args()))
@@ -1,12 +1,18 @@
-import contextlib
+import ast
+import bisect
+import collections
+import importlib
+import json
 import os
+import re
 import sys
+import threading
+import tokenize
 
-from flake8.api import legacy as flake8
-
+import cse40.cache
 import cse40.code
+import cse40.metrics
 import cse40.question
-import cse40.utils
 
 # For codes, see:
 # flake8: https://flake8.pycqa.org/en/latest/user/error-codes.html
@@ -54,11 +60,18 @@ class Style(cse40.question.Question):
     A question that can be added to assignments that checks style.
     """
 
+    SCORING_STAGE = cse40.metrics.STAGE_STYLE
+
     def __init__(self, path, max_points = 5, replacement_name = 'assignment.py'):
-        super().__init__("Style", max_points)
+        # Style depends on the exact text of the submission, not just its AST.
+        super().__init__("Style", max_points, cache_policy = cse40.question.CACHE_SOURCE)
         self._path = path
         self._replacement_name = replacement_name
 
+        # Questions are scored in forked children, so build the (expensive) engine here once
+        # and let every child inherit it.
+        get_engine()
+
     def score_question(self, *args, **kwargs):
         error_count, style_output = check_style(self._path,
                 replace_output_path = self._replacement_name)
@@ -67,84 +80,682 @@ class Style(cse40.question.Question):
             self.add_message("Style is clean!")
             self.full_credit()
         else:
-            self.add_message(("Code has %d style issues (shown below)."
-                    + " Note that line numbers will be offset because of iPython notebooks.")
-                    % (error_count))
+            message = "Code has %d style issues (shown below)." % (error_count)
+            if (self._path.endswith('.ipynb')):
+                message += " Line numbers are relative to each notebook cell."
+
+            self.add_message(message)
             self.add_message("--- Style Output BEGIN ---")
             self.add_message("\n".join(style_output))
             self.add_message("--- Style Output END ---")
             self.score = max(0, self.max_points - error_count)
 
-def check_style(path, replace_output_path = None):
-    cleanup_paths = []
+# |cell| is the (zero-based) index of the notebook cell the violation is in (None otherwise).
+# When |cell| is set, |line| is relative to that cell.
+StyleViolation = collections.namedtuple('StyleViolation',
+        ['code', 'line', 'column', 'text', 'physical_line', 'cell'], defaults = [None])
+
+DEFAULT_SOURCE_FILENAME = 'assignment.py'
+
+STYLE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Checker packages whose version affects results (flake8 itself is always included).
+STYLE_CHECKER_PACKAGES = ['pycodestyle', 'pyflakes']
+
+# Notebooks cells are checked on their own for everything except names (F codes),
+# which need to see the definitions from every cell (see check_notebook()).
+NOTEBOOK_CELL_OPTIONS = dict(STYLE_OPTIONS, select = 'E,W')
+NOTEBOOK_NAME_OPTIONS = dict(STYLE_OPTIONS, select = 'F')
+
+# A comment that turns off checks for a whole file (and therefore the whole notebook).
+_FILE_NOQA = re.compile(r'#\s*flake8[:=]\s*noqa', re.IGNORECASE)
+
+# Errors that mean the flake8 internals we use have changed (see StyleEngine).
+FLAKE8_INTERNAL_ERRORS = (AttributeError, ImportError, TypeError, ValueError)
+
+class StyleEngine(object):
+    """
+    A reusable flake8 setup that reports structured violations.
+    Building a flake8 style guide (options, plugins, decisions) is expensive,
+    so it should be done once per process (see get_engine()).
+
+    Source strings are checked directly (without touching disk),
+    and many files are checked in a single batch.
+    Both rely on flake8 internals (see _load_source_checker()),
+    so if those are ever missing or broken this engine falls back (with a warning)
+    to flake8's public API (flake8.api.legacy), which only checks files.
+    """
+
+    def __init__(self, options = STYLE_OPTIONS):
+        import flake8.api.legacy
+
+        # argparse (used by flake8) will look for a program name on sys.argv[0].
+        if (len(sys.argv) == 0):
+            sys.argv = ['']
+
+        # Each engine gets its own collector, so violations do not mix between engines.
+        collector_class = type('_EngineCollector', (_load_collector(), ), {'violations': []})
+        self._violations = collector_class.violations
+
+        self._style_guide = flake8.api.legacy.get_style_guide(**options)
+        self._style_guide.init_report(collector_class)
+
+        # The guide and collector are stateful.
+        self._lock = threading.Lock()
+
+        self._checker_class = None
+        self._application = None
+
+        try:
+            self._checker_class = _load_source_checker()
+            self._application = self._style_guide._application
+
+            # Make sure the internals still fit together
+            # (e.g. a missed override would try to read this source from disk).
+            if (self._check_internal(DEFAULT_SOURCE_FILENAME, ["SOME_CONSTANT = 1\n"]) != []):
+                raise ValueError('Clean source did not check as clean.')
+        except FLAKE8_INTERNAL_ERRORS as ex:
+            self._use_public_api(ex)
+
+    def uses_internals(self):
+        """
+        Return True if this engine is using flake8 internals (instead of the public API).
+        """
+
+        return (self._application is not None)
+
+    def check_source(self, source_code, filename = DEFAULT_SOURCE_FILENAME):
+        """
+        Check a string of source code.
+        Return a list of StyleViolation (sorted by position).
+        """
+
+        lines = source_code.splitlines(True)
+
+        if (self.uses_internals()):
+            try:
+                return self._check_internal(filename, lines)
+            except FLAKE8_INTERNAL_ERRORS as ex:
+                self._use_public_api(ex)
+
+        # The public API can only check files.
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, DEFAULT_SOURCE_FILENAME)
+            with open(path, 'w', encoding = 'utf-8') as file:
+                file.write(source_code)
+
+            return self._check_public([path])[path]
+
+    def check_file(self, path):
+        """
+        Check a .py or .ipynb file.
+        """
+
+        if (path.endswith('.ipynb')):
+            return self.check_source(cse40.code.extract_notebook_code(path), filename = path)
+        elif (path.endswith('.py')):
+            if (self.uses_internals()):
+                try:
+                    return self._check_internal(path, None)
+                except FLAKE8_INTERNAL_ERRORS as ex:
+                    self._use_public_api(ex)
+
+            return self._check_public([path])[path]
+        else:
+            raise ValueError("Can only check style on .py or .ipynb files, got '%s'." % (path))
+
+    def check_paths(self, paths):
+        """
+        Check many .py or .ipynb files at once.
+        Python files will be checked in parallel using flake8's own job handling.
+        Return a dict of {path: [StyleViolation, ...]}.
+        """
+
+        python_paths = []
+        results = {}
+
+        for path in paths:
+            if (path.endswith('.py')):
+                python_paths.append(path)
+            elif (path.endswith('.ipynb')):
+                results[path] = self.check_file(path)
+            else:
+                raise ValueError("Can only check style on .py or .ipynb files, got '%s'." % (path))
+
+        if (len(python_paths) == 0):
+            return results
+
+        if (self.uses_internals()):
+            try:
+                results.update(self._check_paths_internal(python_paths))
+                return results
+            except FLAKE8_INTERNAL_ERRORS as ex:
+                self._use_public_api(ex)
+
+        results.update(self._check_public(python_paths))
+        return results
+
+    def _use_public_api(self, ex):
+        message = "WARNING: flake8 internals have changed (%s: %s), falling back to its public API."
+        print(message % (type(ex).__name__, ex), file = sys.stderr)
+
+        self._checker_class = None
+        self._application = None
+
+    def _check_public(self, paths):
+        """
+        Check files using only flake8's public API.
+        """
+
+        with self._lock:
+            del self._violations[:]
+            self._style_guide.check_files(paths)
+
+            violations = list(self._violations)
+            del self._violations[:]
+
+        results = {path: [] for path in paths}
+        for violation in violations:
+            path = violation.filename
+            if (path not in results):
+                # flake8 may have normalized the path.
+                path = os.path.abspath(path)
+                path = [key for key in paths if (os.path.abspath(key) == path)][0]
+
+            results[path].append(_to_style_violation(violation))
+
+        for violations in results.values():
+            violations.sort(key = lambda violation: (violation.line, violation.column))
+
+        return results
+
+    def _check_internal(self, filename, lines):
+        checker = self._checker_class(lines, filename = filename,
+                plugins = self._application.plugins.checkers, options = self._application.options)
+        _, raw_results, _ = checker.run_checks()
+
+        return self._filter(filename, raw_results)
+
+    def _check_paths_internal(self, paths):
+        import flake8.checker
+
+        application = self._application
+
+        # The options are shared by every thread using this engine.
+        with self._lock:
+            application.options.filenames = paths
+
+            manager = flake8.checker.Manager(style_guide = application.guide,
+                    plugins = application.plugins.checkers, argv = [])
+            manager.start()
+            manager.run()
+
+            results = manager.results
+
+        raw_results = {filename: file_results for (filename, file_results, _) in results}
+
+        # Report each file under the name it was given to us as.
+        return {path: self._filter(path, raw_results.get(path, [])) for path in paths}
+
+    def _filter(self, filename, raw_results):
+        """
+        Pass raw checker results though flake8's decision engine (select, ignore, noqa).
+        """
+
+        guide = self._application.guide
+        raw_results = sorted(raw_results, key = lambda result: (result[1], result[2]))
+
+        with self._lock:
+            del self._violations[:]
+
+            with guide.processing_file(filename):
+                for (code, line_number, column, text, physical_line) in raw_results:
+                    guide.handle_error(code, filename, line_number, column, text, physical_line)
+
+            violations = list(self._violations)
+            del self._violations[:]
+
+        return [_to_style_violation(violation) for violation in violations]
+
+def _to_style_violation(violation):
+    return StyleViolation(violation.code, violation.line_number, violation.column_number,
+            violation.text, violation.physical_line)
+
+# flake8 is slow to import, so it (and the classes that extend it) are only loaded
+# once style is actually checked (see _load_collector() and _load_source_checker()).
+_collector_class = None
+_source_checker_class = None
+_flake8_lock = threading.Lock()
+
+def _load_collector():
+    """
+    Build a formatter class that collects violations (using flake8's public formatter API).
+    """
+
+    global _collector_class
+
+    with _flake8_lock:
+        if (_collector_class is not None):
+            return _collector_class
+
+        import flake8.formatting.base
+
+        class _ViolationCollector(flake8.formatting.base.BaseFormatter):
+            """
+            A flake8 formatter that just holds onto violations instead of writing them.
+            Violations are added to the (class-level) |violations| list.
+            """
+
+            violations = None
+
+            def start(self):
+                pass
+
+            def stop(self):
+                pass
+
+            def handle(self, error):
+                self.violations.append(error)
+
+            def format(self, error):
+                return None
+
+        _collector_class = _ViolationCollector
+
+    return _collector_class
+
+def _load_source_checker():
+    """
+    Build a file checker class that can take its lines from memory.
+    This uses flake8 internals (flake8.checker.FileChecker and FileProcessor),
+    so callers should be ready for FLAKE8_INTERNAL_ERRORS.
+    """
+
+    global _source_checker_class
+
+    with _flake8_lock:
+        if (_source_checker_class is not None):
+            return _source_checker_class
+
+        import flake8.checker
+        import flake8.processor
+
+        if (not hasattr(flake8.checker.FileChecker, '_make_processor')):
+            raise AttributeError('flake8.checker.FileChecker has no _make_processor().')
 
-    if (path.endswith('.py')):
+        class _SourceChecker(flake8.checker.FileChecker):
+            """
+            A flake8 file checker that can take its lines from memory.
+            """
+
+            def __init__(self, lines, **kwargs):
+                self._lines = lines
+                super().__init__(**kwargs)
+
+            def _make_processor(self):
+                if (self._lines is None):
+                    return super()._make_processor()
+
+                return flake8.processor.FileProcessor(self.filename, self.options,
+                        lines = self._lines)
+
+        _source_checker_class = _SourceChecker
+
+    return _source_checker_class
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(options = STYLE_OPTIONS):
+    """
+    Get the shared (per-process) style engine for a set of options.
+    """
+
+    key = json.dumps(options, sort_keys = True)
+
+    with _engines_lock:
+        if (key not in _engines):
+            _engines[key] = StyleEngine(options)
+
+    return _engines[key]
+
+def format_violations(violations, filename, show_source = STYLE_OPTIONS['show_source']):
+    """
+    Format violations in the same way that flake8 would output them.
+    Violations in notebooks will also cite their (one-based) cell number.
+    """
+
+    lines = []
+    for violation in violations:
+        location = filename
+        if (violation.cell is not None):
+            location = "%s (cell %d)" % (filename, violation.cell + 1)
+
+        lines.append("%s:%d:%d: %s %s" % (location, violation.line, violation.column,
+                violation.code, violation.text))
+
+        if (show_source and (violation.physical_line is not None)):
+            physical_line = violation.physical_line.rstrip()
+            indent = ''.join([char if char.isspace() else ' '
+                    for char in physical_line[:(violation.column - 1)]])
+
+            lines.append(physical_line)
+            lines.append(indent + '^')
+
+    return lines
+
+_caches = {}
+_cache_version = None
+
+def get_cache():
+    """
+    Get the on-disk cache of style results (see cse40.cache.get_cache_dir()).
+    """
+
+    cache_dir = cse40.cache.get_cache_dir('style')
+    if (cache_dir not in _caches):
+        _caches[cache_dir] = cse40.cache.DiskCache(cache_dir, max_bytes = STYLE_CACHE_MAX_BYTES)
+
+    return _caches[cache_dir]
+
+def _cache_key(source_code, options):
+    """
+    Results depend on the source, the options, and the version of all the checkers.
+    """
+
+    global _cache_version
+
+    if (_cache_version is None):
+        versions = [_get_package_version(package)
+                for package in ['flake8'] + STYLE_CHECKER_PACKAGES]
+        _cache_version = json.dumps(versions)
+
+    return cse40.cache.hash_text(source_code, json.dumps(options, sort_keys = True), _cache_version)
+
+def _get_package_version(package):
+    try:
+        import importlib.metadata as metadata
+    except ImportError:
+        # Before Python 3.8, the checkers have to be imported to get their version.
+        try:
+            return importlib.import_module(package).__version__
+        except (ImportError, AttributeError):
+            return ''
+
+    # Ask for versions without importing the checkers (so a cache hit stays cheap).
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return ''
+
+def _read_source(path):
+    # Read the same way flake8 does (respecting encoding declarations).
+    with tokenize.open(path) as file:
+        return file.read()
+
+def _cache_get(key):
+    try:
+        violations = get_cache().get(key)
+    except OSError:
+        # The cache is only an optimization (e.g. its directory may not be writable).
+        return None
+
+    if (violations is None):
+        return None
+
+    return [StyleViolation(*violation) for violation in violations]
+
+def _cache_put(key, violations):
+    try:
+        get_cache().put(key, [list(violation) for violation in violations])
+    except OSError:
+        # The cache is only an optimization.
         pass
-    elif (path.endswith('.ipynb')):
-        contents = cse40.code.extract_notebook_code(path)
 
-        temp_path = cse40.utils.get_temp_path(prefix = 'style_', suffix = '_notebook')
-        cleanup_paths.append(temp_path)
-        with open(temp_path, 'w') as file:
-            file.write(contents)
+def check_source(source_code, filename = DEFAULT_SOURCE_FILENAME, use_cache = True,
+        options = STYLE_OPTIONS):
+    """
+    Check a string of source code, using cached results when possible.
+    On a cache hit, flake8 is not even set up.
+    """
+
+    if (not use_cache):
+        return get_engine(options).check_source(source_code, filename = filename)
+
+    key = _cache_key(source_code, options)
+
+    violations = _cache_get(key)
+    if (violations is None):
+        violations = get_engine(options).check_source(source_code, filename = filename)
+        _cache_put(key, violations)
+
+    return violations
+
+def check_notebook(path, use_cache = True):
+    """
+    Check the style of a notebook one cell at a time,
+    with the same results as checking all the code cells together
+    (see cse40.code.extract_notebook_code()).
+    Because results are cached per cell, editing a cell only requires that cell
+    (and any later cells whose context it changed, see _get_cell_preludes()) to be re-checked.
+    Names (F codes) are checked over all the code at once (so definitions in other cells are seen).
+    Notebooks whose cells can not be checked on their own (e.g. because of a syntax error)
+    are checked all at once.
+    All violations will have a cell (and a line relative to that cell).
+    """
+
+    cells = cse40.code.extract_notebook_cells(path)
+    if (len(cells) == 0):
+        return []
+
+    source_code = "\n".join([cell_code for (_, cell_code) in cells]) + "\n"
+
+    violations = None
+    preludes = _get_cell_preludes(cells)
+    if (preludes is not None):
+        violations = _check_cells(path, cells, preludes, use_cache)
+
+    if (violations is None):
+        return _map_to_cells(cells, check_source(source_code, filename = path,
+                use_cache = use_cache))
 
-        if (replace_output_path is None):
-            replace_output_path = path
+    violations += _map_to_cells(cells, check_source(source_code, filename = path,
+            use_cache = use_cache, options = NOTEBOOK_NAME_OPTIONS))
+    violations.sort(key = lambda violation: (violation.cell, violation.line, violation.column))
 
-        path = temp_path
-    else:
-        raise ValueError("Can only check style on .py or .ipynb files, got '%s'." % (path))
+    return violations
 
-    path = os.path.realpath(path)
+def _check_cells(path, cells, preludes, use_cache):
+    """
+    Check each cell (after its prelude) for everything except names.
+    Return None if any cell could not be checked on its own.
+    """
+
+    violations = []
+
+    for ((index, cell_code), prelude) in zip(cells, preludes):
+        prelude_length = prelude.count("\n")
+
+        for violation in check_source(prelude + cell_code + "\n", filename = path,
+                use_cache = use_cache, options = NOTEBOOK_CELL_OPTIONS):
+            # Syntax (E999) and tokenizing (E902) errors stop all other checks in a file.
+            if (violation.code.startswith('E9')):
+                return None
+
+            if (violation.line > prelude_length):
+                violations.append(violation._replace(cell = index,
+                        line = violation.line - prelude_length))
+
+    return violations
+
+def _get_cell_preludes(cells):
+    """
+    Get the code to check before each cell, so that the cell is checked in the same context
+    as it would be in the whole notebook.
+    Cells are stripped, so there are never blank lines between them,
+    and only two things carry over from one cell to the next:
+    the character of the file's first indent (which E101 and the E1 checks compare against),
+    and whether imports are still allowed (E402, see pycodestyle.module_imports_on_top_of_file()).
+    Return None if the cells can not be checked on their own.
+    """
+
+    import pycodestyle
 
-    output_path = cse40.utils.get_temp_path(prefix = 'style_', suffix = '_output')
-    cleanup_paths.append(output_path)
+    check_imports = getattr(pycodestyle, 'module_imports_on_top_of_file', None)
+    if (check_imports is None):
+        return None
 
-    # argparse (used by flake8) will look for a program name on sys.argv[0].
-    if (len(sys.argv) == 0):
-        sys.argv = ['']
+    preludes = []
+    indent_char = None
+    import_state = {}
 
-    style_guide = flake8.get_style_guide(**STYLE_OPTIONS)
+    for (_, cell_code) in cells:
+        if (_FILE_NOQA.search(cell_code) is not None):
+            return None
 
-    with open(output_path, 'w') as file:
-        with contextlib.redirect_stdout(file):
-            report = style_guide.check_files([path])
+        try:
+            module_ast = ast.parse(cell_code)
+        except (SyntaxError, ValueError):
+            return None
 
-    with open(output_path, 'r') as file:
-        lines = file.readlines()
+        prelude = ''
+        if (len(preludes) > 0):
+            if (indent_char is not None):
+                prelude += "if True:\n%spass\n" % (indent_char)
 
-    lines = [line.rstrip() for line in lines]
+            # Each of these has the same effect on E402 as the earlier cells.
+            if (import_state.get('seen_non_imports', False)):
+                prelude += "pass\n"
+            elif (import_state.get('seen_docstring', False)):
+                prelude += '""\n'
+            else:
+                prelude += "__all__ = []\n"
 
-    if (replace_output_path is not None):
-        lines = [line.replace(path, replace_output_path) for line in lines]
+        preludes.append(prelude)
 
-    for path in cleanup_paths:
-        cse40.utils.remove_dirent(path)
+        lines = cell_code.split("\n")
 
-    return (report._application.result_count, lines)
+        if (indent_char is None):
+            for line in lines:
+                if (line[:1] in (' ', '\t')):
+                    indent_char = line[0]
+                    break
 
-def main(path):
-    path = path.strip()
+        end_line = None
+        for statement in module_ast.body:
+            # Statements after a semicolon are part of the previous logical line.
+            if (statement.lineno != end_line):
+                for _ in check_imports(lines[statement.lineno - 1], 0, import_state, False):
+                    pass
 
-    count, lines = check_style(path)
-    print("Found %d style errors." % (count))
+            end_line = statement.end_lineno
+
+    return preludes
+
+def _map_to_cells(cells, violations):
+    """
+    Map violations in the full notebook code back to their cell.
+    """
+
+    # The (zero-based) line each cell starts on in the full notebook code.
+    cell_offsets = []
+    offset = 0
+
+    for (_, cell_code) in cells:
+        cell_offsets.append(offset)
+        offset += len(cell_code.split("\n"))
+
+    results = []
+    for violation in violations:
+        position = max(0, bisect.bisect_right(cell_offsets, violation.line - 1) - 1)
+        results.append(violation._replace(cell = cells[position][0],
+                line = violation.line - cell_offsets[position]))
+
+    return results
+
+def check_paths(paths, use_cache = True):
+    """
+    Check many .py or .ipynb files, using cached results when possible.
+    Notebooks are checked by cell (see check_notebook()).
+    All the Python files that miss the cache are checked in a single call
+    (see StyleEngine.check_paths()).
+    Return a dict of {path: [StyleViolation, ...]}.
+    """
 
-    if (count > 0):
-        print('---')
-        print("\n".join(lines))
-        print('---')
+    results = {}
+    missed_keys = {}
 
-    sys.exit(count)
+    for path in paths:
+        if (path.endswith('.ipynb')):
+            results[path] = check_notebook(path, use_cache = use_cache)
+            continue
+
+        if (not path.endswith('.py')):
+            raise ValueError("Can only check style on .py or .ipynb files, got '%s'." % (path))
+
+        if (not use_cache):
+            missed_keys[path] = None
+            continue
+
+        key = _cache_key(_read_source(path), STYLE_OPTIONS)
+
+        violations = _cache_get(key)
+        if (violations is None):
+            missed_keys[path] = key
+        else:
+            results[path] = violations
+
+    if (len(missed_keys) > 0):
+        for path, violations in get_engine().check_paths(list(missed_keys)).items():
+            if (missed_keys[path] is not None):
+                _cache_put(missed_keys[path], violations)
+
+            results[path] = violations
+
+    return results
+
+def check_style(path, replace_output_path = None, use_cache = True):
+    """
+    Check the style of a .py or .ipynb file.
+    Return the number of violations and the formatted output lines.
+    """
+
+    violations = check_paths([path], use_cache = use_cache)[path]
+
+    if (replace_output_path is None):
+        replace_output_path = path
+
+    return (len(violations), format_violations(violations, replace_output_path))
+
+def main(paths):
+    total_count = 0
+
+    results = check_paths(paths)
+    for path in paths:
+        violations = results[path]
+        total_count += len(violations)
+
+        if (len(paths) > 1):
+            print("Checking %s." % (path))
+
+        print("Found %d style errors." % (len(violations)))
+
+        if (len(violations) > 0):
+            print('---')
+            print("\n".join(format_violations(violations, path)))
+            print('---')
+
+    sys.exit(total_count)
 
 def _load_args(args):
     args.pop(0)
-    if (len(args) != 1 or ({'h', 'help'} & {arg.lower().strip().replace('-', '') for arg in args})):
-        print("USAGE: python3 -m cse40.style <py or ipynb path>", file = sys.stderr)
+    if (len(args) == 0 or ({'h', 'help'} & {arg.lower().strip().replace('-', '') for arg in args})):
+        print("USAGE: python3 -m cse40.style <py or ipynb path> ...", file = sys.stderr)
         sys.exit(1)
 
-    path = os.path.abspath(args.pop(0))
-
-    return path
+    return [os.path.abspath(arg.strip()) for arg in args]
 
 if (__name__ == '__main__'):
     main(_load_args(sys.argv))
@@ -1,52 +1,393 @@
 """
 Tools for testing graders.
+Each solution declares the score it should get (EXPECTED_POINTS),
+and solutions are graded concurrently (see cse40.batch).
 """
 
+import argparse
+import ast
 import glob
+import json
 import os
 import sys
+import time
+import xml.etree.ElementTree
 
+import cse40.batch
+import cse40.cache
 import cse40.code
 
-def test_dir(grader_path, solutions_dir):
-    grader = cse40.code.import_path(grader_path)
-    error_count = 0
+EXPECTED_POINTS_NAME = 'EXPECTED_POINTS'
 
-    for solution_path in glob.glob(os.path.join(solutions_dir, '*.py')):
-        print("Testing solution: " + solution_path)
+RESULT_PASS = 'pass'
+RESULT_FAIL = 'fail'
+RESULT_ERROR = 'error'
 
-        solution = cse40.code.import_path(solution_path)
+DEFAULT_POLL_SEC = 1.0
 
-        if ('EXPECTED_POINTS' not in dir(solution)):
-            print("    ERROR: 'EXPECTED_POINTS' not defined in solution file.")
-            error_count += 1
+def read_expected_points(path):
+    """
+    Get the value of EXPECTED_POINTS from a solution without running it.
+    The value must be a literal.
+    Return None if the solution does not define it.
+    """
+
+    module_ast = ast.parse(cse40.code.extract_code(path), filename = path)
+
+    expected_points = None
+    for node in module_ast.body:
+        if (isinstance(node, ast.Assign)):
+            targets = node.targets
+        elif (isinstance(node, ast.AnnAssign) and (node.value is not None)):
+            targets = [node.target]
+        else:
             continue
 
-        assignment = grader.grade(solution_path)
-        score, _ = assignment.get_score()
+        if (any([isinstance(target, ast.Name) and (target.id == EXPECTED_POINTS_NAME)
+                for target in targets])):
+            # Like an import, the last assignment wins.
+            expected_points = ast.literal_eval(node.value)
+
+    return expected_points
+
+def find_solutions(solutions_dir):
+    return sorted(glob.glob(os.path.join(solutions_dir, '*.py')))
+
+def test_solutions(grader_path, solution_paths, workers = None, warm_up = True):
+    """
+    Grade each solution and compare its score to its expected points.
+    Solutions are graded concurrently, and results are yielded as they finish.
+    Each result is a dict with:
+    'path', 'status' (one of the RESULT_* constants), 'expected', 'score', 'message', and 'runtime'.
+    """
 
-        if (score != solution.EXPECTED_POINTS):
-            print("    ERROR: Expected score (%s) does not match actual score (%s)." % (
-                solution.EXPECTED_POINTS, score))
-            error_count += 1
+    results = {}
+    to_grade = []
+
+    for path in solution_paths:
+        result = {
+            'path': path,
+            'status': None,
+            'expected': None,
+            'score': None,
+            'message': '',
+            'runtime': 0.0,
+        }
+
+        try:
+            result['expected'] = read_expected_points(path)
+        except (SyntaxError, ValueError) as ex:
+            result['status'] = RESULT_ERROR
+            result['message'] = "Could not read '%s': %s" % (EXPECTED_POINTS_NAME, ex)
+            yield result
             continue
 
-    return error_count
+        if (result['expected'] is None):
+            result['status'] = RESULT_ERROR
+            result['message'] = "'%s' not defined in solution file." % (EXPECTED_POINTS_NAME)
+            yield result
+            continue
+
+        results[path] = result
+        to_grade.append(path)
+
+    if (len(to_grade) == 0):
+        return
+
+    for graded in cse40.batch.grade_paths(grader_path, to_grade, workers = workers,
+            warm_up = warm_up):
+        result = results[graded['path']]
+        result['runtime'] = graded['runtime']
+
+        if (graded['status'] != 'success'):
+            result['status'] = RESULT_ERROR
+            result['message'] = graded['message']
+            yield result
+            continue
+
+        result['score'] = sum([question['score']
+                for question in graded['assignment']['questions']])
+
+        if (result['score'] == result['expected']):
+            result['status'] = RESULT_PASS
+        else:
+            result['status'] = RESULT_FAIL
+            result['message'] = ("Expected score (%s) does not match actual score (%s)."
+                    % (result['expected'], result['score']))
+
+        yield result
+
+def test_dir(grader_path, solutions_dir, workers = None, warm_up = True,
+        json_path = None, junit_path = None):
+    """
+    Test a grader against all the solutions in a directory,
+    and optionally write JSON and JUnit XML reports.
+    Return the number of solutions that did not pass.
+    """
+
+    start_time = time.time()
+    results = []
+
+    for result in test_solutions(grader_path, find_solutions(solutions_dir),
+            workers = workers, warm_up = warm_up):
+        _print_result(result)
+        results.append(result)
+
+    runtime = time.time() - start_time
+    results.sort(key = lambda result: result['path'])
+
+    if (json_path is not None):
+        write_json_report(results, runtime, json_path)
+
+    if (junit_path is not None):
+        write_junit_report(results, runtime, junit_path, grader_path)
+
+    return len([result for result in results if (result['status'] != RESULT_PASS)])
+
+class Watcher(object):
+    """
+    Track a grader and a directory of solutions,
+    and only regrade the solutions whose inputs (the grader or the solution itself) changed.
+
+    Results are kept in a manifest keyed by (grader hash, solution hash),
+    so reverting an edit does not need a regrade.
+    Files are only hashed when their mtime or size changes.
+    """
+
+    def __init__(self, grader_path, solutions_dir, workers = None, warm_up = True):
+        self._grader_path = grader_path
+        self._solutions_dir = solutions_dir
+        self._workers = workers
+        self._warm_up = warm_up
+
+        # {path: ((mtime_ns, size), hash)}
+        self._hashes = {}
+
+        # {(grader hash, solution hash): result}
+        self._manifest = {}
+
+        # {path: result}
+        self._results = {}
+
+    def get_results(self):
+        return [self._results[path] for path in sorted(self._results)]
+
+    def check(self):
+        """
+        Regrade any solutions that changed since the last check.
+        Return a list of (path, old result, new result) for each solution that was
+        regraded, added (old result is None), or removed (new result is None).
+        Results that came from the manifest are not regraded, but are still reported.
+        """
+
+        grader_hash = self._hash(self._grader_path)
+        paths = find_solutions(self._solutions_dir)
+
+        for path in list(self._hashes):
+            if ((path != self._grader_path) and (path not in paths)):
+                del self._hashes[path]
+
+        changes = []
+        keys = {}
+
+        for path in sorted(set(self._results) - set(paths)):
+            changes.append((path, self._results.pop(path), None))
+
+        for path in paths:
+            try:
+                key = (grader_hash, self._hash(path))
+            except OSError:
+                # The file was removed since we listed the directory.
+                continue
+
+            old_result = self._results.get(path)
+            if ((old_result is not None) and (self._manifest.get(key) is old_result)):
+                continue
+
+            keys[path] = key
+
+        to_grade = [path for (path, key) in keys.items() if (key not in self._manifest)]
+        if (len(to_grade) > 0):
+            for result in test_solutions(self._grader_path, to_grade,
+                    workers = self._workers, warm_up = self._warm_up):
+                self._manifest[keys[result['path']]] = result
+
+        for (path, key) in keys.items():
+            new_result = self._manifest[key]
+            changes.append((path, self._results.get(path), new_result))
+            self._results[path] = new_result
+
+        return changes
+
+    def _hash(self, path):
+        stat = os.stat(path)
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+
+        if ((path in self._hashes) and (self._hashes[path][0] == file_stat)):
+            return self._hashes[path][1]
+
+        file_hash = cse40.cache.hash_file(path)
+        self._hashes[path] = (file_stat, file_hash)
+
+        return file_hash
+
+def watch(grader_path, solutions_dir, workers = None, warm_up = True,
+        poll_sec = DEFAULT_POLL_SEC):
+    """
+    Test a grader against a directory of solutions,
+    then keep polling for changes and regrade only what changed (until interrupted).
+    """
+
+    watcher = Watcher(grader_path, solutions_dir, workers = workers, warm_up = warm_up)
+
+    print("Watching '%s' and '%s' (Ctrl-C to stop)." % (grader_path, solutions_dir))
+
+    first = True
+    while (True):
+        start_time = time.time()
+
+        try:
+            changes = watcher.check()
+        except (OSError, SyntaxError) as ex:
+            # Editors may leave files missing or half written for a moment.
+            print("Could not check for changes: %s" % (ex))
+            changes = []
+
+        if (len(changes) > 0):
+            for (path, old_result, new_result) in changes:
+                if (first):
+                    _print_result(new_result)
+                else:
+                    _print_change(path, old_result, new_result)
+
+            results = watcher.get_results()
+            passed = len([result for result in results if (result['status'] == RESULT_PASS)])
+
+            print("%d / %d solutions passed (%.2fs)." % (passed, len(results),
+                    time.time() - start_time))
+            first = False
+
+        time.sleep(poll_sec)
+
+def _print_result(result):
+    print("Testing solution: %s (%.2fs)" % (result['path'], result['runtime']))
+
+    if (result['status'] != RESULT_PASS):
+        for line in result['message'].splitlines():
+            print("    ERROR: " + line)
+
+def _print_change(path, old_result, new_result):
+    if (new_result is None):
+        print("Removed: %s" % (path))
+        return
+
+    new_summary = (new_result['status'], new_result['score'])
+
+    if (old_result is None):
+        print("Added: %s" % (path))
+    else:
+        old_summary = (old_result['status'], old_result['score'])
+
+        if (old_summary == new_summary):
+            print("Unchanged: %s (%s, score: %s)" % ((path,) + new_summary))
+        else:
+            message = "Changed: %s (%s, score: %s) -> (%s, score: %s)"
+            print(message % ((path,) + old_summary + new_summary))
+
+    if (new_result['status'] != RESULT_PASS):
+        for line in new_result['message'].splitlines():
+            print("    ERROR: " + line)
+
+def write_json_report(results, runtime, path):
+    report = {
+        'runtime': runtime,
+        'count': len(results),
+        'passed': len([result for result in results if (result['status'] == RESULT_PASS)]),
+        'results': results,
+    }
+
+    with open(path, 'w') as file:
+        json.dump(report, file, indent = 4)
+
+def write_junit_report(results, runtime, path, grader_path):
+    suite = xml.etree.ElementTree.Element('testsuite', {
+        'name': os.path.basename(grader_path),
+        'tests': str(len(results)),
+        'failures': str(len([result for result in results
+                if (result['status'] == RESULT_FAIL)])),
+        'errors': str(len([result for result in results
+                if (result['status'] == RESULT_ERROR)])),
+        'time': "%.3f" % (runtime),
+    })
+
+    for result in results:
+        case = xml.etree.ElementTree.SubElement(suite, 'testcase', {
+            'classname': os.path.splitext(os.path.basename(grader_path))[0],
+            'name': os.path.basename(result['path']),
+            'time': "%.3f" % (result['runtime']),
+        })
+
+        if (result['status'] == RESULT_FAIL):
+            element = xml.etree.ElementTree.SubElement(case, 'failure',
+                    {'message': result['message']})
+        elif (result['status'] == RESULT_ERROR):
+            element = xml.etree.ElementTree.SubElement(case, 'error',
+                    {'message': (result['message'].splitlines() or [''])[-1]})
+            element.text = result['message']
+
+    xml.etree.ElementTree.ElementTree(suite).write(path, encoding = 'utf-8',
+            xml_declaration = True)
+
+def main(arguments):
+    if (arguments.watch):
+        try:
+            watch(arguments.grader_path, arguments.solutions_dir, workers = arguments.workers,
+                warm_up = arguments.warm_up, poll_sec = arguments.poll_sec)
+        except KeyboardInterrupt:
+            pass
+
+        return 0
+
+    return test_dir(arguments.grader_path, arguments.solutions_dir,
+            workers = arguments.workers, warm_up = arguments.warm_up,
+            json_path = arguments.json_path, junit_path = arguments.junit_path)
+
+def _load_args():
+    parser = argparse.ArgumentParser(description = 'Test a grader against a set of solutions.')
+
+    parser.add_argument('grader_path',
+        action = 'store', type = os.path.abspath,
+        help = 'The grader to test (must have a grade(path) function that returns an Assignment).')
+
+    parser.add_argument('solutions_dir',
+        action = 'store', type = os.path.abspath,
+        help = "A directory of solutions (.py), each with an '%s'." % (EXPECTED_POINTS_NAME))
+
+    parser.add_argument('--workers', dest = 'workers',
+        action = 'store', type = int, default = None,
+        help = 'The number of grading processes to use (default: the number of CPUs).')
+
+    parser.add_argument('--no-warm-up', dest = 'warm_up',
+        action = 'store_false', default = True,
+        help = 'Do not pre-import heavy modules in each worker (see cse40.utils.warm_up()).')
+
+    parser.add_argument('--json', dest = 'json_path',
+        action = 'store', type = str, default = None,
+        help = 'Write a JSON report here.')
 
-def main(grader_path, solutions_dir):
-    error_count = test_dir(grader_path, solutions_dir)
-    sys.exit(error_count)
+    parser.add_argument('--junit', dest = 'junit_path',
+        action = 'store', type = str, default = None,
+        help = 'Write a JUnit XML report here.')
 
-def _load_args(args):
-    args.pop(0)
-    if (len(args) != 2 or ({'h', 'help'} & {arg.lower().strip().replace('-', '') for arg in args})):
-        print("USAGE: python3 -m cse40.testgrader <grader path> <solution dir>", file = sys.stderr)
-        sys.exit(1)
+    parser.add_argument('--watch', dest = 'watch',
+        action = 'store_true', default = False,
+        help = 'Keep running and regrade solutions when they (or the grader) change.')
 
-    grader_path = os.path.abspath(args.pop(0))
-    solutions_dir = os.path.abspath(args.pop(0))
+    parser.add_argument('--poll', dest = 'poll_sec',
+        action = 'store', type = float, default = DEFAULT_POLL_SEC,
+        help = 'How often (in seconds) to check for changes when watching (default: %(default)s).')
 
-    return grader_path, solutions_dir
+    return parser.parse_args()
 
 if (__name__ == '__main__'):
-    main(*_load_args(sys.argv))
+    sys.exit(main(_load_args()))
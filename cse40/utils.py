@@ -1,40 +1,301 @@
 import atexit
-import multiprocessing
+import collections
+import gc
+import importlib
+import math
 import os
+import reprlib
 import shutil
+import signal
 import sys
 import tempfile
+import threading
 import time
 import traceback
+import types
 import uuid
 
+try:
+    import resource
+except ImportError:
+    # Windows.
+    resource = None
+
 import cse40.code
+import cse40.metrics
 
+# How long a killed child has to exit before it is counted as leaked (see get_reaper_stats()).
 REAP_TIME_SEC = 5
+REAP_POLL_SEC = 0.05
+
+# Heavy modules that most submissions (and graders) will end up importing.
+DEFAULT_PRELOAD_MODULES = ['numpy', 'pandas', 'sklearn']
+
+# The kinds of limits that can be exceeded (see invoke_with_limits()).
+LIMIT_CPU = 'cpu'
+LIMIT_MEMORY = 'memory'
+
+# Where in-memory workspaces are made (see Workspace).
+SHM_DIR = '/dev/shm'
+
+# The most history entries (of each kind) shown in a Mock's repr.
+MOCK_REPR_ENTRIES = 10
+
+# Grading children are always forked from the grading process (see warm_up()).
+# multiprocessing is slow to import, so this is loaded on first use (see _get_mp_context()).
+_mp_context = None
+
+class _Reaper(object):
+    """
+    Reap finished (or killed) grading children in a background thread,
+    so grading never has to wait for a child to actually exit.
+    Children that are still alive REAP_TIME_SEC after being handed over are given up on
+    and counted as leaked.
+    """
 
-class Mock(object):
     def __init__(self):
-        self.item_history = list()
-        self.attribute_history = list()
-        self.call_history = list()
+        self._condition = threading.Condition()
+        self._pending = []
+        self._thread = None
+        self._reaped = 0
+        self._leaked = 0
+
+    def add(self, process):
+        with self._condition:
+            self._pending.append((process, time.monotonic() + REAP_TIME_SEC))
+
+            if ((self._thread is None) or (not self._thread.is_alive())):
+                self._thread = threading.Thread(target = self._run, daemon = True)
+                self._thread.start()
+
+            self._condition.notify()
+
+    def get_stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'reaped': self._reaped,
+                'leaked': self._leaked,
+            }
+
+    def _run(self):
+        with self._condition:
+            while True:
+                if (len(self._pending) == 0):
+                    self._condition.wait()
+                    continue
+
+                now = time.monotonic()
+                still_pending = []
+
+                for (process, deadline) in self._pending:
+                    # is_alive() will reap (waitpid) the child if it has exited.
+                    if (not process.is_alive()):
+                        self._reaped += 1
+                    elif (now >= deadline):
+                        self._leaked += 1
+                    else:
+                        still_pending.append((process, deadline))
+
+                self._pending = still_pending
+
+                if (len(self._pending) > 0):
+                    self._condition.wait(REAP_POLL_SEC)
+
+_reaper = _Reaper()
+
+def _reset_reaper():
+    global _reaper
+    # A forked child does not get the reaper's thread (or any of the parent's children).
+    _reaper = _Reaper()
+
+if (hasattr(os, 'register_at_fork')):
+    os.register_at_fork(after_in_child = _reset_reaper)
+
+def get_reaper_stats():
+    """
+    Get counts of the grading children in this process that are
+    waiting to be reaped ('pending'), have been reaped ('reaped'),
+    or were still alive REAP_TIME_SEC after being killed ('leaked').
+    """
+
+    return _reaper.get_stats()
+
+class Mock(object):
+    """
+    An object that accepts any attribute access, item access, or call (and returns itself).
+    Useful for stubbing out APIs (e.g. plotting) in student code.
+
+    |history_size| controls how much history is kept:
+    None keeps everything, a positive int keeps only the most recent entries,
+    and 0 keeps no entries (only counts).
+    Counts are always exact.
+
+    A call is attributed to the attribute accessed right before it (e.g. `mock.plot(1)` is a call
+    to 'plot'), and calls to a directly called mock are attributed to None.
+    Query methods are prefixed with 'mock_' so they are unlikely to shadow the mocked API.
+    """
+
+    def __init__(self, history_size = None):
+        if ((history_size is not None) and (history_size < 0)):
+            raise ValueError("History size must be None or non-negative, got %d." % (history_size))
+
+        self._history_size = history_size
+
+        self.item_history = self._new_history()
+        self.attribute_history = self._new_history()
+        self.call_history = self._new_history()
+
+        self._item_count = 0
+        self._item_counts = collections.Counter()
+        self._attribute_counts = collections.Counter()
+        self._call_counts = collections.Counter()
+
+        # {name: history of (args, kwargs)}
+        self._named_calls = {}
+
+        # The attribute that the next call will be attributed to.
+        self._pending_name = None
 
     def __repr__(self):
         return "Mock -- Item History: %s, Attribute History: %s, Call History: %s" % (
-            str(self.item_history), str(self.attribute_history), str(self.call_history))
+            _repr_history(self.item_history, self._item_count),
+            _repr_history(self.attribute_history, sum(self._attribute_counts.values())),
+            _repr_history(self.call_history, sum(self._call_counts.values())))
 
     def __call__(self, *args, **kwargs):
-        self.call_history.append((args, kwargs))
+        name = self._pending_name
+        self._pending_name = None
+
+        self._call_counts[name] += 1
+
+        if (self._history_size != 0):
+            call = (args, kwargs)
+            self.call_history.append(call)
+
+            if (name not in self._named_calls):
+                self._named_calls[name] = self._new_history()
+            self._named_calls[name].append(call)
+
         return self
 
     def __getitem__(self, name):
-        self.item_history.append(name)
+        self._pending_name = None
+        self._item_count += 1
+
+        try:
+            self._item_counts[name] += 1
+        except TypeError:
+            # Unhashable keys (e.g. slices) are only counted in the total.
+            pass
+
+        if (self._history_size != 0):
+            self.item_history.append(name)
+
         return self
 
     def __getattr__(self, name):
-        self.attribute_history.append(name)
+        # Special lookups (e.g. __setstate__ from copy/pickle) may happen before __init__().
+        if (name.startswith('__') and name.endswith('__')):
+            raise AttributeError(name)
+
+        self._pending_name = name
+        self._attribute_counts[name] += 1
+
+        if (self._history_size != 0):
+            self.attribute_history.append(name)
+
         return self
 
-def _invoke_helper(result, function):
+    def mock_get_attribute_count(self, name = None):
+        """
+        Get the number of times an attribute (or any attribute if None) was accessed.
+        """
+
+        if (name is None):
+            return sum(self._attribute_counts.values())
+
+        return self._attribute_counts[name]
+
+    def mock_get_item_count(self, key = None):
+        """
+        Get the number of times an item (or any item if None) was accessed.
+        """
+
+        if (key is None):
+            return self._item_count
+
+        try:
+            return self._item_counts[key]
+        except TypeError:
+            return 0
+
+    def mock_get_call_count(self, name = None):
+        """
+        Get the number of calls to an attribute (or of all calls if None).
+        """
+
+        if (name is None):
+            return sum(self._call_counts.values())
+
+        return self._call_counts[name]
+
+    def mock_get_calls(self, name):
+        """
+        Get the kept (see |history_size|) calls to an attribute as a list of (args, kwargs).
+        """
+
+        return list(self._named_calls.get(name, []))
+
+    def mock_was_called_with(self, name, *args, **kwargs):
+        """
+        Check if an attribute was called with exactly these arguments.
+        Only kept (see |history_size|) calls are checked.
+        """
+
+        for call in self._named_calls.get(name, []):
+            if (call == (args, kwargs)):
+                return True
+
+        return False
+
+    def _new_history(self):
+        if (self._history_size is None):
+            return list()
+
+        return collections.deque(maxlen = self._history_size)
+
+def _repr_history(history, count):
+    """
+    Represent the most recent entries of a Mock's history (along with how many were left out).
+    """
+
+    start = max(0, len(history) - MOCK_REPR_ENTRIES)
+    entries = [history[i] for i in range(start, len(history))]
+    text = "[%s]" % (', '.join([reprlib.repr(entry) for entry in entries]))
+
+    if (count > len(entries)):
+        text = "(%d more) %s" % (count - len(entries), text)
+
+    return text
+
+def _invoke_helper(result, function, cpu_limit, memory_limit, spawn_start_time):
+    # Monotonic time is system-wide (on Linux), so it can be compared with the parent.
+    start_time = time.monotonic()
+
+    # Put the child (and anything it spawns) in its own process group,
+    # so everything can be killed together (see _kill_process_group()).
+    try:
+        os.setpgid(0, 0)
+    except OSError:
+        pass
+
+    # Forked children start with all of the parent's memory (e.g. preloaded modules),
+    # so limits and measurements are relative to where the child started.
+    base_rss = _get_memory_sizes()[1]
+
+    _apply_limits(cpu_limit, memory_limit)
+
     value = None
     error = None
 
@@ -43,59 +304,377 @@ def _invoke_helper(result, function):
     except Exception as ex:
         error = (ex, traceback.format_exc())
 
+    end_time = time.monotonic()
+
     sys.stdout.flush()
 
-    result.put((value, error))
+    usage = _measure_usage(base_rss)
+    usage['timings'] = {
+        cse40.metrics.STAGE_SPAWN: start_time - spawn_start_time,
+        cse40.metrics.STAGE_SCORING: end_time - start_time,
+        # Filled in by the parent once the result arrives.
+        cse40.metrics.STAGE_TRANSFER: time.monotonic(),
+    }
+
+    try:
+        result.send((value, error, usage))
+    except Exception:
+        # The value (or exception) could not be pickled.
+        result.send((None, (None, traceback.format_exc()), usage))
+
     result.close()
 
+def _kill_process_group(process):
+    """
+    SIGKILL a child and every process it started.
+    """
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # The group is already gone (or was never made), just make sure the child is dead.
+        process.kill()
+
+def _apply_limits(cpu_limit, memory_limit):
+    """
+    Limit the resources of the current process.
+    When the CPU limit is hit, the process will get a SIGXCPU (and a SIGKILL a second later).
+    The memory limit is how much more address space the process may use (on top of what it has now),
+    and when it is hit allocations will fail (MemoryError).
+    """
+
+    if (cpu_limit is not None):
+        seconds = max(1, math.ceil(cpu_limit))
+        resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+
+    if (memory_limit is not None):
+        limit = _get_memory_sizes()[0] + memory_limit
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _get_memory_sizes():
+    """
+    Get the (virtual, resident) size (in bytes) of the current process.
+    Both will be zero if they can not be read (outside of Linux).
+    """
+
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            parts = file.read().split()
+    except OSError:
+        return (0, 0)
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    return (int(parts[0]) * page_size, int(parts[1]) * page_size)
+
+def _measure_usage(base_rss = 0):
+    """
+    Get the CPU time (in seconds) and peak RSS (in bytes) used by this process and its children.
+    The peak RSS will not count the first |base_rss| bytes (e.g. memory inherited from a parent).
+    """
+
+    usage = {
+        'cpu_time': None,
+        'peak_memory': None,
+    }
+
+    if (resource is None):
+        return usage
+
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    usage['cpu_time'] = (self_usage.ru_utime + self_usage.ru_stime
+            + child_usage.ru_utime + child_usage.ru_stime)
+
+    # Linux reports in KB.
+    peak_rss = max(self_usage.ru_maxrss, child_usage.ru_maxrss) * 1024
+    usage['peak_memory'] = max(0, peak_rss - base_rss)
+
+    return usage
+
+def warm_up(modules = DEFAULT_PRELOAD_MODULES, freeze = True):
+    """
+    Turn the current process into a warm parent (zygote) for grading.
+    Each module in |modules| that is available will be imported once here,
+    so every child forked by invoke_with_timeout() will already have it loaded.
+    If |freeze| is true, then all surviving objects are moved into the GC's permanent generation
+    so children do not touch (and therefore copy) those pages when they collect.
+    Return the names of the modules that were loaded.
+    """
+
+    loaded = []
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            continue
+
+        loaded.append(module)
+
+    # Children are forked (so the parent needs multiprocessing loaded anyway).
+    _get_mp_context()
+
+    if (freeze):
+        gc.collect()
+        gc.freeze()
+
+    return loaded
+
+def _get_mp_context():
+    global _mp_context
+
+    if ((_mp_context is None) and sys.platform.startswith('linux')):
+        import multiprocessing
+        _mp_context = multiprocessing.get_context('fork')
+
+    return _mp_context
+
 # Return: (success, function return value)
 # On timeout, success will be false and the value will be None.
 # On error, success will be false and value will be the string stacktrace.
 # On successful completion, success will be true and value may be None (if nothing was returned).
 def invoke_with_timeout(timeout, function):
+    success, value, _ = invoke_with_limits(timeout, function)
+    return (success, value)
+
+# Return: (success, function return value, usage)
+# The same as invoke_with_timeout(), but the child can also have its CPU time (in seconds)
+# and memory (address space, in bytes) limited.
+# The memory limit is on top of what the child starts with (all of this process' memory).
+# Limits are only enforced on Linux.
+# If a limit is exceeded, success will be false, the value will be a message,
+# and usage['limit_exceeded'] will be one of the LIMIT_* constants.
+# Usage will also have the measured 'cpu_time' (seconds) and 'peak_memory'
+# (bytes, beyond what the child started with),
+# which will be None if they could not be measured (e.g. on a timeout),
+# and 'timings': {stage: seconds} for the spawn, scoring, and transfer stages (see cse40.metrics).
+# The child (and every process it started) is killed before returning,
+# and is reaped in the background (see get_reaper_stats()).
+def invoke_with_limits(timeout, function, cpu_limit = None, memory_limit = None):
     if (not sys.platform.startswith('linux')):
         # Mac and Windows have some pickling issues with multiprocessing.
-        # Just run them without a timeout.
+        # Just run them in-process (with a timer-based timeout when possible),
+        # and let any exception propagate (like it would without a sandbox).
         # Any autograder will be run on a Linux machine and will be safe.
-        start_time = time.time()
-        value = function()
-        runtime = time.time() - start_time
+        return _invoke_in_process(timeout, function, catch_errors = False)
 
-        if (runtime > timeout):
-            return (False, None)
+    usage = _new_usage()
 
-        return (True, value)
+    # Make sure the child's temp paths go in a workspace this process will remove
+    # (children exit without running any cleanup).
+    get_workspace().open()
 
-    result = multiprocessing.Queue(1)
+    context = _get_mp_context()
+    reader, writer = context.Pipe(duplex = False)
 
     # Note that we use processes instead of threads so they can be more completely killed.
-    process = multiprocessing.Process(target = _invoke_helper, args = (result, function))
+    process = context.Process(target = _invoke_helper,
+            args = (writer, function, cpu_limit, memory_limit, time.monotonic()))
     process.start()
 
-    # Wait for at most the timeout.
-    process.join(timeout)
+    # Also set the group from the parent, so there is no window where the child can't be killed.
+    try:
+        os.setpgid(process.pid, process.pid)
+    except OSError:
+        pass
+
+    # Only the child should hold the write end, so we see EOF if it exits without a result.
+    writer.close()
 
-    # Check to see if the process is still running.
-    if process.is_alive():
-        # Kill the long-running process.
-        process.terminate()
+    try:
+        # Wait for at most the timeout for a result (or the child exiting).
+        if (not reader.poll(timeout)):
+            # Immediately kill the long-running process (and anything it started),
+            # and let the reaper wait for it.
+            _kill_process_group(process)
+            _reaper.add(process)
+
+            return (False, None, usage)
+
+        try:
+            value, error, child_usage = reader.recv()
+
+            timings = child_usage['timings']
+            timings[cse40.metrics.STAGE_TRANSFER] = (time.monotonic()
+                    - timings[cse40.metrics.STAGE_TRANSFER])
+
+            usage.update(child_usage)
+        except EOFError:
+            # The process explicitly existed (like via sys.exit()), or was killed.
+            value, error = None, (None, 'Code explicitly exited (like via sys.exit()).')
+
+            # The child has closed its end of the pipe, so it is exiting. Get its exit status.
+            process.join(REAP_TIME_SEC)
+    except BaseException:
+        # Don't leave the child running if we are interrupted.
+        _kill_process_group(process)
+        _reaper.add(process)
+        raise
+    finally:
+        reader.close()
+
+    exitcode = process.exitcode
+
+    # The child is done with its work, but may still be alive (e.g. non-daemon threads)
+    # or have left processes behind.
+    _kill_process_group(process)
+    _reaper.add(process)
+
+    if ((cpu_limit is not None) and (exitcode == -signal.SIGXCPU)):
+        usage['limit_exceeded'] = LIMIT_CPU
+        return (False, "CPU time limit exceeded (%s seconds)." % (cpu_limit), usage)
 
-        # Try to reap the process once before just giving up on it.
-        process.join(REAP_TIME_SEC)
+    if (error is not None):
+        exception, stacktrace = error
 
-        return (False, None)
+        if ((memory_limit is not None) and isinstance(exception, MemoryError)):
+            usage['limit_exceeded'] = LIMIT_MEMORY
+            return (False, "Memory limit exceeded (%d MB)." % (memory_limit // (1024 * 1024)),
+                    usage)
 
-    # Check to see if the process explicitly existed (like via sys.exit()).
-    if (result.empty()):
-        return (False, 'Code explicitly exited (like via sys.exit()).')
+        return (False, stacktrace, usage)
 
-    value, error = result.get()
+    return (True, value, usage)
+
+class _InProcessTimeout(BaseException):
+    """
+    Raised (via SIGALRM) inside in-process code that has run out of time.
+    This is not an Exception, so code can't accidentally catch it with `except Exception`.
+    """
+
+    pass
+
+def invoke_in_process(timeout, function):
+    """
+    The same as invoke_with_limits() (without limits), but run the function in this process.
+    This avoids the cost of starting a process, but should only be used for trusted code:
+    the timeout is enforced with a SIGALRM timer (which can't interrupt long-running C calls),
+    and nothing the function does to this process is undone.
+    Timers only work on the main thread (and when no other timer is running),
+    so in other cases the function will be run in a process anyways.
+    """
+
+    if (sys.platform.startswith('linux') and (not _can_use_timer())):
+        return invoke_with_limits(timeout, function)
+
+    return _invoke_in_process(timeout, function)
+
+def _can_use_timer():
+    if (not hasattr(signal, 'setitimer')):
+        return False
+
+    if (threading.current_thread() is not threading.main_thread()):
+        return False
+
+    # Don't clobber someone else's timer.
+    return (signal.getitimer(signal.ITIMER_REAL)[0] == 0)
+
+def _invoke_in_process(timeout, function, catch_errors = True):
+    usage = _new_usage()
+    use_timer = _can_use_timer()
+
+    def handle_alarm(signum, frame):
+        raise _InProcessTimeout()
+
+    if (use_timer):
+        old_handler = signal.signal(signal.SIGALRM, handle_alarm)
+
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+
+    value = None
+    error = None
+    timed_out = False
+
+    try:
+        if (use_timer):
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+
+        try:
+            value = function()
+        finally:
+            if (use_timer):
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except _InProcessTimeout:
+        timed_out = True
+    except SystemExit:
+        if (not catch_errors):
+            raise
+
+        error = 'Code explicitly exited (like via sys.exit()).'
+    except Exception:
+        if (not catch_errors):
+            raise
+
+        error = traceback.format_exc()
+    finally:
+        if (use_timer):
+            signal.signal(signal.SIGALRM, old_handler)
+
+    runtime = time.perf_counter() - start_time
+    usage['cpu_time'] = time.process_time() - start_cpu_time
+    usage['timings'][cse40.metrics.STAGE_SCORING] = runtime
+
+    # Without a timer, we can only check the timeout after the fact.
+    if (timed_out or (runtime > timeout)):
+        return (False, None, usage)
 
     if (error is not None):
-        exception, stacktrace = error
-        return (False, stacktrace)
+        return (False, error, usage)
+
+    return (True, value, usage)
+
+def _new_usage():
+    return {
+        'cpu_time': None,
+        'peak_memory': None,
+        'limit_exceeded': None,
+        'timings': {},
+    }
+
+def copy_submission(submission):
+    """
+    Get a shallow copy of a submission namespace (see cse40.code.sanitize_and_import_code())
+    that can be scored in-process (see invoke_in_process()) without affecting later scoring.
+    Functions are rebound to a copy of their globals,
+    so rebinding names (e.g. with `global`) does not leak out of the copy.
+    Mutable values (e.g. lists) are still shared.
+    Other kinds of submissions (e.g. a single function) are returned as-is.
+    """
+
+    if (not isinstance(submission, (types.SimpleNamespace, types.ModuleType))):
+        return submission
+
+    namespace = dict(vars(submission))
+
+    # {id(original globals): copied globals, ...}
+    globals_copies = {}
+    # {id(original function): (original function, copied function), ...}
+    function_copies = {}
+
+    for value in namespace.values():
+        if ((not isinstance(value, types.FunctionType)) or (id(value) in function_copies)):
+            continue
+
+        if (id(value.__globals__) not in globals_copies):
+            globals_copies[id(value.__globals__)] = dict(value.__globals__)
 
-    return (True, value)
+        function = types.FunctionType(value.__code__, globals_copies[id(value.__globals__)],
+                value.__name__, value.__defaults__, value.__closure__)
+        function.__kwdefaults__ = value.__kwdefaults__
+        function.__qualname__ = value.__qualname__
+        function.__dict__.update(value.__dict__)
+
+        function_copies[id(value)] = (value, function)
+
+    # Point everything at the copied functions, so they call each other (and not the originals).
+    for names in [namespace] + list(globals_copies.values()):
+        for (name, value) in names.items():
+            copy = function_copies.get(id(value))
+            if ((copy is not None) and (copy[0] is value)):
+                names[name] = copy[1]
+
+    return types.SimpleNamespace(**namespace)
 
 def prepare_submission(path):
     """
@@ -104,21 +683,109 @@ def prepare_submission(path):
 
     return cse40.code.sanitize_and_import_path(path)
 
+class Workspace(object):
+    """
+    A temp directory that holds all the temp paths made (see get_temp_path()) while it is active.
+    Everything is removed in one operation when the workspace is closed.
+    The directory is made when the workspace is entered (or first used),
+    so that children forked while it is active (see invoke_with_limits()) share it
+    instead of making their own directory that would never be removed.
+
+    Use as a context manager (`with Workspace(): ...`) to make it the active workspace
+    for the current thread (workspaces can be nested).
+    If |in_memory| is True, then the workspace will be on SHM_DIR (when available).
+    """
+
+    def __init__(self, prefix = 'cse40-', in_memory = False):
+        self._prefix = prefix
+        self._base_dir = None
+        self._lock = threading.Lock()
+        self.path = None
+
+        if (in_memory and os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)):
+            self._base_dir = SHM_DIR
+
+    def __enter__(self):
+        self.open()
+        _get_workspace_stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        stack = _get_workspace_stack()
+        if (self in stack):
+            stack.remove(self)
+
+        self.close()
+
+    def get_path(self, prefix = '', suffix = ''):
+        """
+        Get a path inside this workspace (nothing is made at the path).
+        """
+
+        return os.path.join(self.open(), prefix + uuid.uuid4().hex + suffix)
+
+    def open(self):
+        """
+        Make the workspace's directory (if it does not already exist) and return its path.
+        """
+
+        with self._lock:
+            if (self.path is None):
+                self.path = tempfile.mkdtemp(prefix = self._prefix, dir = self._base_dir)
+
+            return self.path
+
+    def close(self):
+        with self._lock:
+            path = self.path
+            self.path = None
+
+        if (path is not None):
+            shutil.rmtree(path, ignore_errors = True)
+
+_workspaces = threading.local()
+
+# Holds temp paths made outside of any active workspace, removed on exit.
+_process_workspace = None
+_process_workspace_lock = threading.Lock()
+
+def _get_workspace_stack():
+    if (not hasattr(_workspaces, 'stack')):
+        _workspaces.stack = []
+
+    return _workspaces.stack
+
+def get_workspace():
+    """
+    Get the active workspace for the current thread,
+    or the process-wide workspace (which is removed on exit) if there is none.
+    """
+
+    global _process_workspace
+
+    stack = _get_workspace_stack()
+    if (len(stack) > 0):
+        return stack[-1]
+
+    with _process_workspace_lock:
+        if (_process_workspace is None):
+            _process_workspace = Workspace()
+            _process_workspace.open()
+            atexit.register(_process_workspace.close)
+
+        return _process_workspace
+
 def get_temp_path(prefix = '', suffix = '', rm = True):
     """
     Get a path to a valid temp dirent.
-    If rm is True, then the dirent will be attempted to be deleted on exit
-    (no error will occur if the path is not there).
+    If rm is True, then the path will be inside the active workspace (see get_workspace())
+    and will be removed with it (no error will occur if the path is not there).
     """
 
-    path = None
-    while ((path is None) or os.path.exists(path)):
-        path = os.path.join(tempfile.gettempdir(), prefix + str(uuid.uuid4()) + suffix)
-
     if (rm):
-        atexit.register(remove_dirent, path)
+        return get_workspace().get_path(prefix = prefix, suffix = suffix)
 
-    return path
+    return os.path.join(tempfile.gettempdir(), prefix + str(uuid.uuid4()) + suffix)
 
 def remove_dirent(path):
     if (not os.path.exists(path)):
@@ -1,12 +1,67 @@
 #!/usr/bin/env python3
 
+import argparse
+import concurrent.futures
+import io
+import json
 import os
 import re
 import sys
+import time
 import unittest
 
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
 TARGET_DIR = os.path.join('tests')
 
+# Test durations from previous runs ({test id: seconds}), used to balance shards.
+DURATIONS_PATH = os.path.join(THIS_DIR, '.test_durations.json')
+
+# The assumed duration of a test that has never been run (when there are no other durations).
+DEFAULT_DURATION_SEC = 0.1
+
+class _LineStream(object):
+    """
+    A stream with the writeln() that unittest.TextTestResult expects.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def writeln(self, text = None):
+        if (text is not None):
+            self._stream.write(text)
+
+        self._stream.write('\n')
+
+class _TimedTestResult(unittest.TextTestResult):
+    """
+    A result that also records how long each test took.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.durations = {}
+        self._startTime = None
+
+    def startTest(self, test):
+        self._startTime = time.perf_counter()
+        super().startTest(test)
+
+    def stopTest(self, test):
+        super().stopTest(test)
+        self.durations[test.id()] = time.perf_counter() - self._startTime
+
+class _TimedTestRunner(unittest.TextTestRunner):
+    resultclass = _TimedTestResult
+
+    def _makeResult(self):
+        self.lastResult = super()._makeResult()
+        return self.lastResult
+
 # Return a list of unittest.TestCase
 def _collect_tests(suite, testCases = []):
     if (isinstance(suite, unittest.TestCase)):
@@ -21,8 +76,148 @@ def _collect_tests(suite, testCases = []):
 
     return testCases
 
-def main(pattern = None):
-    runner = unittest.TextTestRunner(verbosity = 3)
+def _load_durations():
+    try:
+        with open(DURATIONS_PATH, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def _save_durations(durations):
+    # Keep the durations of tests that were not run this time (e.g. because of a pattern).
+    allDurations = _load_durations()
+    allDurations.update(durations)
+
+    tempPath = DURATIONS_PATH + '.tmp'
+    with open(tempPath, 'w') as file:
+        json.dump(allDurations, file, indent = 4, sort_keys = True)
+
+    os.replace(tempPath, DURATIONS_PATH)
+
+def _make_shards(testIds, jobs, durations):
+    """
+    Split the tests into (at most) |jobs| shards with about the same total duration.
+    The longest tests are placed first, each into the currently shortest shard.
+    """
+
+    knownDurations = [durations[testId] for testId in testIds if (testId in durations)]
+    if (len(knownDurations) > 0):
+        defaultDuration = sum(knownDurations) / len(knownDurations)
+    else:
+        defaultDuration = DEFAULT_DURATION_SEC
+
+    shards = [{'duration': 0.0, 'testIds': []} for _ in range(min(jobs, len(testIds)))]
+
+    testIds = sorted(testIds, key = lambda testId: durations.get(testId, defaultDuration),
+            reverse = True)
+
+    for testId in testIds:
+        shard = min(shards, key = lambda shard: shard['duration'])
+        shard['testIds'].append(testId)
+        shard['duration'] += durations.get(testId, defaultDuration)
+
+    # Run each shard in the usual (discovery) order.
+    return [sorted(shard['testIds']) for shard in shards]
+
+def _run_shard(testIds):
+    """
+    Run a shard of tests in a worker process.
+    Everything returned is plain data, so it can be sent back to the parent.
+    """
+
+    targetDir = os.path.abspath(TARGET_DIR)
+    if (targetDir not in sys.path):
+        sys.path.insert(0, targetDir)
+
+    tests = unittest.TestLoader().loadTestsFromNames(testIds)
+
+    stream = io.StringIO()
+    result = _TimedTestResult(_LineStream(stream), True, 3)
+    tests.run(result)
+
+    return {
+        'output': stream.getvalue(),
+        'testsRun': result.testsRun,
+        'failures': [(result.getDescription(test), text) for (test, text) in result.failures],
+        'errors': [(result.getDescription(test), text) for (test, text) in result.errors],
+        'skipped': len(result.skipped),
+        'expectedFailures': len(result.expectedFailures),
+        'unexpectedSuccesses': len(result.unexpectedSuccesses),
+        'durations': result.durations,
+    }
+
+def _run_parallel(tests, jobs):
+    """
+    Run the tests across |jobs| worker processes and print one merged summary.
+    Return True if all tests were successful.
+    """
+
+    testIds = [test.id() for test in tests]
+    shards = _make_shards(testIds, jobs, _load_durations())
+
+    print("Running %d tests in %d shards." % (len(testIds), len(shards)))
+
+    startTime = time.perf_counter()
+    results = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = len(shards)) as executor:
+        futures = [executor.submit(_run_shard, shard) for shard in shards]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            sys.stderr.write(result['output'])
+            sys.stderr.flush()
+
+            results.append(result)
+
+    runtime = time.perf_counter() - startTime
+
+    durations = {}
+    for result in results:
+        durations.update(result['durations'])
+
+    _save_durations(durations)
+
+    stream = _LineStream(sys.stderr)
+
+    for kind in ('errors', 'failures'):
+        flavour = 'ERROR' if (kind == 'errors') else 'FAIL'
+        for result in results:
+            for (description, text) in result[kind]:
+                stream.writeln(unittest.TextTestResult.separator1)
+                stream.writeln("%s: %s" % (flavour, description))
+                stream.writeln(unittest.TextTestResult.separator2)
+                stream.writeln(text)
+
+    testsRun = sum([result['testsRun'] for result in results])
+
+    stream.writeln(unittest.TextTestResult.separator2)
+    stream.writeln("Ran %d test%s in %.3fs" % (testsRun, '' if (testsRun == 1) else 's', runtime))
+    stream.writeln()
+
+    counts = [
+        ('failures', sum([len(result['failures']) for result in results])),
+        ('errors', sum([len(result['errors']) for result in results])),
+        ('skipped', sum([result['skipped'] for result in results])),
+        ('expected failures', sum([result['expectedFailures'] for result in results])),
+        ('unexpected successes', sum([result['unexpectedSuccesses'] for result in results])),
+    ]
+
+    infos = ["%s=%d" % (name, count) for (name, count) in counts if (count > 0)]
+    successful = (counts[0][1] == 0) and (counts[1][1] == 0) and (counts[4][1] == 0)
+
+    if (successful):
+        stream.write('OK')
+    else:
+        stream.write('FAILED')
+
+    if (len(infos) > 0):
+        stream.writeln(" (%s)" % (', '.join(infos)))
+    else:
+        stream.writeln()
+
+    return successful
+
+def main(pattern = None, jobs = 1):
     discoveredSuite = unittest.TestLoader().discover(TARGET_DIR)
     testCases = _collect_tests(discoveredSuite)
 
@@ -39,22 +234,37 @@ def main(pattern = None):
         else:
             print("Skipping %s because of match pattern." % (testCase.id()))
 
-    if not runner.run(tests).wasSuccessful():
-        sys.exit(1)
+    if ((jobs > 1) and (tests.countTestCases() > 1)):
+        if (not _run_parallel(list(tests), jobs)):
+            sys.exit(1)
 
-def _load_args(args):
-    executable = args.pop(0)
-    if (len(args) > 1 or ({'h', 'help'} & {arg.lower().strip().replace('-', '') for arg in args})):
-        print("USAGE: python3 %s [test pattern]" % (executable), file = sys.stderr)
-        print('The test pattern will be used directly in re.search() to see if a test will be run.',
-            file = sys.stderr)
+        return
+
+    runner = _TimedTestRunner(verbosity = 3)
+    successful = runner.run(tests).wasSuccessful()
+    _save_durations(runner.lastResult.durations)
+
+    if not successful:
         sys.exit(1)
 
-    pattern = None
-    if (len(args) > 0):
-        pattern = args.pop(0)
+def _load_args():
+    parser = argparse.ArgumentParser(description = 'Run the tests.')
+
+    parser.add_argument('pattern',
+        action = 'store', type = str, nargs = '?', default = None,
+        help = 'Only run tests whose id matches this pattern (using re.search()).')
+
+    parser.add_argument('-j', '--jobs', dest = 'jobs',
+        action = 'store', type = int, default = 1,
+        help = 'Split the tests across this many processes (default: %(default)s).'
+            + ' Shards are balanced using the durations of previous runs.')
+
+    arguments = parser.parse_args()
+
+    if (arguments.jobs < 1):
+        parser.error('--jobs must be at least 1.')
 
-    return (pattern, )
+    return (arguments.pattern, arguments.jobs)
 
 if __name__ == '__main__':
-    main(*_load_args(sys.argv))
+    main(*_load_args())
@@ -0,0 +1,20 @@
+import os
+
+import cse40.cache
+
+def use_cache_dir(test_case, cache_dir):
+    """
+    Point the default caches (see cse40.cache.get_cache_dir()) at |cache_dir|
+    until |test_case| is done, so tests never read or write the real caches.
+    """
+
+    old_cache_dir = os.environ.get(cse40.cache.CACHE_DIR_ENV)
+    os.environ[cse40.cache.CACHE_DIR_ENV] = cache_dir
+
+    test_case.addCleanup(_restore_cache_dir, old_cache_dir)
+
+def _restore_cache_dir(old_cache_dir):
+    if (old_cache_dir is None):
+        os.environ.pop(cse40.cache.CACHE_DIR_ENV, None)
+    else:
+        os.environ[cse40.cache.CACHE_DIR_ENV] = old_cache_dir
@@ -0,0 +1,30 @@
+import cse40.assignment
+import cse40.question
+import cse40.utils
+
+class Constant(cse40.question.Question):
+    def score_question(self, submission):
+        if (submission.SOME_CONSTANT == 1):
+            self.full_credit()
+        else:
+            self.fail("Wrong value for SOME_CONSTANT.")
+
+def grade(path):
+    submission = cse40.utils.prepare_submission(path)
+
+    assignment = cse40.assignment.Assignment('Test Grader', [Constant('Q1', 1)])
+    assignment.grade(submission)
+
+    return assignment
+
+def grade_iter(path):
+    """
+    The same as grade(), but yield each question as it is graded (see cse40.server).
+    """
+
+    submission = cse40.utils.prepare_submission(path)
+
+    assignment = cse40.assignment.Assignment('Test Grader', [Constant('Q1', 1)])
+    yield from assignment.grade_iter(submission)
+
+    return assignment
@@ -0,0 +1,3 @@
+EXPECTED_POINTS = 1
+
+SOME_CONSTANT = 1
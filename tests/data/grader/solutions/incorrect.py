@@ -0,0 +1,3 @@
+EXPECTED_POINTS = 0
+
+SOME_CONSTANT = 2
@@ -1,8 +1,11 @@
+import sys
 import unittest
 import time
 
-import cse40.question
 import cse40.assignment
+import cse40.code
+import cse40.metrics
+import cse40.question
 
 class TestAssignment(unittest.TestCase):
     class Q1(cse40.question.Question):
@@ -53,17 +56,147 @@ class TestAssignment(unittest.TestCase):
             time.sleep(0.25)
             return True
 
-        # Shorten the reap time for testing.
-        old_reap_time = cse40.utils.REAP_TIME_SEC
-        cse40.utils.REAP_TIME_SEC = 0.01
-
-        try:
-            assignment = cse40.assignment.Assignment('test_sleep_fail', questions)
-            assignment.grade(submission, show_exceptions = True)
-        finally:
-            cse40.utils.REAP_TIME_SEC = old_reap_time
+        assignment = cse40.assignment.Assignment('test_sleep_fail', questions)
+        assignment.grade(submission, show_exceptions = True)
 
         total_score, max_score = assignment.get_score()
 
         self.assertEqual(total_score, 0)
         self.assertEqual(max_score, 1)
+
+    def test_parallel(self):
+        questions = [TestAssignment.Q1('Q%d' % (i), 1) for i in range(4)]
+        questions.append(TestAssignment.Q1('QFail', 1, timeout = 0.05))
+
+        def submission():
+            time.sleep(0.2)
+            return True
+
+        assignment = cse40.assignment.Assignment('test_parallel', questions)
+
+        start_time = time.time()
+        score = assignment.grade(submission, show_exceptions = True,
+                parallel = True, workers = len(questions))
+        runtime = time.time() - start_time
+
+        self.assertEqual(score, 4)
+        self.assertEqual(assignment.get_score(), (4, 5))
+        self.assertLess(runtime, 0.2 * len(questions))
+
+        # Questions should be reported in their original order.
+        names = [question['name'] for question in assignment.to_dict()['questions']]
+        self.assertEqual(names, ['Q0', 'Q1', 'Q2', 'Q3', 'QFail'])
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Limits are only enforced on Linux.')
+    def test_limits(self):
+        questions = [
+            TestAssignment.Q1('Q1', 1),
+            TestAssignment.Q1('Q2', 1, cpu_limit = 5),
+        ]
+
+        cse40.assignment.Assignment('test_limits', questions, cpu_limit = 1)
+
+        # Only questions without their own limit get the assignment's limit.
+        self.assertEqual(questions[0].cpu_limit, 1)
+        self.assertEqual(questions[1].cpu_limit, 5)
+
+        def submission():
+            while True:
+                pass
+
+        question = TestAssignment.Q1('Q1', 1)
+        assignment = cse40.assignment.Assignment('test_limits', [question], cpu_limit = 1)
+        assignment.grade(submission)
+
+        self.assertEqual(assignment.get_score(), (0, 1))
+        self.assertIn('CPU time limit exceeded', question.message)
+
+        data = assignment.to_dict()['questions'][0]
+        self.assertEqual(data['cpu_limit'], 1)
+        self.assertIn('cpu_time', data)
+
+    def test_timings(self):
+        cse40.metrics.collect()
+        cse40.metrics.record(cse40.metrics.STAGE_EXTRACTION, 0.5)
+
+        questions = [TestAssignment.Q1('Q1', 1)]
+        assignment = cse40.assignment.Assignment('test_timings', questions)
+        assignment.grade(lambda: True)
+
+        timings = assignment.get_timings()
+        self.assertEqual(timings[cse40.metrics.STAGE_EXTRACTION], 0.5)
+        self.assertIn(cse40.metrics.STAGE_SCORING, timings)
+        self.assertIn(cse40.metrics.STAGE_TOTAL, timings)
+
+        self.assertIn(cse40.metrics.STAGE_SCORING, questions[0].timings)
+        self.assertEqual(assignment.to_dict()['timings'], timings)
+        self.assertIn('Timings:', assignment.report(show_timings = True))
+        self.assertNotIn('Timings:', assignment.report())
+
+        # Pending timings are only collected once.
+        assignment.grade(lambda: True)
+        self.assertNotIn(cse40.metrics.STAGE_EXTRACTION, assignment.get_timings())
+
+    def test_in_process(self):
+        class Bump(cse40.question.Question):
+            def score_question(self, submission):
+                # Rebind a global in the submission.
+                if (submission.bump() == 1):
+                    self.full_credit()
+
+        class Check(cse40.question.Question):
+            def score_question(self, submission):
+                if (submission.COUNT == 0):
+                    self.full_credit()
+
+        source = "COUNT = 0\ndef bump():\n    global COUNT\n    COUNT += 1\n    return COUNT\n"
+        submission = cse40.code.sanitize_and_import_code(source, 'submission.py')
+
+        questions = [
+            Bump('Bump 1', 1, in_process = True),
+            Bump('Bump 2', 1, in_process = True),
+            Check('Check', 1, in_process = True),
+        ]
+
+        assignment = cse40.assignment.Assignment('test_in_process', questions)
+        assignment.grade(submission, show_exceptions = True)
+
+        self.assertEqual(assignment.get_score(), (3, 3))
+        self.assertEqual(submission.COUNT, 0)
+        self.assertEqual(submission.bump(), 1)
+
+    def test_in_process_timeout(self):
+        questions = [
+            TestAssignment.Q1('Q1', 1, timeout = 0.05, in_process = True),
+        ]
+
+        def submission():
+            time.sleep(5)
+            return True
+
+        start_time = time.time()
+        assignment = cse40.assignment.Assignment('test_in_process_timeout', questions)
+        assignment.grade(submission)
+        runtime = time.time() - start_time
+
+        self.assertEqual(assignment.get_score(), (0, 1))
+        self.assertIn('Timeout', questions[0].message)
+        self.assertLess(runtime, 2)
+
+    def test_grade_iter(self):
+        questions = [TestAssignment.Q1('Q%d' % (i), 1) for i in range(3)]
+        assignment = cse40.assignment.Assignment('test_grade_iter', questions)
+
+        graded = []
+        for question in assignment.grade_iter(lambda: True):
+            # Each question is done as soon as it is yielded.
+            self.assertEqual(question.score, 1)
+            graded.append(question.name)
+
+        self.assertEqual(graded, ['Q0', 'Q1', 'Q2'])
+        self.assertEqual(assignment.get_score(), (3, 3))
+        self.assertIn(cse40.metrics.STAGE_TOTAL, assignment.get_timings())
+
+        graded = [question.name for question in assignment.grade_iter(lambda: True,
+                parallel = True, workers = 3)]
+        self.assertEqual(sorted(graded), ['Q0', 'Q1', 'Q2'])
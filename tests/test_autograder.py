@@ -2,11 +2,15 @@ import contextlib
 import functools
 import json
 import os
+import tempfile
 import types
 import unittest
 
 import cse40.assignment
 import cse40.autograder
+import cse40.cache
+
+import cache_helper
 
 THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
 DATA_DIR = os.path.join(THIS_DIR, "data")
@@ -18,9 +22,15 @@ class TestAutograder(unittest.TestCase):
     def setUp(self):
         self._backup_send_request = cse40.autograder._send_request
 
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+        cache_helper.use_cache_dir(self, self._temp_dir.name)
+
     def tearDown(self):
         cse40.autograder._send_request = self._backup_send_request
 
+        self._temp_dir.cleanup()
+
     def test_history(self):
         cse40.autograder._send_request = functools.partial(_mock_history_response, self)
 
@@ -48,7 +58,8 @@ class TestAutograder(unittest.TestCase):
 
         arguments = types.SimpleNamespace(config_path = CONFIG_PATH,
                 submission_path = SUBMISSION_PATH,
-                server = cse40.autograder.DEFAULT_AUTOGRADER_URL)
+                server = cse40.autograder.DEFAULT_AUTOGRADER_URL, delta = False,
+                stream = False, compress = False)
 
         with contextlib.redirect_stdout(None):
             result = cse40.autograder._submit(arguments)
@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import cse40.batch
+
+import cache_helper
+
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+DATA_DIR = os.path.join(THIS_DIR, "data")
+
+GRADER_PATH = os.path.join(DATA_DIR, 'grader', 'grader.py')
+SOLUTIONS_DIR = os.path.join(DATA_DIR, 'grader', 'solutions')
+
+SUPPORT_FLAG = '_SUPPORTS_MAX_TASKS_PER_CHILD'
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+        # Questions (e.g. style) may use their own caches, which should not be the real ones.
+        cache_helper.use_cache_dir(self, self._temp_dir.name)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_grade_dir(self):
+        output = io.StringIO()
+        stats = cse40.batch.grade_dir(GRADER_PATH, SOLUTIONS_DIR, output = output,
+                workers = 2, max_pending = 1, slowest_count = 1, warm_up = False)
+
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(len(stats['slowest']), 1)
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        scores = {os.path.basename(result['path']): result['assignment']['questions'][0]['score']
+                for result in results}
+
+        self.assertEqual(scores, {'correct.py': 1, 'incorrect.py': 0})
+
+    def test_max_tasks_per_child(self):
+        # Without support (before Python 3.11), the option is ignored instead of failing.
+        paths = cse40.batch.find_submissions(SOLUTIONS_DIR)
+
+        for supported in [True, False]:
+            with unittest.mock.patch.object(cse40.batch, SUPPORT_FLAG, supported):
+                results = list(cse40.batch.grade_paths(GRADER_PATH, paths, workers = 1,
+                        warm_up = False, max_tasks_per_child = 1))
+
+            self.assertEqual(len(results), 2)
+            self.assertEqual([result['status'] for result in results], ['success', 'success'])
+
+    def test_cached_style(self):
+        code = "SOME_CONSTANT = 1\n"
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            grader_path = os.path.join(temp_dir, 'grader.py')
+            with open(grader_path, 'w') as file:
+                file.write(STYLE_GRADER)
+
+            clean_path = os.path.join(temp_dir, 'clean.py')
+            with open(clean_path, 'w') as file:
+                file.write(code)
+
+            # The same code (once whitespace is stripped), but with style issues.
+            messy_path = os.path.join(temp_dir, 'messy.py')
+            with open(messy_path, 'w') as file:
+                file.write(code.rstrip() + "   \n\n\n")
+
+            results = list(cse40.batch.grade_paths(grader_path, [clean_path, messy_path],
+                    workers = 1, warm_up = False, cache_dir = os.path.join(temp_dir, 'cache')))
+
+        results = {os.path.basename(result['path']): result for result in results}
+
+        self.assertFalse(results['messy.py']['cached'])
+        self.assertEqual(results['clean.py']['assignment']['questions'][0]['score'], 5)
+        self.assertLess(results['messy.py']['assignment']['questions'][0]['score'], 5)
+
+STYLE_GRADER = """
+import cse40.assignment
+import cse40.style
+
+def grade(path):
+    assignment = cse40.assignment.Assignment('Style Grader', [cse40.style.Style(path)])
+    assignment.grade(None)
+
+    return assignment
+"""
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+
+import cse40.assignment
+import cse40.cache
+import cse40.question
+
+CODE = "SOME_CONSTANT = 1\n\ndef some_function():\n    return SOME_CONSTANT\n"
+WHITESPACE_CODE = "SOME_CONSTANT=1\ndef some_function():\n\n    return   SOME_CONSTANT  # Hi.\n"
+DIFFERENT_CODE = "SOME_CONSTANT = 2\n"
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._cache = cse40.cache.GradingCache(self._temp_dir.name)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_hash_source(self):
+        path = os.path.join(self._temp_dir.name, 'submission.py')
+
+        with open(path, 'w') as file:
+            file.write(CODE)
+        source_hash = cse40.cache.hash_source(path)
+
+        with open(path, 'w') as file:
+            file.write(CODE + "  \n\n")
+
+        self.assertNotEqual(cse40.cache.hash_source(path), source_hash)
+
+    def test_hash_dir(self):
+        package_dir = os.path.join(self._temp_dir.name, 'package')
+        os.makedirs(os.path.join(package_dir, 'sub'))
+
+        path = os.path.join(package_dir, 'sub', 'module.py')
+        with open(path, 'w') as file:
+            file.write(CODE)
+
+        dir_hash = cse40.cache.hash_dir(package_dir)
+
+        # Other files do not matter.
+        with open(os.path.join(package_dir, 'notes.txt'), 'w') as file:
+            file.write('Notes.')
+
+        self.assertEqual(cse40.cache.hash_dir(package_dir), dir_hash)
+
+        with open(path, 'w') as file:
+            file.write(DIFFERENT_CODE)
+
+        self.assertNotEqual(cse40.cache.hash_dir(package_dir), dir_hash)
+
+        self.assertEqual(cse40.cache.get_package_fingerprint(),
+                cse40.cache.hash_dir(cse40.cache.PACKAGE_DIR))
+
+    def test_grading_base(self):
+        assignment = _make_assignment(cse40.question.CACHE_SANITIZED)
+
+        self.assertIsNone(self._cache.get(CODE, 'grader'))
+        self.assertTrue(self._cache.put(CODE, 'grader', assignment))
+
+        self.assertEqual(self._cache.get(CODE, 'grader'), assignment.to_dict())
+        self.assertEqual(self._cache.get(WHITESPACE_CODE, 'grader'), assignment.to_dict())
+
+        self.assertIsNone(self._cache.get(DIFFERENT_CODE, 'grader'))
+        self.assertIsNone(self._cache.get(CODE, 'other_grader'))
+
+    def test_grading_policy_source(self):
+        assignment = _make_assignment(cse40.question.CACHE_SOURCE)
+
+        self.assertTrue(self._cache.put(CODE, 'grader', assignment))
+
+        self.assertEqual(self._cache.get(CODE, 'grader'), assignment.to_dict())
+        self.assertIsNone(self._cache.get(WHITESPACE_CODE, 'grader'))
+
+    def test_grading_policy_never(self):
+        assignment = _make_assignment(cse40.question.CACHE_NEVER)
+
+        self.assertFalse(self._cache.put(CODE, 'grader', assignment))
+        self.assertIsNone(self._cache.get(CODE, 'grader'))
+
+    def test_grading_syntax_error(self):
+        assignment = _make_assignment(cse40.question.CACHE_SANITIZED)
+
+        self.assertFalse(self._cache.put('def (', 'grader', assignment))
+        self.assertIsNone(self._cache.get('def (', 'grader'))
+
+    def test_eviction(self):
+        cache = cse40.cache.DiskCache(self._temp_dir.name, max_bytes = 250)
+
+        for i in range(5):
+            cache.put(str(i), 'x' * 100)
+            # Make sure the entry times are distinct.
+            os.utime(os.path.join(self._temp_dir.name, str(i) + '.json'), (i, i))
+
+        # Use an old entry so it becomes the most recently used.
+        self.assertIsNotNone(cache.get('3'))
+        cache.put('5', 'x' * 100)
+
+        self.assertIsNotNone(cache.get('3'))
+        self.assertIsNotNone(cache.get('5'))
+
+        for key in ['0', '1', '2', '4']:
+            self.assertIsNone(cache.get(key))
+
+def _make_assignment(policy):
+    questions = [
+        cse40.question.Question('Q1', 1),
+        cse40.question.Question('Q2', 1, cache_policy = policy),
+    ]
+
+    assignment = cse40.assignment.Assignment('Test', questions)
+    questions[0].full_credit()
+
+    return assignment
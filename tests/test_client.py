@@ -0,0 +1,308 @@
+import asyncio
+import gzip
+import http.server
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import cse40.assignment
+import cse40.autograder
+import cse40.cache
+import cse40.client
+
+import cache_helper
+
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+DATA_DIR = os.path.join(THIS_DIR, "data")
+
+CONFIG_PATH = os.path.join(DATA_DIR, 'autograder', 'config.json')
+SUBMISSION_PATH = os.path.join(DATA_DIR, 'simple.py')
+
+FAKE_ASSIGNMENT = cse40.assignment.Assignment('Test Assignment', [])
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+        cache_helper.use_cache_dir(self, self._temp_dir.name)
+
+        self._server = _FakeServer(('127.0.0.1', 0), _FakeHandler)
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+        self._thread.start()
+
+        self._url = "http://127.0.0.1:%d" % (self._server.server_address[1])
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+        self._temp_dir.cleanup()
+
+    def test_request_history(self):
+        success, result = cse40.autograder.request_history(CONFIG_PATH, self._url)
+
+        self.assertTrue(success)
+        self.assertEqual(result, [{'id': '1', 'score': [2, 3], 'user': 'sslug'}])
+
+    def test_request_submit(self):
+        success, result = cse40.autograder.request_submit(CONFIG_PATH, SUBMISSION_PATH, self._url)
+
+        self.assertTrue(success)
+        self.assertEqual(result, FAKE_ASSIGNMENT)
+        self.assertIn('SOME_CONSTANT', self._server.requests[-1]['code'])
+
+    def test_history_unusable_cache(self):
+        # The cache directory can not be created (its parent is a file).
+        parent_path = os.path.join(self._temp_dir.name, 'file')
+        with open(parent_path, 'w') as file:
+            file.write('')
+
+        os.environ[cse40.cache.CACHE_DIR_ENV] = os.path.join(parent_path, 'cache')
+        self.assertIsNone(cse40.client.get_history_cache())
+
+        success, result = cse40.autograder.request_history(CONFIG_PATH, self._url)
+        self.assertTrue(success)
+        self.assertEqual(result, [{'id': '1', 'score': [2, 3], 'user': 'sslug'}])
+
+        # A cache that breaks after being created is also skipped.
+        cache_dir = os.path.join(self._temp_dir.name, 'history')
+        cache = cse40.cache.DiskCache(cache_dir)
+        os.rmdir(cache_dir)
+
+        fetch = cse40.client.HistoryFetch({'cruzid': 'sslug'}, self._url, cache = cache)
+        fetch.handle({'history': [{'id': '1'}], 'etag': 'abc'})
+        self.assertEqual(fetch.get_history(), [{'id': '1'}])
+
+    def test_failure(self):
+        configs = [{'cruzid': 'bad'}]
+        results = cse40.client.run(cse40.client.history_many(configs, self._url))
+
+        self.assertEqual(results, [(False, 'Unknown user.')])
+
+    def test_history_many(self):
+        configs = [{'cruzid': "user-%02d" % (i)} for i in range(20)]
+        results = cse40.client.run(cse40.client.history_many(configs, self._url,
+                max_connections = 2))
+
+        self.assertEqual(len(results), len(configs))
+        for (config, (success, history)) in zip(configs, results):
+            self.assertTrue(success)
+            self.assertEqual(history[0]['user'], config['cruzid'])
+
+        # Connections are kept alive and reused.
+        self.assertLessEqual(self._server.connections, 2)
+
+    def test_chunked(self):
+        configs = [{'cruzid': 'sslug', 'chunked': True}] * 3
+        results = cse40.client.run(cse40.client.repeat_many(configs, self._url,
+                max_connections = 1))
+
+        self.assertEqual(results, [(True, FAKE_ASSIGNMENT)] * 3)
+        self.assertEqual(self._server.connections, 1)
+
+    def test_timeout(self):
+        configs = [{'cruzid': 'slow'}, {'cruzid': 'sslug'}]
+
+        start_time = time.time()
+        results = cse40.client.run(cse40.client.history_many(configs, self._url,
+                timeout = 0.2))
+
+        self.assertLess(time.time() - start_time, 1.0)
+        self.assertFalse(results[0][0])
+        self.assertIn('Timed out', results[0][1])
+        self.assertTrue(results[1][0])
+
+    def test_slow_submit(self):
+        # Grading can take longer than the timeout (which only applies to other requests).
+        results = cse40.client.run(cse40.client.submit_many([({'cruzid': 'slow'}, '')],
+                self._url, timeout = 0.2))
+
+        self.assertEqual(results, [(True, FAKE_ASSIGNMENT)])
+
+        async def submit():
+            async with cse40.client.Client(self._url, submit_timeout = 0.2) as client:
+                return await cse40.client.capture(client.submit({'cruzid': 'slow'}, ''))
+
+        success, message = cse40.client.run(submit())
+        self.assertFalse(success)
+        self.assertIn('Timed out', message)
+
+    def test_slow_request_submit(self):
+        # Plain (not streamed, delta, or compressed) submissions also wait on grading.
+        config = {'cruzid': 'slow', 'task': cse40.client.TASK_SUBMIT, 'code': ''}
+        body, message = cse40.autograder._send_request(config, self._url, timeout = 0.2)
+
+        self.assertIsNone(message)
+        self.assertEqual(cse40.assignment.Assignment.from_dict(body['assignment']),
+                FAKE_ASSIGNMENT)
+
+        # Other requests are still limited by the timeout.
+        config['task'] = cse40.client.TASK_REPEAT
+        body, message = cse40.autograder._send_request(config, self._url, timeout = 0.2)
+
+        self.assertIsNone(body)
+        self.assertIn('Timed out', message)
+
+    def test_bad_response(self):
+        results = cse40.client.run(cse40.client.submit_many([({'cruzid': 'garbage'}, '')],
+                self._url))
+
+        self.assertFalse(results[0][0])
+        self.assertIn('bad response', results[0][1])
+
+        body, message = cse40.autograder._send_request({'cruzid': 'garbage'}, self._url)
+        self.assertIsNone(body)
+        self.assertIn('bad response', message)
+
+    def test_unreachable(self):
+        # Get a port that nothing is listening on.
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            url = "http://127.0.0.1:%d" % (sock.getsockname()[1])
+
+        results = cse40.client.run(cse40.client.history_many([{'cruzid': 'sslug'}], url))
+
+        self.assertFalse(results[0][0])
+        self.assertIn('Could not reach', results[0][1])
+
+    def test_run_in_loop(self):
+        # Sync functions still work when called from inside an event loop (e.g. a notebook).
+        async def call():
+            return cse40.autograder.request_history(CONFIG_PATH, self._url)
+
+        success, _ = asyncio.run(call())
+        self.assertTrue(success)
+
+    def test_compressed(self):
+        source_code = "SOME_CONSTANT = 1\n" * 1000
+        self._server.gzip_responses = True
+
+        results = cse40.client.run(cse40.client.submit_many([({}, source_code)], self._url,
+                compress = True))
+
+        self.assertEqual(results, [(True, FAKE_ASSIGNMENT)])
+        self.assertEqual(self._server.encodings, ['gzip'])
+        self.assertEqual(self._server.requests[0]['code'], source_code)
+
+    def test_no_compression_by_default(self):
+        source_code = "SOME_CONSTANT = 1\n" * 1000
+
+        results = cse40.client.run(cse40.client.submit_many([({}, source_code)], self._url))
+
+        self.assertEqual(results, [(True, FAKE_ASSIGNMENT)])
+        self.assertEqual(self._server.encodings, [None])
+
+    def test_compression_fallback(self):
+        source_code = "SOME_CONSTANT = 1\n" * 1000
+        self._server.accept_gzip = False
+
+        results = cse40.client.run(cse40.client.submit_many([({}, source_code)] * 2, self._url,
+                max_connections = 1, compress = True))
+
+        self.assertEqual(results, [(True, FAKE_ASSIGNMENT)] * 2)
+        # Once the server rejects compression, the client stops trying.
+        self.assertEqual(self._server.encodings, ['gzip', None, None])
+
+    def test_delta(self):
+        for _ in range(2):
+            success, result = cse40.autograder.request_submit(CONFIG_PATH, SUBMISSION_PATH,
+                    self._url, delta = True)
+
+            self.assertTrue(success)
+            self.assertEqual(result, FAKE_ASSIGNMENT)
+
+        # Only the first submission needed to upload the code.
+        uploads = ['code' in request for request in self._server.requests]
+        self.assertEqual(uploads, [False, True, False])
+
+class _FakeServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.connections = 0
+        self.requests = []
+
+        # The Content-Encoding of each request.
+        self.encodings = []
+        self.accept_gzip = True
+        self.gzip_responses = False
+
+        self.known_code = set()
+
+class _FakeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        data = self.rfile.read(length)
+
+        encoding = self.headers.get('Content-Encoding')
+        self.server.encodings.append(encoding)
+
+        if (encoding == 'gzip'):
+            if (not self.server.accept_gzip):
+                self.send_response(cse40.client.HTTP_UNSUPPORTED_MEDIA_TYPE)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            data = gzip.decompress(data)
+
+        config = json.loads(data.decode(cse40.client.ENCODING))
+        self.server.requests.append(config)
+
+        if ('code' in config):
+            self.server.known_code.add(cse40.client.hash_code(config['code']))
+
+        user = config.get('cruzid')
+        if (user == 'slow'):
+            time.sleep(1.0)
+
+        if (user == 'bad'):
+            body = {'status': 'failure', 'message': 'Unknown user.'}
+        elif (('code_hash' in config) and ('code' not in config)
+                and (config['code_hash'] not in self.server.known_code)):
+            body = {'status': cse40.client.STATUS_NEED_CODE}
+        elif (config.get('task', cse40.client.TASK_HISTORY) == cse40.client.TASK_HISTORY):
+            body = {'status': 'success', 'history': [{'id': '1', 'score': [2, 3], 'user': user}]}
+        else:
+            body = {'status': 'success', 'assignment': FAKE_ASSIGNMENT.to_dict()}
+
+        data = json.dumps(body).encode(cse40.client.ENCODING)
+        if (user == 'garbage'):
+            data = b'Not JSON.'
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+
+        if (self.server.gzip_responses and ('gzip' in self.headers.get('Accept-Encoding', ''))):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+
+        if (config.get('chunked', False)):
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            for i in range(0, len(data), 16):
+                chunk = data[i:(i + 16)]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
@@ -1,4 +1,10 @@
+import importlib
+import json
 import os
+import shutil
+import sys
+import tempfile
+import traceback
 import unittest
 
 import cse40.code
@@ -17,6 +23,67 @@ class TestImport(unittest.TestCase):
             source_code = cse40.code.extract_code(path)
             self.assertEqual(source_code, "SOME_CONSTANT = 1")
 
+    def test_extract_notebook_cells(self):
+        path = os.path.join(DATA_DIR, 'bad_style.ipynb')
+        cells = cse40.code.extract_notebook_cells(path)
+
+        self.assertEqual([index for (index, _) in cells], [0, 3])
+        self.assertEqual(cells[0][1], "import random\n\nSOME_CONSTANT=1")
+
+        self.assertEqual(cse40.code.extract_notebook_code(path),
+                "\n".join([cell_code for (_, cell_code) in cells]) + "\n")
+
+    def test_extract_notebook_outputs(self):
+        notebook = {
+            'metadata': {'numbers': [1, -2.5e3, None, True, False]},
+            'cells': [
+                {
+                    'outputs': [
+                        {'data': {'image/png': 'A' * 10000, 'text/html': ['<b>{[', ']}"']}},
+                    ],
+                    'source': ["SOME_CONSTANT = '\\\"{['\n", 'x = 1'],
+                    'cell_type': 'code',
+                },
+                {
+                    'cell_type': 'markdown',
+                    'source': 'Some [text].',
+                },
+                {
+                    'cell_type': 'code',
+                    'source': 'y = 2',
+                    'outputs': [],
+                },
+            ],
+        }
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'notebook.ipynb')
+            with open(path, 'w') as file:
+                json.dump(notebook, file, indent = 1)
+
+            cells = cse40.code.extract_notebook_cells(path)
+
+        self.assertEqual(cells, [(0, "SOME_CONSTANT = '\\\"{['\nx = 1"), (2, 'y = 2')])
+
+    def test_extract_notebook_limits(self):
+        path = os.path.join(DATA_DIR, 'bad_style.ipynb')
+
+        old_max_bytes = cse40.code.MAX_NOTEBOOK_BYTES
+        old_max_cells = cse40.code.MAX_NOTEBOOK_CELLS
+
+        try:
+            cse40.code.MAX_NOTEBOOK_BYTES = 10
+            with self.assertRaisesRegex(ValueError, 'too large'):
+                cse40.code.extract_notebook_cells(path)
+
+            cse40.code.MAX_NOTEBOOK_BYTES = old_max_bytes
+            cse40.code.MAX_NOTEBOOK_CELLS = 2
+            with self.assertRaisesRegex(ValueError, 'Too many cells'):
+                cse40.code.extract_notebook_cells(path)
+        finally:
+            cse40.code.MAX_NOTEBOOK_BYTES = old_max_bytes
+            cse40.code.MAX_NOTEBOOK_CELLS = old_max_cells
+
     def test_import_base(self):
         for ext in ['py', 'ipynb']:
             # The code should be executed, causing some_int to become -1.
@@ -44,3 +111,102 @@ class TestImport(unittest.TestCase):
                 self.assertIn('random', dir(module))
                 self.assertNotIn('some_int', dir(module))
                 self.assertIn('some_function', dir(module))
+
+    def test_import_notebook_in_memory(self):
+        path = os.path.join(DATA_DIR, 'base_with_raise.ipynb')
+
+        try:
+            cse40.code.import_path(path)
+            self.fail("Import with raise did not fail as expected.")
+        except RuntimeError:
+            stacktrace = traceback.format_exc()
+
+        # The traceback should point at the notebook and show the extracted code.
+        self.assertIn('File "%s", line 13' % (path), stacktrace)
+        self.assertIn('raise RuntimeError()', stacktrace)
+
+        path = os.path.join(DATA_DIR, 'base.ipynb')
+        module_a = cse40.code.import_path(path, module_name = 'module_a')
+        module_b = cse40.code.import_path(path, module_name = 'module_b')
+
+        self.assertEqual(module_a.__file__, path)
+        self.assertEqual(module_a.__name__, 'module_a')
+        self.assertEqual(module_b.__name__, 'module_b')
+        self.assertIsNot(module_a, module_b)
+        self.assertEqual(module_b.some_int, -1)
+
+    def test_notebook_finder(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(temp_dir.name, 'cse40_notebook_only.ipynb')
+        shutil.copyfile(os.path.join(DATA_DIR, 'simple.ipynb'), path)
+
+        cse40.code.install_notebook_finder()
+        sys.path.insert(0, temp_dir.name)
+
+        try:
+            module = importlib.import_module('cse40_notebook_only')
+            self.assertEqual(module.SOME_CONSTANT, 1)
+            self.assertEqual(module.__file__, path)
+        finally:
+            sys.path.remove(temp_dir.name)
+            sys.modules.pop('cse40_notebook_only', None)
+            sys.meta_path.remove(cse40.code._notebook_finder)
+            temp_dir.cleanup()
+
+    def test_code_cache(self):
+        cse40.code.clear_code_cache()
+
+        source_code = "import random\n\nSOME_CONSTANT = 1\n\nsome_int = 2\n"
+
+        module = cse40.code.sanitize_and_import_code(source_code, 'a.py')
+        self.assertEqual(module.SOME_CONSTANT, 1)
+        self.assertEqual(cse40.code.get_code_cache_stats(),
+                {'hits': 0, 'disk_hits': 0, 'misses': 1})
+
+        module = cse40.code.sanitize_and_import_code(source_code, 'a.py')
+        self.assertEqual(module.SOME_CONSTANT, 1)
+        self.assertNotIn('some_int', dir(module))
+        self.assertEqual(cse40.code.get_code_cache_stats(),
+                {'hits': 1, 'disk_hits': 0, 'misses': 1})
+
+        # A different filename is a different code object.
+        cse40.code.sanitize_and_import_code(source_code, 'b.py')
+        self.assertEqual(cse40.code.get_code_cache_stats()['misses'], 2)
+
+    def test_code_cache_disk(self):
+        cse40.code.clear_code_cache()
+
+        source_code = "SOME_CONSTANT = 1\n"
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cse40.code.set_code_cache_dir(temp_dir)
+
+            try:
+                cse40.code.sanitize_and_import_code(source_code, 'a.py')
+                self.assertEqual(len(os.listdir(temp_dir)), 1)
+
+                # Drop the in-memory cache so the disk has to be used.
+                cse40.code.clear_code_cache()
+
+                module = cse40.code.sanitize_and_import_code(source_code, 'a.py')
+                self.assertEqual(module.SOME_CONSTANT, 1)
+                self.assertEqual(cse40.code.get_code_cache_stats(),
+                        {'hits': 0, 'disk_hits': 1, 'misses': 0})
+            finally:
+                cse40.code.set_code_cache_dir(None)
+
+    def test_code_cache_disk_eviction(self):
+        cse40.code.clear_code_cache()
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cse40.code.set_code_cache_dir(temp_dir, max_bytes = 4096)
+
+            try:
+                for i in range(50):
+                    cse40.code.sanitize_and_import_code("SOME_CONSTANT = %d\n" % (i), 'a.py')
+
+                paths = [os.path.join(temp_dir, name) for name in os.listdir(temp_dir)]
+                self.assertLess(len(paths), 50)
+                self.assertLessEqual(sum([os.path.getsize(path) for path in paths]), 4096)
+            finally:
+                cse40.code.set_code_cache_dir(None)
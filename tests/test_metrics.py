@@ -0,0 +1,54 @@
+import unittest
+
+import cse40.metrics
+
+class TestMetrics(unittest.TestCase):
+    def test_registry(self):
+        registry = cse40.metrics.Registry()
+        registry.observe('a', 1.0)
+        registry.observe('a', 3.0)
+        registry.observe('b', 0.5)
+
+        self.assertEqual(registry.to_dict(), {
+            'a': {'count': 2, 'sum': 4.0, 'max': 3.0},
+            'b': {'count': 1, 'sum': 0.5, 'max': 0.5},
+        })
+
+        text = registry.to_prometheus()
+        self.assertIn('# TYPE cse40_stage_seconds summary', text)
+        self.assertIn('cse40_stage_seconds_sum{stage="a"} 4.000000', text)
+        self.assertIn('cse40_stage_seconds_count{stage="a"} 2', text)
+        self.assertIn('cse40_stage_seconds_max{stage="b"} 0.500000', text)
+
+        registry.reset()
+        self.assertEqual(registry.to_dict(), {})
+
+    def test_collect(self):
+        cse40.metrics.collect()
+
+        with cse40.metrics.timed('test_stage'):
+            pass
+
+        cse40.metrics.record('test_stage', 1.0)
+        cse40.metrics.record('other_stage', 1.0, pending = False)
+
+        timings = cse40.metrics.collect()
+        self.assertEqual(list(timings.keys()), ['test_stage'])
+        self.assertGreaterEqual(timings['test_stage'], 1.0)
+
+        self.assertEqual(cse40.metrics.collect(), {})
+
+    def test_scope(self):
+        cse40.metrics.collect()
+
+        # Recorded for some other work (and never collected).
+        cse40.metrics.record('outside_stage', 1.0)
+
+        with cse40.metrics.scope():
+            cse40.metrics.record('inside_stage', 1.0)
+            self.assertEqual(cse40.metrics.collect(), {'inside_stage': 1.0})
+
+            # Left uncollected.
+            cse40.metrics.record('inside_stage', 1.0)
+
+        self.assertEqual(cse40.metrics.collect(), {'outside_stage': 1.0})
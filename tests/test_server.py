@@ -0,0 +1,263 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import types
+import unittest
+import urllib.error
+import urllib.request
+
+import cse40.autograder
+import cse40.cache
+import cse40.code
+import cse40.server
+import cse40.utils
+
+import cache_helper
+
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+DATA_DIR = os.path.join(THIS_DIR, "data")
+
+GRADER_PATH = os.path.join(DATA_DIR, 'grader', 'grader.py')
+CORRECT_PATH = os.path.join(DATA_DIR, 'grader', 'solutions', 'correct.py')
+INCORRECT_PATH = os.path.join(DATA_DIR, 'grader', 'solutions', 'incorrect.py')
+
+ASSIGNMENT_NAME = 'HO0'
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+        cache_helper.use_cache_dir(self, self._temp_dir.name)
+
+        self._data_dir = cse40.utils.get_temp_path(prefix = 'server-')
+        self._config_path = cse40.utils.get_temp_path(suffix = '.json')
+
+        with open(self._config_path, 'w') as file:
+            json.dump({'cruzid': 'sslug', 'password': '1234', 'assignment': ASSIGNMENT_NAME}, file)
+
+        self._release = threading.Event()
+        self._release.set()
+
+        graders = {
+            ASSIGNMENT_NAME: cse40.code.import_path(GRADER_PATH),
+            'blocking': types.SimpleNamespace(grade = self._blocking_grade),
+        }
+
+        self._server = cse40.server.GradingServer(graders, data_dir = self._data_dir,
+                users = {'sslug': '1234'}, port = 0, workers = 1, queue_size = 1)
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+        self._thread.start()
+
+        self._url = self._server.get_url()
+
+    def tearDown(self):
+        self._release.set()
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+        self._temp_dir.cleanup()
+
+    def _blocking_grade(self, path):
+        self._release.wait()
+        raise ValueError('Not a real grader.')
+
+    def test_submit(self):
+        success, result = cse40.autograder.request_submit(self._config_path, CORRECT_PATH,
+                self._url)
+        self.assertTrue(success)
+        self.assertEqual(result.get_score(), (1, 1))
+
+        success, result = cse40.autograder.request_submit(self._config_path, INCORRECT_PATH,
+                self._url)
+        self.assertTrue(success)
+        self.assertEqual(result.get_score(), (0, 1))
+
+        success, history = cse40.autograder.request_history(self._config_path, self._url)
+        self.assertTrue(success)
+        self.assertEqual([row['score'] for row in history], [[1, 1], [0, 1]])
+        self.assertLess(int(history[0]['id']), int(history[1]['id']))
+
+        success, result = cse40.autograder.request_repeat(self._config_path, self._url)
+        self.assertTrue(success)
+        self.assertEqual(result.get_score(), (0, 1))
+
+        stats = json.loads(urllib.request.urlopen(self._url + '/stats').read())
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['latency']['count'], 2)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_stream(self):
+        questions = []
+
+        success, result = cse40.autograder.request_submit(self._config_path, CORRECT_PATH,
+                self._url, on_question = questions.append)
+
+        self.assertTrue(success)
+        self.assertEqual(result.get_score(), (1, 1))
+        self.assertEqual([(question.name, question.score) for question in questions], [('Q1', 1)])
+
+        success, history = cse40.autograder.request_history(self._config_path, self._url)
+        self.assertEqual(len(history), 1)
+
+    def test_stream_cli(self):
+        for stream in (True, False):
+            arguments = types.SimpleNamespace(config_path = self._config_path,
+                    submission_path = CORRECT_PATH, server = self._url, delta = False,
+                    stream = stream, compress = False)
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                result = cse40.autograder._submit(arguments)
+
+            self.assertEqual(result, 0)
+
+            # Each question is only shown once (whether it was streamed or not).
+            self.assertEqual(output.getvalue().count('Q1: 1 / 1'), 1)
+            self.assertIn('Total: 1 / 1', output.getvalue())
+
+    def test_history_cache(self):
+        responses = []
+        handle_task = self._server.handle_task
+
+        def record_task(config):
+            status, body = handle_task(config)
+            if (config.get('task') == 'history'):
+                responses.append(body)
+
+            return status, body
+
+        self._server.handle_task = record_task
+
+        for path in [CORRECT_PATH, INCORRECT_PATH, CORRECT_PATH]:
+            cse40.autograder.request_submit(self._config_path, path, self._url)
+
+        # Paginated (one row at a time) and cached.
+        success, history = cse40.autograder.request_history(self._config_path, self._url,
+                page_size = 1)
+        self.assertTrue(success)
+        self.assertEqual([row['score'] for row in history], [[1, 1], [0, 1], [1, 1]])
+        self.assertEqual([len(response['history']) for response in responses], [1, 1, 1])
+
+        # Nothing new.
+        responses.clear()
+        success, cached_history = cse40.autograder.request_history(self._config_path, self._url)
+        self.assertEqual(cached_history, history)
+        self.assertEqual(len(responses), 1)
+        self.assertTrue(responses[0]['not_modified'])
+
+        # Only the new row is sent.
+        cse40.autograder.request_submit(self._config_path, INCORRECT_PATH, self._url)
+
+        responses.clear()
+        success, new_history = cse40.autograder.request_history(self._config_path, self._url)
+        self.assertEqual(new_history[:3], history)
+        self.assertEqual(new_history[3]['score'], [0, 1])
+        self.assertEqual(len(responses[0]['history']), 1)
+        self.assertTrue(responses[0]['partial'])
+
+        # Without the cache, everything is sent.
+        responses.clear()
+        success, uncached_history = cse40.autograder.request_history(self._config_path, self._url,
+                use_cache = False)
+        self.assertEqual(uncached_history, new_history)
+        self.assertEqual(len(responses[0]['history']), 4)
+
+    def test_delta(self):
+        for _ in range(2):
+            success, result = cse40.autograder.request_submit(self._config_path, CORRECT_PATH,
+                    self._url, delta = True)
+
+            self.assertTrue(success)
+            self.assertEqual(result.get_score(), (1, 1))
+
+        self.assertEqual(len(os.listdir(os.path.join(self._data_dir, 'code'))), 1)
+
+    def test_bad_password(self):
+        with open(self._config_path, 'w') as file:
+            json.dump({'cruzid': 'sslug', 'password': 'nope', 'assignment': ASSIGNMENT_NAME}, file)
+
+        success, message = cse40.autograder.request_history(self._config_path, self._url)
+
+        self.assertFalse(success)
+        self.assertIn('password', message)
+
+    def test_gzip_bomb(self):
+        config = {'cruzid': 'sslug', 'password': '1234', 'assignment': ASSIGNMENT_NAME,
+                'task': cse40.autograder.TASK_HISTORY}
+        data = json.dumps(config).encode()
+        padding = b' ' * (cse40.server.MAX_REQUEST_BYTES)
+
+        request = urllib.request.Request(self._url, data = gzip.compress(data + padding),
+                headers = {'Content-Encoding': 'gzip'})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request)
+
+        self.assertEqual(context.exception.code, cse40.server.HTTP_PAYLOAD_TOO_LARGE)
+
+        # Small (and multi-member) bodies are still fine.
+        body = gzip.compress(data[:10]) + gzip.compress(data[10:])
+        request = urllib.request.Request(self._url, data = body,
+                headers = {'Content-Encoding': 'gzip'})
+        with urllib.request.urlopen(request) as response:
+            self.assertEqual(json.loads(response.read())['status'], 'success')
+
+        request = urllib.request.Request(self._url, data = gzip.compress(data)[:-4],
+                headers = {'Content-Encoding': 'gzip'})
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request)
+
+        self.assertEqual(context.exception.code, cse40.server.HTTP_BAD_REQUEST)
+
+    def test_backpressure(self):
+        self._release.clear()
+        service = self._server.service
+
+        path = self._server.code.put('SOME_CONSTANT = 1')
+
+        # One submission being graded, and one waiting in the queue.
+        running = service.submit('blocking', path)
+        _wait_for(lambda: service.get_stats()['queue_depth'] == 0)
+        queued = service.submit('blocking', path)
+
+        self.assertIsNotNone(running)
+        self.assertIsNotNone(queued)
+        self.assertIsNone(service.submit('blocking', path))
+
+        config = {
+            'cruzid': 'sslug',
+            'password': '1234',
+            'assignment': 'blocking',
+            'task': 'submit',
+            'code': 'SOME_CONSTANT = 1',
+        }
+
+        request = urllib.request.Request(self._url, data = json.dumps(config).encode())
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(request)
+
+        self.assertEqual(context.exception.code, cse40.server.HTTP_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(context.exception.headers['Retry-After']), 1)
+
+        self._release.set()
+        self.assertRaises(ValueError, running.result)
+        self.assertRaises(ValueError, queued.result)
+
+        stats = service.get_stats()
+        self.assertEqual(stats['rejected'], 2)
+        self.assertEqual(stats['errors'], 2)
+
+def _wait_for(condition, timeout = 5.0):
+    event = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if (condition()):
+            return True
+
+        event.wait(0.01)
+
+    return condition()
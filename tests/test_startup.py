@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+ROOT_DIR = os.path.dirname(THIS_DIR)
+
+# Modules that each entry point should only load once they are actually needed.
+LAZY_MODULES = {
+    'cse40.autograder': ['multiprocessing', 'flake8', 'cse40.utils', 'cse40.code'],
+    'cse40.style': ['multiprocessing', 'flake8', 'cse40.utils'],
+    'cse40.utils': ['multiprocessing'],
+}
+
+# The most time (in microseconds) that importing an entry point may take.
+# The best of a few runs is used, to smooth over a noisy machine.
+IMPORT_BUDGET_USEC = 250000
+IMPORT_RUNS = 3
+
+class TestStartup(unittest.TestCase):
+    def test_lazy_modules(self):
+        for (module, lazy_modules) in LAZY_MODULES.items():
+            loaded = _get_loaded_modules(module)
+
+            for lazy_module in lazy_modules:
+                self.assertFalse(lazy_module in loaded,
+                        "'%s' was loaded by importing '%s'." % (lazy_module, module))
+
+    def test_import_time(self):
+        for module in ['cse40.autograder', 'cse40.style']:
+            import_time = min([_get_import_time(module) for _ in range(IMPORT_RUNS)])
+
+            self.assertLess(import_time, IMPORT_BUDGET_USEC,
+                    "Importing '%s' took %d us (budget: %d us)." % (module, import_time,
+                    IMPORT_BUDGET_USEC))
+
+def _run_python(*args):
+    result = subprocess.run([sys.executable] + list(args), cwd = ROOT_DIR,
+            capture_output = True, text = True, check = True)
+
+    return result.stdout, result.stderr
+
+def _get_loaded_modules(module):
+    code = "import json, sys, %s; print(json.dumps(sorted(sys.modules)))" % (module)
+    stdout, _ = _run_python('-c', code)
+
+    return set(json.loads(stdout))
+
+def _get_import_time(module):
+    """
+    Get the cumulative time (in microseconds) that importing a module took (see `-X importtime`).
+    """
+
+    _, stderr = _run_python('-X', 'importtime', '-c', "import %s" % (module))
+
+    # Lines look like: "import time: self [us] | cumulative | imported package".
+    for line in stderr.splitlines():
+        parts = line.split('|')
+        if ((len(parts) == 3) and (parts[2].strip() == module)):
+            return int(parts[1])
+
+    raise ValueError("Could not find the import time for '%s'." % (module))
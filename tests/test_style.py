@@ -0,0 +1,242 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import cse40.cache
+import cse40.code
+import cse40.style
+
+import cache_helper
+
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+DATA_DIR = os.path.join(THIS_DIR, "data")
+
+BAD_CODE = "import os\nx=1 \n"
+
+class TestStyle(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+        cache_helper.use_cache_dir(self, self._temp_dir.name)
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_check_source(self):
+        violations = cse40.style.get_engine().check_source(BAD_CODE)
+
+        self.assertEqual([(violation.code, violation.line, violation.column)
+                for violation in violations], [('F401', 1, 1), ('E225', 2, 2), ('W291', 2, 4)])
+
+    def test_check_source_clean(self):
+        self.assertEqual(cse40.style.get_engine().check_source("SOME_CONSTANT = 1"), [])
+
+    def test_check_style(self):
+        for ext in ['py', 'ipynb']:
+            path = os.path.join(DATA_DIR, 'base.' + ext)
+            count, lines = cse40.style.check_style(path)
+
+            self.assertEqual(count, 0)
+            self.assertEqual(lines, [])
+
+    def test_check_paths(self):
+        paths = [os.path.join(DATA_DIR, basename) for basename in
+                ['base.py', 'base.ipynb', 'simple.py', 'simple.ipynb']]
+        results = cse40.style.get_engine().check_paths(paths)
+
+        self.assertEqual(results, {path: [] for path in paths})
+
+    def test_unusable_cache(self):
+        # The cache directory can not be created (its parent is a file).
+        parent_path = os.path.join(self._temp_dir.name, 'file')
+        with open(parent_path, 'w') as file:
+            file.write('')
+
+        os.environ[cse40.cache.CACHE_DIR_ENV] = os.path.join(parent_path, 'cache')
+
+        self.assertEqual(len(cse40.style.check_source(BAD_CODE)), 3)
+
+        count, _ = cse40.style.check_style(os.path.join(DATA_DIR, 'base.py'))
+        self.assertEqual(count, 0)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Processes are only used on Linux.')
+    def test_style_question_engine(self):
+        with unittest.mock.patch.dict(cse40.style._engines, clear = True):
+            question = cse40.style.Style(os.path.join(DATA_DIR, 'base.py'))
+            self.assertEqual(len(cse40.style._engines), 1)
+
+            # The (forked) child scoring the question should reuse the engine built above.
+            with unittest.mock.patch.object(cse40.style, 'StyleEngine', _fail_style_engine):
+                question.grade(None)
+
+        self.assertEqual(question.score, question.max_points)
+
+    def test_engine_internals(self):
+        # If this fails, a flake8 update broke the internals that the engine uses
+        # (and style is being checked with the slower public API).
+        self.assertTrue(cse40.style.get_engine().uses_internals())
+
+    def test_engine_public_api(self):
+        def broken_internals():
+            raise AttributeError('Missing internals.')
+
+        stderr = io.StringIO()
+        with unittest.mock.patch.object(cse40.style, '_load_source_checker', broken_internals):
+            with contextlib.redirect_stderr(stderr):
+                engine = cse40.style.StyleEngine()
+
+        self.assertFalse(engine.uses_internals())
+        self.assertIn('Missing internals.', stderr.getvalue())
+
+        path = os.path.join(self._temp_dir.name, 'bad.py')
+        with open(path, 'w') as file:
+            file.write(BAD_CODE)
+
+        paths = [path, os.path.join(DATA_DIR, 'base.py'), os.path.join(DATA_DIR, 'base.ipynb')]
+
+        # The public API should give the same results as the internals.
+        expected_engine = cse40.style.get_engine()
+        self.assertEqual(engine.check_source(BAD_CODE), expected_engine.check_source(BAD_CODE))
+        self.assertEqual(engine.check_file(path), expected_engine.check_file(path))
+        self.assertEqual(engine.check_paths(paths), expected_engine.check_paths(paths))
+        self.assertEqual(len(engine.check_file(path)), 3)
+
+    def test_format_violations(self):
+        violations = cse40.style.get_engine().check_source(BAD_CODE)
+        lines = cse40.style.format_violations(violations, 'assignment.py')
+
+        self.assertEqual(lines[0:3], [
+            "assignment.py:1:1: F401 'os' imported but unused",
+            'import os',
+            '^',
+        ])
+
+    def test_cache(self):
+        expected = cse40.style.check_source(BAD_CODE)
+        self.assertEqual(len(expected), 3)
+
+        # Cache hits should not need the engine at all.
+        old_get_engine = cse40.style.get_engine
+        cse40.style.get_engine = _fail_get_engine
+
+        try:
+            self.assertEqual(cse40.style.check_source(BAD_CODE), expected)
+
+            with self.assertRaises(AssertionError):
+                cse40.style.check_source(BAD_CODE + "y=2\n")
+        finally:
+            cse40.style.get_engine = old_get_engine
+
+    def test_package_version(self):
+        import flake8
+
+        self.assertEqual(cse40.style._get_package_version('flake8'), flake8.__version__)
+        self.assertEqual(cse40.style._get_package_version('not_a_real_package'), '')
+
+        # Without importlib.metadata (before Python 3.8), the package is imported instead.
+        with unittest.mock.patch.dict(sys.modules, {'importlib.metadata': None}):
+            self.assertEqual(cse40.style._get_package_version('flake8'), flake8.__version__)
+            self.assertEqual(cse40.style._get_package_version('not_a_real_package'), '')
+
+    def test_check_notebook(self):
+        path = os.path.join(DATA_DIR, 'bad_style.ipynb')
+        violations = cse40.style.check_notebook(path)
+
+        # Note that the import used in another cell is not reported.
+        self.assertEqual([(violation.code, violation.cell, violation.line, violation.column)
+                for violation in violations], [
+            ('E225', 0, 3, 14),
+            ('W291', 3, 2, 44),
+            ('F821', 3, 5, 7),
+        ])
+
+        count, lines = cse40.style.check_style(path, replace_output_path = 'assignment.ipynb')
+        self.assertEqual(count, 3)
+        self.assertEqual(lines[0],
+                'assignment.ipynb (cell 1):3:14: E225 missing whitespace around operator')
+
+    def test_check_notebook_across_cells(self):
+        # Cells are checked on their own, but an import after another cell's code is still E402.
+        path = os.path.join(self._temp_dir.name, 'cells.ipynb')
+        _write_notebook(path, ["SOME_CONSTANT = 1", "import os\n\nprint(os.sep)"])
+
+        violations = cse40.style.check_notebook(path)
+        self.assertEqual([(violation.code, violation.cell, violation.line, violation.column)
+                for violation in violations], [
+            ('E402', 1, 1, 1),
+        ])
+
+    def test_check_notebook_matches_whole(self):
+        # Checking cell by cell should give the same results as checking all the code at once.
+        notebooks = [
+            # Docstrings before imports.
+            ['"""Doc."""', "import os\nprint(os.sep)"],
+            ['"""Doc."""', '"""Two."""', "import os\nprint(os.sep)"],
+            # Conditional imports and semicolons.
+            ["try:\n    import numpy\nexcept ImportError:\n    numpy = None", "import os\nx = 1"],
+            ["x = 1; import os", "import sys\nprint(os, sys, x)"],
+            # The first indent in the notebook decides what mixed indentation is.
+            ["def f():\n\treturn 1", "def g():\n    return 2\n\n\nx = [1,\n    2]"],
+            ["class A:\n    def f(self):\n        pass\n    def g(self):\n        pass", "x = 1"],
+            # Cells that are not valid on their own (so the whole notebook is checked).
+            ["x = (", "1)"],
+        ]
+
+        for (i, cells) in enumerate(notebooks):
+            path = os.path.join(self._temp_dir.name, "%d.ipynb" % (i))
+            _write_notebook(path, cells)
+
+            whole_violations = cse40.style.check_source(cse40.code.extract_notebook_code(path))
+            expected = cse40.style._map_to_cells(cse40.code.extract_notebook_cells(path),
+                    whole_violations)
+
+            self.assertEqual(sorted(cse40.style.check_notebook(path)), sorted(expected),
+                    "Notebook %d: %s" % (i, cells))
+
+    def test_check_notebook_incremental(self):
+        path = os.path.join(self._temp_dir.name, 'cells.ipynb')
+        cells = ["import os", "SOME_CONSTANT = 1", "print(os.sep)"]
+
+        _write_notebook(path, cells)
+        expected = cse40.style.check_notebook(path)
+
+        # Only the edited cell (and the names over the whole notebook) should be checked again.
+        checked = []
+        old_get_engine = cse40.style.get_engine
+
+        def get_engine(options = cse40.style.STYLE_OPTIONS):
+            checked.append(options['select'])
+            return old_get_engine(options)
+
+        _write_notebook(path, cells[:-1] + ["print(os.sep )"])
+
+        with unittest.mock.patch.object(cse40.style, 'get_engine', get_engine):
+            violations = cse40.style.check_notebook(path)
+
+        self.assertEqual(sorted(checked), ['E,W', 'F'])
+        self.assertEqual(expected, [])
+        self.assertEqual([(violation.code, violation.cell, violation.line)
+                for violation in violations], [('E202', 2, 1)])
+
+def _fail_get_engine(options = None):
+    raise AssertionError('Engine used on a cache hit.')
+
+def _fail_style_engine(options = None):
+    raise AssertionError('Style engine built while scoring.')
+
+def _write_notebook(path, cells):
+    notebook = {
+        'cells': [{'cell_type': 'code', 'metadata': {}, 'outputs': [], 'execution_count': None,
+                'source': cell.splitlines(True)} for cell in cells],
+        'metadata': {},
+        'nbformat': 4,
+        'nbformat_minor': 5,
+    }
+
+    with open(path, 'w') as file:
+        json.dump(notebook, file)
@@ -0,0 +1,143 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree
+
+import cse40.testgrader
+
+THIS_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+DATA_DIR = os.path.join(THIS_DIR, "data")
+
+GRADER_PATH = os.path.join(DATA_DIR, 'grader', 'grader.py')
+SOLUTIONS_DIR = os.path.join(DATA_DIR, 'grader', 'solutions')
+
+class TestTestGrader(unittest.TestCase):
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    def test_read_expected_points(self):
+        path = os.path.join(self._temp_dir.name, 'solution.py')
+        with open(path, 'w') as file:
+            file.write("import sys\nEXPECTED_POINTS: int = 5\nsys.exit(1)\n")
+
+        self.assertEqual(cse40.testgrader.read_expected_points(path), 5)
+
+        with open(path, 'w') as file:
+            file.write("SOME_CONSTANT = 1\n")
+
+        self.assertIsNone(cse40.testgrader.read_expected_points(path))
+
+        with open(path, 'w') as file:
+            file.write("EXPECTED_POINTS = len('abc')\n")
+
+        self.assertRaises(ValueError, cse40.testgrader.read_expected_points, path)
+
+    def test_dir(self):
+        json_path = os.path.join(self._temp_dir.name, 'report.json')
+        junit_path = os.path.join(self._temp_dir.name, 'report.xml')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            error_count = cse40.testgrader.test_dir(GRADER_PATH, SOLUTIONS_DIR, workers = 2,
+                    warm_up = False, json_path = json_path, junit_path = junit_path)
+
+        self.assertEqual(error_count, 0)
+
+        with open(json_path, 'r') as file:
+            report = json.load(file)
+
+        self.assertEqual(report['count'], 2)
+        self.assertEqual(report['passed'], 2)
+        self.assertEqual([(os.path.basename(result['path']), result['score'])
+                for result in report['results']], [('correct.py', 1), ('incorrect.py', 0)])
+
+        suite = xml.etree.ElementTree.parse(junit_path).getroot()
+        self.assertEqual(suite.get('tests'), '2')
+        self.assertEqual(suite.get('failures'), '0')
+        self.assertEqual(len(suite.findall('testcase')), 2)
+
+    def test_dir_failures(self):
+        solutions_dir = os.path.join(self._temp_dir.name, 'solutions')
+        shutil.copytree(SOLUTIONS_DIR, solutions_dir)
+
+        # Wrong expected points.
+        with open(os.path.join(solutions_dir, 'wrong.py'), 'w') as file:
+            file.write("EXPECTED_POINTS = 0\nSOME_CONSTANT = 1\n")
+
+        # No expected points.
+        with open(os.path.join(solutions_dir, 'missing.py'), 'w') as file:
+            file.write("SOME_CONSTANT = 1\n")
+
+        junit_path = os.path.join(self._temp_dir.name, 'report.xml')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            error_count = cse40.testgrader.test_dir(GRADER_PATH, solutions_dir, workers = 2,
+                    warm_up = False, junit_path = junit_path)
+
+        self.assertEqual(error_count, 2)
+
+        suite = xml.etree.ElementTree.parse(junit_path).getroot()
+        self.assertEqual(suite.get('failures'), '1')
+        self.assertEqual(suite.get('errors'), '1')
+
+    def test_watcher(self):
+        grader_path = os.path.join(self._temp_dir.name, 'grader.py')
+        shutil.copyfile(GRADER_PATH, grader_path)
+
+        solutions_dir = os.path.join(self._temp_dir.name, 'solutions')
+        shutil.copytree(SOLUTIONS_DIR, solutions_dir)
+
+        correct_path = os.path.join(solutions_dir, 'correct.py')
+        incorrect_path = os.path.join(solutions_dir, 'incorrect.py')
+
+        watcher = cse40.testgrader.Watcher(grader_path, solutions_dir, workers = 1,
+                warm_up = False)
+
+        changes = watcher.check()
+        self.assertEqual([(path, old) for (path, old, _) in changes],
+                [(correct_path, None), (incorrect_path, None)])
+        self.assertEqual([result['status'] for result in watcher.get_results()],
+                [cse40.testgrader.RESULT_PASS] * 2)
+
+        # Nothing changed.
+        self.assertEqual(watcher.check(), [])
+
+        # Only the mtime changed.
+        _touch(correct_path)
+        self.assertEqual(watcher.check(), [])
+
+        # Only the edited solution is regraded.
+        with open(incorrect_path, 'w') as file:
+            file.write("EXPECTED_POINTS = 0\nSOME_CONSTANT = 1\n")
+        _touch(incorrect_path)
+
+        changes = watcher.check()
+        self.assertEqual(len(changes), 1)
+
+        (path, old_result, new_result) = changes[0]
+        self.assertEqual(path, incorrect_path)
+        self.assertEqual(old_result['score'], 0)
+        self.assertEqual(new_result['score'], 1)
+        self.assertEqual(new_result['status'], cse40.testgrader.RESULT_FAIL)
+
+        # A removed solution is reported.
+        os.remove(incorrect_path)
+        self.assertEqual(watcher.check(), [(incorrect_path, new_result, None)])
+
+        # A grader change regrades everything.
+        with open(grader_path, 'a') as file:
+            file.write("\n# Edited.\n")
+        _touch(grader_path)
+
+        self.assertEqual([path for (path, _, _) in watcher.check()], [correct_path])
+
+def _touch(path):
+    # Make sure the mtime changes, even on filesystems with a coarse resolution.
+    stat = os.stat(path)
+    os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
@@ -0,0 +1,307 @@
+import gc
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+import unittest.mock
+
+import cse40.metrics
+import cse40.utils
+
+class TestUtils(unittest.TestCase):
+    def test_invoke_base(self):
+        self.assertEqual(cse40.utils.invoke_with_timeout(1, lambda: 1), (True, 1))
+        self.assertEqual(cse40.utils.invoke_with_timeout(1, lambda: None), (True, None))
+
+    def test_invoke_error(self):
+        def raise_error():
+            raise ValueError('Some error.')
+
+        success, value = cse40.utils.invoke_with_timeout(1, raise_error)
+
+        self.assertFalse(success)
+        self.assertIn('Some error.', value)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Processes are only used on Linux.')
+    def test_invoke_exit(self):
+        success, value = cse40.utils.invoke_with_timeout(1, lambda: sys.exit(0))
+
+        self.assertFalse(success)
+        self.assertIn('explicitly exited', value)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Processes are only used on Linux.')
+    def test_invoke_unpicklable(self):
+        success, value = cse40.utils.invoke_with_timeout(1, lambda: (lambda: None))
+
+        self.assertFalse(success)
+        self.assertIsNotNone(value)
+
+    def test_warm_up(self):
+        try:
+            loaded = cse40.utils.warm_up(['json', 'not_a_real_module'])
+            self.assertEqual(loaded, ['json'])
+            self.assertGreater(gc.get_freeze_count(), 0)
+
+            self.assertEqual(cse40.utils.invoke_with_timeout(1, lambda: 2), (True, 2))
+        finally:
+            gc.unfreeze()
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Limits are only enforced on Linux.')
+    def test_invoke_usage(self):
+        success, value, usage = cse40.utils.invoke_with_limits(1, lambda: 1)
+
+        self.assertTrue(success)
+        self.assertEqual(value, 1)
+        self.assertIsNone(usage['limit_exceeded'])
+        self.assertGreaterEqual(usage['cpu_time'], 0.0)
+
+        # Memory is measured beyond what the child started with, which can be nothing here.
+        self.assertGreaterEqual(usage['peak_memory'], 0)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Limits are only enforced on Linux.')
+    def test_invoke_cpu_limit(self):
+        def spin():
+            while True:
+                pass
+
+        success, value, usage = cse40.utils.invoke_with_limits(10, spin, cpu_limit = 1)
+
+        self.assertFalse(success)
+        self.assertEqual(usage['limit_exceeded'], cse40.utils.LIMIT_CPU)
+        self.assertIn('CPU time limit exceeded', value)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Limits are only enforced on Linux.')
+    def test_invoke_memory_limit(self):
+        memory_limit = 64 * 1024 * 1024
+
+        success, value, usage = cse40.utils.invoke_with_limits(10,
+                lambda: len(bytearray(512 * 1024 * 1024)), memory_limit = memory_limit)
+
+        self.assertFalse(success)
+        self.assertEqual(usage['limit_exceeded'], cse40.utils.LIMIT_MEMORY)
+        self.assertIn('Memory limit exceeded', value)
+
+        # The limit is on top of the (possibly large) memory the child starts with.
+        success, value, usage = cse40.utils.invoke_with_limits(10,
+                lambda: len(bytearray(16 * 1024 * 1024)), memory_limit = memory_limit)
+
+        self.assertTrue(success)
+        self.assertEqual(value, 16 * 1024 * 1024)
+
+        # Only the child's own memory is measured.
+        self.assertGreater(usage['peak_memory'], 8 * 1024 * 1024)
+        self.assertLess(usage['peak_memory'], memory_limit)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Processes are only used on Linux.')
+    def test_invoke_timeout_kills_group(self):
+        pid_path = cse40.utils.get_temp_path(suffix = '.txt')
+
+        def spawn_and_sleep():
+            child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])
+            with open(pid_path, 'w') as file:
+                file.write(str(child.pid))
+
+            time.sleep(60)
+
+        start_stats = cse40.utils.get_reaper_stats()
+
+        start_time = time.time()
+        success, value = cse40.utils.invoke_with_timeout(1, spawn_and_sleep)
+        runtime = time.time() - start_time
+
+        self.assertFalse(success)
+        self.assertIsNone(value)
+
+        # The timeout should not wait on the child exiting.
+        self.assertLess(runtime, 1 + (cse40.utils.REAP_TIME_SEC / 2))
+
+        with open(pid_path, 'r') as file:
+            grandchild_pid = int(file.read())
+
+        self.assertTrue(_wait_for(lambda: not _is_running(grandchild_pid)))
+        self.assertTrue(_wait_for(lambda:
+                cse40.utils.get_reaper_stats()['reaped'] > start_stats['reaped']))
+        self.assertEqual(cse40.utils.get_reaper_stats()['leaked'], start_stats['leaked'])
+
+    def test_invoke_in_process(self):
+        self.assertEqual(cse40.utils.invoke_in_process(1, lambda: 1)[:2], (True, 1))
+
+        def raise_error():
+            raise ValueError('Some error.')
+
+        success, value, _ = cse40.utils.invoke_in_process(1, raise_error)
+        self.assertFalse(success)
+        self.assertIn('Some error.', value)
+
+        # Catching Exception should not stop the timeout.
+        def stubborn_sleep():
+            try:
+                time.sleep(5)
+            except Exception:
+                time.sleep(5)
+
+        start_time = time.time()
+        success, value, usage = cse40.utils.invoke_in_process(0.1, stubborn_sleep)
+
+        self.assertEqual((success, value), (False, None))
+        self.assertLess(time.time() - start_time, 2)
+        self.assertIn(cse40.metrics.STAGE_SCORING, usage['timings'])
+
+    def test_invoke_non_linux(self):
+        def raise_error():
+            raise ValueError('Some error.')
+
+        # Without processes, errors propagate to the caller (like they always have).
+        with unittest.mock.patch.object(sys, 'platform', 'darwin'):
+            success, value, _ = cse40.utils.invoke_with_limits(1, lambda: 1)
+            self.assertEqual((success, value), (True, 1))
+
+            with self.assertRaisesRegex(ValueError, 'Some error.'):
+                cse40.utils.invoke_with_limits(1, raise_error)
+
+            with self.assertRaises(SystemExit):
+                cse40.utils.invoke_with_limits(1, lambda: sys.exit(0))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Processes are only used on Linux.')
+    def test_invoke_in_process_fallback(self):
+        # Off the main thread, a process has to be used to enforce the timeout.
+        results = []
+        thread = threading.Thread(target = lambda:
+                results.append(cse40.utils.invoke_in_process(1, os.getpid)))
+        thread.start()
+        thread.join()
+
+        success, value, _ = results[0]
+        self.assertTrue(success)
+        self.assertNotEqual(value, os.getpid())
+
+    def test_mock(self):
+        mock = cse40.utils.Mock()
+
+        mock.plot([1, 2], color = 'red')
+        mock.figure().add_subplot(1, 2)['a']
+        mock(3)
+
+        self.assertEqual(mock.attribute_history, ['plot', 'figure', 'add_subplot'])
+        self.assertEqual(mock.item_history, ['a'])
+        self.assertEqual(len(mock.call_history), 4)
+
+        self.assertEqual(mock.mock_get_call_count(), 4)
+        self.assertEqual(mock.mock_get_call_count('plot'), 1)
+        self.assertEqual(mock.mock_get_call_count(None), 4)
+        self.assertEqual(mock.mock_get_attribute_count('figure'), 1)
+        self.assertEqual(mock.mock_get_item_count('a'), 1)
+
+        self.assertTrue(mock.mock_was_called_with('plot', [1, 2], color = 'red'))
+        self.assertFalse(mock.mock_was_called_with('plot', [1, 2]))
+        self.assertEqual(mock.mock_get_calls('add_subplot'), [((1, 2), {})])
+        self.assertEqual(mock.mock_get_calls(None), [((3, ), {})])
+
+    def test_mock_bounded(self):
+        for history_size in (0, 5):
+            mock = cse40.utils.Mock(history_size = history_size)
+
+            for i in range(1000):
+                mock.plot(i)[i]
+
+            self.assertEqual(len(mock.call_history), history_size)
+            self.assertEqual(len(mock.attribute_history), history_size)
+            self.assertEqual(len(mock.item_history), history_size)
+
+            self.assertEqual(mock.mock_get_call_count('plot'), 1000)
+            self.assertEqual(mock.mock_get_attribute_count(), 1000)
+            self.assertEqual(mock.mock_get_item_count(), 1000)
+
+            self.assertEqual(mock.mock_was_called_with('plot', 999), (history_size > 0))
+            self.assertFalse(mock.mock_was_called_with('plot', 0))
+
+            self.assertIn('(%d more)' % (1000 - history_size), repr(mock))
+
+    def test_mock_repr(self):
+        mock = cse40.utils.Mock()
+        for i in range(1000):
+            mock.plot(i)
+
+        text = repr(mock)
+        self.assertIn('(990 more)', text)
+        self.assertLess(len(text), 1000)
+
+    def test_workspace(self):
+        with cse40.utils.Workspace() as outer:
+            outer_path = cse40.utils.get_temp_path(suffix = '.txt')
+            with open(outer_path, 'w') as file:
+                file.write('outer')
+
+            with cse40.utils.Workspace(in_memory = True) as inner:
+                self.assertIs(cse40.utils.get_workspace(), inner)
+
+                inner_path = cse40.utils.get_temp_path()
+                os.makedirs(inner_path)
+
+            self.assertFalse(os.path.exists(inner_path))
+            self.assertTrue(os.path.exists(outer_path))
+            self.assertIs(cse40.utils.get_workspace(), outer)
+
+        self.assertFalse(os.path.exists(outer_path))
+        self.assertFalse(os.path.exists(os.path.dirname(outer_path)))
+
+        # Outside of a workspace, paths share the single process-wide workspace.
+        path = cse40.utils.get_temp_path()
+        self.assertIs(cse40.utils.get_workspace(), cse40.utils.get_workspace())
+        self.assertEqual(os.path.dirname(path), cse40.utils.get_workspace().path)
+
+    def test_workspace_unused(self):
+        # The directory is made up front (so forked children share it), and removed on exit.
+        with cse40.utils.Workspace() as workspace:
+            path = workspace.path
+            self.assertTrue(os.path.isdir(path))
+
+        self.assertIsNone(workspace.path)
+        self.assertFalse(os.path.exists(path))
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'Processes are only used on Linux.')
+    def test_workspace_child(self):
+        def make_temp_file():
+            path = cse40.utils.get_temp_path(suffix = '.txt')
+            with open(path, 'w') as file:
+                file.write('child')
+
+            return path
+
+        # Paths made in a child are removed with the parent's workspace.
+        with cse40.utils.Workspace() as workspace:
+            success, path = cse40.utils.invoke_with_timeout(5, make_temp_file)
+
+            self.assertTrue(success)
+            self.assertEqual(os.path.dirname(path), workspace.path)
+            self.assertTrue(os.path.exists(path))
+
+        self.assertFalse(os.path.exists(path))
+
+        # Outside of a workspace, they go in the process-wide workspace (removed on exit).
+        success, path = cse40.utils.invoke_with_timeout(5, make_temp_file)
+
+        self.assertTrue(success)
+        self.assertEqual(os.path.dirname(path), cse40.utils.get_workspace().path)
+
+def _wait_for(condition, timeout = 5.0):
+    end_time = time.time() + timeout
+    while (time.time() < end_time):
+        if (condition()):
+            return True
+
+        time.sleep(0.05)
+
+    return condition()
+
+def _is_running(pid):
+    # A zombie (waiting on a reparented parent to reap it) is no longer running.
+    try:
+        with open('/proc/%d/stat' % (pid), 'r') as file:
+            state = file.read().rsplit(')', 1)[1].split()[0]
+    except OSError:
+        return False
+
+    return (state != 'Z')